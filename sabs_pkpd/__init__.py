@@ -1,3 +1,13 @@
+from . import ragged_array
+from . import simulation_pool
+from . import simulation_cache
+from . import chain_store
+from . import convergence
+from . import delayed_acceptance
+from . import kde
+from . import chain_analysis
+from . import fit_stats
+from . import decimation
 from . import load_data
 from . import run_model
 from . import pints_problem_def
@@ -0,0 +1,377 @@
+import collections
+import itertools
+
+import numpy as np
+
+
+def read_chain_chunks(source, chunk_size=10000, start=0):
+    """
+    Reads one MCMC chain in chunks of iterations, so that chains larger than
+    the memory can be analysed.
+
+    :param source: str or array
+        Path to a CSV file of the chain written by PINTS (see
+        MCMC_routine(chain_filename=...)), to a .npy file of shape
+        (n_iterations, n_parameters), or an object indexable along the
+        iterations like a numpy.array, for instance one chain of a
+        sabs_pkpd.chain_store.LazyChains.
+    :param chunk_size: int
+        Number of iterations per chunk. 10000 if not specified.
+    :param start: int
+        Number of iterations skipped at the start of the chain, for instance
+        the exploratory phase. 0 if not specified.
+    :return: Generator of numpy.array of shape (chunk length, n_parameters)
+    """
+    if chunk_size < 1:
+        raise ValueError('The chunk size must be at least 1. Got ' +
+                         str(chunk_size))
+    if isinstance(source, str) and source.endswith('.npy'):
+        source = np.load(source, mmap_mode='r')
+
+    if isinstance(source, str):
+        with open(source) as f:
+            # Header of the parameter names, and skipped iterations
+            collections.deque(itertools.islice(f, start + 1), maxlen=0)
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if not lines:
+                    break
+                yield np.loadtxt(lines, delimiter=',', ndmin=2)
+    else:
+        for i in range(start, len(source), chunk_size):
+            yield np.asarray(source[i:i + chunk_size], dtype=np.float64)
+
+
+class TDigest():
+    """
+    Sketch of a distribution estimating its quantiles in a single pass over
+    the samples, in the spirit of the merging t-digest (Dunning and Ertl,
+    2019). The samples are summarised by weighted centroids, which are small
+    in the tails and larger in the bulk of the distribution, so that the
+    extreme quantiles stay accurate.
+
+    Attributes
+    ----------
+    compression : float
+        Number of centroids kept is of the order of compression / 2.
+    n_samples : float
+        Total weight of the samples received.
+    """
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.n_samples = 0
+        self._means = np.zeros(0)
+        self._weights = np.zeros(0)
+        self._min = np.inf
+        self._max = -np.inf
+
+    def update(self, x):
+        """
+        Adds samples to the sketch.
+
+        :param x: numpy.array
+            Samples.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if len(x) == 0:
+            return
+        self._min = min(self._min, np.min(x))
+        self._max = max(self._max, np.max(x))
+        means = np.concatenate([self._means, x])
+        weights = np.concatenate([self._weights, np.ones(len(x))])
+        order = np.argsort(means, kind='stable')
+        means = means[order]
+        weights = weights[order]
+        self.n_samples += len(x)
+
+        # Centroids whose centre falls in the same unit of the k1 scale
+        # function are merged
+        cumulated = np.cumsum(weights)
+        q = (cumulated - weights / 2) / cumulated[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        group = np.floor(k)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(group)) + 1])
+        self._weights = np.add.reduceat(weights, starts)
+        self._means = np.add.reduceat(means * weights, starts) / self._weights
+
+    def quantile(self, q):
+        """
+        Returns the estimated quantiles q (between 0 and 1) of the samples.
+        """
+        if self.n_samples == 0:
+            raise ValueError('The sketch does not contain any sample')
+        cumulated = np.cumsum(self._weights) - self._weights / 2
+        positions = np.concatenate([[0], cumulated, [self.n_samples]])
+        values = np.concatenate([[self._min], self._means, [self._max]])
+        return np.interp(np.asarray(q) * self.n_samples, positions, values)
+
+
+class ChainSummary():
+    """
+    This class summarises one MCMC chain in a single pass over chunks of
+    iterations, in constant memory: mean, covariance, histograms and
+    quantiles of the parameters, and a downsampled trace.
+
+    Each histogram has n_bins bins covering the range of the samples
+    received. When a sample falls outside of it, pairs of bins are merged so
+    that the bins are twice as wide and the range twice as long. The trace
+    keeps one iteration every stride iterations, and the stride doubles when
+    more than 2 * trace_points iterations are kept.
+
+    The summaries can be passed to plot_distribution_parameters and
+    plot_MCMC_convergence instead of the chains.
+
+    Attributes
+    ----------
+    n_parameters : int
+        Number of parameters sampled.
+    n_samples : int
+        Number of iterations received.
+    first_iteration : int
+        Iteration of the chain of the first sample received.
+    stride : int
+        Number of iterations between two iterations of the trace.
+    """
+    def __init__(self, n_parameters, n_bins=1024, compression=200,
+                 trace_points=1000, first_iteration=0):
+        """
+        :param n_parameters: int
+            Number of parameters sampled.
+        :param n_bins: int
+            Number of bins of the histograms. Must be even. 1024 if not
+            specified.
+        :param compression: float
+            Compression of the quantile sketches, see TDigest. 200 if not
+            specified.
+        :param trace_points: int
+            Minimal number of iterations kept in the trace once 2 *
+            trace_points iterations were received. 1000 if not specified.
+        :param first_iteration: int
+            Iteration of the chain of the first sample, for instance the
+            number of iterations skipped. 0 if not specified.
+        """
+        if n_bins < 2 or n_bins % 2 != 0:
+            raise ValueError('The number of bins must be even. Got ' +
+                             str(n_bins))
+        self.n_parameters = n_parameters
+        self.n_samples = 0
+        self.first_iteration = first_iteration
+        self.stride = 1
+        self._mean = np.zeros(n_parameters)
+        self._m2 = np.zeros((n_parameters, n_parameters))
+
+        self._n_bins = n_bins
+        self._bin_low = np.zeros(n_parameters)
+        self._bin_width = np.zeros(n_parameters)
+        self._counts = np.zeros((n_parameters, n_bins))
+        self._digests = [TDigest(compression) for _ in range(n_parameters)]
+
+        self._trace_points = trace_points
+        self._trace_iterations = np.zeros(0, dtype=np.int64)
+        self._trace = np.zeros((0, n_parameters))
+
+    def update(self, samples):
+        """
+        Adds the next iterations of the chain.
+
+        :param samples: numpy.array
+            Array of shape (number of iterations, n_parameters).
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim != 2 or samples.shape[1] != self.n_parameters:
+            raise ValueError('The samples must have shape (number of '
+                             'iterations, ' + str(self.n_parameters) +
+                             '). Got ' + str(samples.shape))
+        n = len(samples)
+        if n == 0:
+            return
+
+        # Chan's update of the mean and the sum of the squared deviations
+        mean = np.mean(samples, axis=0)
+        deviations = samples - mean
+        delta = mean - self._mean
+        total = self.n_samples + n
+        self._m2 += deviations.T @ deviations + \
+            np.outer(delta, delta) * self.n_samples * n / total
+        self._mean += delta * n / total
+
+        for i in range(self.n_parameters):
+            self._update_histogram(i, samples[:, i])
+            self._digests[i].update(samples[:, i])
+
+        iterations = self.n_samples + np.arange(n)
+        kept = iterations % self.stride == 0
+        self._trace_iterations = np.concatenate(
+            [self._trace_iterations, iterations[kept]])
+        self._trace = np.concatenate([self._trace, samples[kept]])
+        while len(self._trace) > 2 * self._trace_points:
+            self.stride *= 2
+            kept = self._trace_iterations % self.stride == 0
+            self._trace_iterations = self._trace_iterations[kept]
+            self._trace = self._trace[kept]
+
+        self.n_samples = total
+
+    def _update_histogram(self, i, x):
+        low = np.min(x)
+        high = np.max(x)
+        if self.n_samples == 0:
+            self._bin_low[i] = low
+            width = (high - low) / self._n_bins
+            self._bin_width[i] = width if width > 0 else \
+                max(abs(low), 1) * 1e-9
+
+        # Double the width of the bins until the range covers the samples
+        half = self._n_bins // 2
+        while low < self._bin_low[i] or high > \
+                self._bin_low[i] + self._n_bins * self._bin_width[i]:
+            merged = self._counts[i].reshape(-1, 2).sum(axis=1)
+            if low < self._bin_low[i]:
+                self._counts[i] = np.concatenate([np.zeros(half), merged])
+                self._bin_low[i] -= self._n_bins * self._bin_width[i]
+            else:
+                self._counts[i] = np.concatenate([merged, np.zeros(half)])
+            self._bin_width[i] *= 2
+
+        index = np.minimum(
+            ((x - self._bin_low[i]) / self._bin_width[i]).astype(np.intp),
+            self._n_bins - 1)
+        self._counts[i] += np.bincount(index, minlength=self._n_bins)
+
+    def mean(self):
+        """
+        Returns the mean of each parameter.
+        """
+        return np.array(self._mean)
+
+    def covariance(self):
+        """
+        Returns the covariance matrix of the parameters.
+        """
+        return self._m2 / (self.n_samples - 1)
+
+    def quantiles(self, q):
+        """
+        Returns the estimated quantiles q of each parameter, of shape
+        (n_parameters, ) + shape of q.
+        """
+        return np.array([digest.quantile(q) for digest in self._digests])
+
+    def histogram(self, i):
+        """
+        Returns the histogram of the i-th parameter, without the empty bins
+        at its ends.
+
+        :return: edges : numpy.array
+            Edges of the bins.
+        :return: counts : numpy.array
+            Number of samples in each bin.
+        """
+        counts = self._counts[i]
+        non_zero = np.flatnonzero(counts)
+        first, last = non_zero[0], non_zero[-1] + 1
+        edges = self._bin_low[i] + \
+            np.arange(first, last + 1) * self._bin_width[i]
+        return edges, counts[first:last]
+
+    def trace(self):
+        """
+        Returns the downsampled trace of the chain.
+
+        :return: iterations : numpy.array
+            Iterations of the chain kept.
+        :return: samples : numpy.array
+            Samples at those iterations, of shape (number of iterations kept,
+            n_parameters).
+        """
+        return self.first_iteration + self._trace_iterations, \
+            np.array(self._trace)
+
+
+def summarise_chain(source, chunk_size=10000, start=0, **kwargs):
+    """
+    Summarises one chain read in chunks, see read_chain_chunks.
+
+    :param source: str or array
+        Chain, see read_chain_chunks.
+    :param chunk_size: int
+        Number of iterations read at once. 10000 if not specified.
+    :param start: int
+        Number of iterations skipped at the start of the chain.
+    :param kwargs:
+        Arguments of ChainSummary.
+    :return: summary : ChainSummary
+    """
+    summary = None
+    for chunk in read_chain_chunks(source, chunk_size, start):
+        if summary is None:
+            summary = ChainSummary(chunk.shape[1], first_iteration=start,
+                                   **kwargs)
+        summary.update(chunk)
+    if summary is None:
+        raise ValueError('The chain does not have more than ' + str(start) +
+                         ' iterations')
+    return summary
+
+
+def summarise_chains(sources, chunk_size=10000, start=0, **kwargs):
+    """
+    Summarises several chains read in chunks.
+
+    :param sources: list or array
+        List of chains (see read_chain_chunks), or chains indexable like a
+        numpy.array of shape (n_chains, n_iterations, n_parameters), for
+        instance sabs_pkpd.chain_store.ChainStore.chains().
+    :param chunk_size: int
+        Number of iterations read at once. 10000 if not specified.
+    :param start: int
+        Number of iterations skipped at the start of each chain.
+    :param kwargs:
+        Arguments of ChainSummary.
+    :return: summaries : list of ChainSummary
+    """
+    return [summarise_chain(sources[i], chunk_size, start, **kwargs)
+            for i in range(len(sources))]
+
+
+def decimate_minmax(x, y, max_points):
+    """
+    Decimates a trace for plotting, keeping its visual envelope: the trace is
+    split into max_points // 2 buckets of consecutive points, and only the
+    minimum and the maximum of each bucket are kept, in their original
+    order, as well as the first and last points.
+
+    :param x: numpy.array
+        Abscissas of the trace, for instance the iterations.
+    :param y: numpy.array
+        Values of the trace.
+    :param max_points: int
+        Maximal number of points kept (apart from the first and last
+        points). If None, or if the trace is shorter, it is not decimated.
+    :return: x, y : numpy.array
+        Decimated trace.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return x, y
+    if max_points < 2:
+        raise ValueError('At least 2 points must be kept. Got ' +
+                         str(max_points))
+
+    # Buckets of equal size, the last one padded
+    size = int(np.ceil(n / (max_points // 2)))
+    n_buckets = int(np.ceil(n / size))
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    starts = np.arange(n_buckets) * size
+    with np.errstate(invalid='ignore'):
+        finite = np.any(np.isfinite(padded), axis=1)
+    padded[~finite, 0] = 0
+    indices = np.concatenate([[0, n - 1],
+                              starts + np.nanargmin(padded, axis=1),
+                              starts + np.nanargmax(padded, axis=1)])
+    indices = np.unique(indices)
+    return x[indices], y[indices]
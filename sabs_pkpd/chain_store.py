@@ -0,0 +1,281 @@
+import glob
+import json
+import os
+import pickle
+
+import numpy as np
+
+
+class ChainStore():
+    """
+    This class stores MCMC chains on disk as a sequence of binary .npy
+    chunks, together with checkpoints of the state of the sampler, so that a
+    long MCMC routine can be resumed after a crash.
+
+    The iterations are appended in memory and written as a new chunk every
+    chunk_size iterations, or when flush() is called. Each chunk holds the
+    samples, of shape (n_chains, chunk length, n_parameters), and the log
+    pdfs, of shape (n_chains, chunk length). Files are written to a temporary
+    name first, so that an interrupted write never leaves a partial chunk or
+    checkpoint.
+
+    Attributes
+    ----------
+    directory : str
+        Directory containing the chunks and the checkpoint.
+    n_chains : int
+        Number of chains.
+    n_parameters : int
+        Number of parameters sampled.
+    chunk_size : int
+        Number of iterations buffered in memory before writing a chunk.
+    """
+    def __init__(self, directory, n_chains=None, n_parameters=None,
+                 chunk_size=1000):
+        """
+        :param directory: str
+            Directory of the store. If it already contains a store, it is
+            opened and n_chains and n_parameters are read from it.
+        :param n_chains: int
+            Number of chains. Required to create a new store.
+        :param n_parameters: int
+            Number of parameters sampled. Required to create a new store.
+        :param chunk_size: int
+            Number of iterations per chunk. 1000 if not specified.
+        """
+        if chunk_size < 1:
+            raise ValueError('The chunk size must be at least 1. Got ' +
+                             str(chunk_size))
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+        meta_filename = os.path.join(directory, 'meta.json')
+        if os.path.isfile(meta_filename):
+            with open(meta_filename) as f:
+                meta = json.load(f)
+            if (n_chains is not None and n_chains != meta['n_chains']) or \
+                    (n_parameters is not None and
+                     n_parameters != meta['n_parameters']):
+                raise ValueError('The chain store in ' + directory + ' has ' +
+                                 str(meta['n_chains']) + ' chains of ' +
+                                 str(meta['n_parameters']) + ' parameters')
+            n_chains = meta['n_chains']
+            n_parameters = meta['n_parameters']
+        else:
+            if n_chains is None or n_parameters is None:
+                raise ValueError('The number of chains and of parameters are '
+                                 'required to create a chain store')
+            os.makedirs(directory, exist_ok=True)
+            self._write(meta_filename, json.dumps(
+                {'n_chains': n_chains, 'n_parameters': n_parameters}).encode())
+
+        self.n_chains = n_chains
+        self.n_parameters = n_parameters
+        self._buffer_samples = []
+        self._buffer_log_pdfs = []
+
+        # Start of each chunk on disk, in increasing order
+        self._chunk_starts = sorted(
+            int(os.path.basename(filename)[len('samples_'):-len('.npy')])
+            for filename in glob.glob(os.path.join(directory,
+                                                   'samples_*.npy')))
+        self._n_stored = 0
+        if self._chunk_starts:
+            last = np.load(self._chunk_filename('samples',
+                                                self._chunk_starts[-1]),
+                           mmap_mode='r')
+            self._n_stored = self._chunk_starts[-1] + last.shape[1]
+
+    def _write(self, filename, data):
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+
+    def _save_array(self, filename, array):
+        tmp_filename = filename + '.tmp.npy'
+        np.save(tmp_filename, array)
+        os.replace(tmp_filename, filename)
+
+    def _chunk_filename(self, name, start):
+        return os.path.join(self.directory,
+                            name + '_' + '%012d' % start + '.npy')
+
+    def n_iterations(self):
+        """
+        Returns the number of iterations stored, including the ones not
+        written to disk yet.
+        """
+        return self._n_stored + len(self._buffer_samples)
+
+    def append(self, samples, log_pdfs):
+        """
+        Appends one iteration to the chains.
+
+        :param samples: numpy.array
+            Array of shape (n_chains, n_parameters).
+        :param log_pdfs: numpy.array
+            Array of length n_chains.
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.shape != (self.n_chains, self.n_parameters):
+            raise ValueError('The samples must have shape ' +
+                             str((self.n_chains, self.n_parameters)) +
+                             '. Got ' + str(samples.shape))
+        self._buffer_samples.append(samples)
+        self._buffer_log_pdfs.append(np.asarray(log_pdfs, dtype=np.float64))
+        if len(self._buffer_samples) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the iterations buffered in memory as a new chunk.
+        """
+        if not self._buffer_samples:
+            return
+        start = self._n_stored
+        # The samples are written last: a chunk exists once they are written
+        self._save_array(self._chunk_filename('log_pdfs', start),
+                         np.stack(self._buffer_log_pdfs, axis=1))
+        self._save_array(self._chunk_filename('samples', start),
+                         np.stack(self._buffer_samples, axis=1))
+        self._chunk_starts.append(start)
+        self._n_stored += len(self._buffer_samples)
+        self._buffer_samples = []
+        self._buffer_log_pdfs = []
+
+    def checkpoint(self, state):
+        """
+        Writes the buffered iterations, then saves state as the checkpoint
+        matching the iterations stored.
+
+        :param state: object
+            Picklable state of the sampler.
+        """
+        self.flush()
+        self._write(os.path.join(self.directory, 'checkpoint.pickle'),
+                    pickle.dumps((self._n_stored, state)))
+
+    def load_checkpoint(self):
+        """
+        Returns the state saved by the last checkpoint, and discards the
+        iterations stored after it. If no checkpoint was saved, all the
+        iterations are discarded and None is returned.
+        """
+        filename = os.path.join(self.directory, 'checkpoint.pickle')
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                n_iterations, state = pickle.load(f)
+        else:
+            n_iterations, state = 0, None
+
+        # Chunks are always flushed at checkpoints, so the chunks written
+        # after the checkpoint can be deleted as a whole
+        self._buffer_samples = []
+        self._buffer_log_pdfs = []
+        while self._chunk_starts and self._chunk_starts[-1] >= n_iterations:
+            start = self._chunk_starts.pop()
+            os.remove(self._chunk_filename('samples', start))
+            os.remove(self._chunk_filename('log_pdfs', start))
+        self._n_stored = n_iterations
+        return state
+
+    def _load_chunks(self, name):
+        self.flush()
+        return [np.load(self._chunk_filename(name, start), mmap_mode='r')
+                for start in self._chunk_starts]
+
+    def chains(self):
+        """
+        Returns the samples as a LazyChains of shape (n_chains,
+        n_iterations, n_parameters), read from disk when indexed.
+        """
+        return LazyChains(self._load_chunks('samples'))
+
+    def log_pdfs(self):
+        """
+        Returns the log pdfs as a LazyChains of shape (n_chains,
+        n_iterations), read from disk when indexed.
+        """
+        return LazyChains(self._load_chunks('log_pdfs'))
+
+
+class LazyChains():
+    """
+    Read-only view on chains stored in chunks along the iterations. It can
+    be indexed like a numpy.array of shape (n_chains, n_iterations, ...), and
+    only the chunks and values indexed are read from disk.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the chains.
+    """
+    def __init__(self, chunks, chain=None):
+        """
+        :param chunks: list
+            Arrays (or memory-mapped arrays) of shape (n_chains, chunk
+            length, ...).
+        :param chain: int
+            If provided, the view is restricted to this chain.
+        """
+        self._chunks = chunks
+        self._chain = chain
+        self._starts = np.cumsum([0] + [chunk.shape[1] for chunk in chunks])
+        if chunks:
+            shape = (chunks[0].shape[0], int(self._starts[-1])) + \
+                chunks[0].shape[2:]
+        else:
+            shape = (0, 0)
+        if chain is not None:
+            shape = shape[1:]
+        self.shape = shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        if self._chain is not None:
+            key = (self._chain, ) + key
+        elif isinstance(key[0], (int, np.integer)) and len(key) == 1:
+            # View on a single chain, read when indexed further
+            if not -self.shape[0] <= key[0] < self.shape[0]:
+                raise IndexError('LazyChains index out of range')
+            return LazyChains(self._chunks, key[0] % self.shape[0])
+
+        chain_key = key[0]
+        iteration_key = key[1] if len(key) > 1 else slice(None)
+        other_key = key[2:]
+        # Axis of the iterations once the chains are indexed
+        axis = 0 if isinstance(chain_key, (int, np.integer)) else 1
+
+        iterations = np.arange(self._starts[-1])[iteration_key]
+        single_iteration = np.ndim(iterations) == 0
+        iterations = np.atleast_1d(iterations)
+        if not self._chunks:
+            raise IndexError('LazyChains index out of range')
+
+        # Read the requested iterations chunk by chunk, in the requested order
+        chunk_index = np.searchsorted(self._starts, iterations,
+                                      side='right') - 1
+        splits = np.flatnonzero(np.diff(chunk_index)) + 1
+        parts = [np.take(self._chunks[0][chain_key],
+                         np.array([], dtype=np.intp), axis=axis)]
+        for run in np.split(np.arange(len(iterations)), splits):
+            if len(run) == 0:
+                continue
+            c = chunk_index[run[0]]
+            parts.append(np.take(self._chunks[c][chain_key],
+                                 iterations[run] - self._starts[c],
+                                 axis=axis))
+        values = np.concatenate(parts, axis=axis)
+
+        if single_iteration:
+            values = np.take(values, 0, axis=axis)
+            return values[(slice(None), ) * axis + other_key]
+        return values[(slice(None), ) * (axis + 1) + other_key]
@@ -49,13 +49,13 @@ def get_steady_state(s,
     """
 
     # test types of variables provided
-    if type(s) != myokit._sim.cvodesim.Simulation:
+    if not isinstance(s, myokit.Simulation):
         if type(s) != list:
             raise ValueError('s should be provided as a myokit.Simulation or '
                              'list of myokit.Simulation')
         else:
             for j in range(len(s)):
-                if type(s[j]) != myokit._sim.cvodesim.Simulation:
+                if not isinstance(s[j], myokit.Simulation):
                     raise ValueError('s should be provided as a '
                                      'myokit.Simulation or list of '
                                      'myokit.Simulation')
@@ -74,7 +74,7 @@ def get_steady_state(s,
             steady_state = []
             for i in range(len(s)):
                 s[i].reset()
-                s[i].run(time_to_steady_state)
+                s[i].run(time_to_steady_state, log=myokit.LOG_NONE)
                 steady_state.append([s[i].state()])
                 s[i].set_default_state(steady_state[i][0])
 
@@ -89,7 +89,7 @@ def get_steady_state(s,
                     s[i].set_constant(
                         data_exp.fitting_instructions.exp_cond_param_annot,
                         data_exp.exp_conds[j])
-                    s[i].run(time_to_steady_state)
+                    s[i].run(time_to_steady_state, log=myokit.LOG_NONE)
                     model_ss.append(s[i].state())
                 steady_state.append(model_ss)
 
@@ -98,7 +98,7 @@ def get_steady_state(s,
         if data_exp is None:
             # In case particular experimental conditions are not specified
             s.reset()
-            s.run(time_to_steady_state)
+            s.run(time_to_steady_state, log=myokit.LOG_NONE)
             steady_state = [[s.state()]]
             s.set_default_state(steady_state[0][0])
         else:
@@ -110,7 +110,7 @@ def get_steady_state(s,
                 s.set_constant(
                     data_exp.fitting_instructions.exp_cond_param_annot,
                     data_exp.exp_conds[i])
-                s.run(time_to_steady_state)
+                s.run(time_to_steady_state, log=myokit.LOG_NONE)
                 steady_state[0].append(s.state())
 
     # Set the save of the models if relevant
@@ -2,6 +2,7 @@ import sabs_pkpd
 
 n = 2
 
+# myokit.Simulation, or sabs_pkpd.simulation_pool.SimulationPool
 s = []
 
 default_state = None
@@ -10,6 +11,16 @@ data_exp = sabs_pkpd.load_data.Data_exp([], [], [], [])
 
 pre_run = 0
 
+condition_pool = None
+
+pre_run_cache = None
+
+# sabs_pkpd.run_model.SimulationMemo used by MyModel, if any
+simulation_memo = None
+
+# sabs_pkpd.fit_stats.FitStats recording the fit, if any
+fit_stats = None
+
 protocol_optimisation_instructions = []
 
 
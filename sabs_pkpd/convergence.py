@@ -0,0 +1,164 @@
+import numpy as np
+
+
+class OnlineConvergence():
+    """
+    This class computes the convergence diagnostics of MCMC chains while
+    they are sampled, in constant memory: the split R-hat (see pints.rhat)
+    and the effective sample size (ESS) of each parameter.
+
+    The samples of each chain are summarised in batches of equal size. Each
+    batch only keeps its mean and sum of squared deviations, and pairs of
+    batches are merged when the number of batches reaches 2 * n_batches, so
+    that between n_batches and 2 * n_batches batches are kept. The split
+    R-hat compares the first and second halves of the batches of each chain,
+    and the ESS is estimated with the batch means method.
+
+    Attributes
+    ----------
+    n_chains : int
+        Number of chains.
+    n_parameters : int
+        Number of parameters sampled.
+    n_samples : int
+        Number of samples of each chain received.
+    batch_size : int
+        Number of samples per batch.
+    """
+    def __init__(self, n_chains, n_parameters, n_batches=16):
+        """
+        :param n_chains: int
+            Number of chains.
+        :param n_parameters: int
+            Number of parameters sampled.
+        :param n_batches: int
+            Minimal number of batches kept once 2 * n_batches samples were
+            received. 16 if not specified.
+        """
+        if n_batches < 2:
+            raise ValueError('The number of batches must be at least 2. Got '
+                             + str(n_batches))
+        self.n_chains = n_chains
+        self.n_parameters = n_parameters
+        self.n_samples = 0
+        self.batch_size = 1
+        self._n_batches = n_batches
+        self._n_full = 0
+        self._means = np.zeros((2 * n_batches, n_chains, n_parameters))
+        self._m2s = np.zeros((2 * n_batches, n_chains, n_parameters))
+
+        # Batch being filled
+        self._count = 0
+        self._mean = np.zeros((n_chains, n_parameters))
+        self._m2 = np.zeros((n_chains, n_parameters))
+
+    def update(self, samples):
+        """
+        Adds one sample to each chain.
+
+        :param samples: numpy.array
+            Array of shape (n_chains, n_parameters).
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        self.n_samples += 1
+
+        # Welford update of the batch being filled
+        self._count += 1
+        delta = samples - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (samples - self._mean)
+
+        if self._count == self.batch_size:
+            self._means[self._n_full] = self._mean
+            self._m2s[self._n_full] = self._m2
+            self._n_full += 1
+            self._count = 0
+            self._mean = np.zeros_like(self._mean)
+            self._m2 = np.zeros_like(self._m2)
+
+            if self._n_full == 2 * self._n_batches:
+                self._merge_batches()
+
+    def _merge_batches(self):
+        first = self._means[0::2]
+        second = self._means[1::2]
+        n = self.batch_size
+        self._m2s[:self._n_batches] = self._m2s[0::2] + self._m2s[1::2] + \
+            (second - first) ** 2 * n / 2
+        self._means[:self._n_batches] = (first + second) / 2
+        self._n_full = self._n_batches
+        self.batch_size *= 2
+
+    def _combine(self, counts, means, m2s):
+        # Combines the statistics of groups of samples (along the first axis)
+        counts = np.asarray(counts, dtype=np.float64).reshape(
+            (-1, ) + (1, ) * (means.ndim - 1))
+        count = np.sum(counts)
+        mean = np.sum(counts * means, axis=0) / count
+        m2 = np.sum(m2s + counts * (means - mean) ** 2, axis=0)
+        return count, mean, m2
+
+    def rhat(self):
+        """
+        Returns the split R-hat of each parameter, nan if fewer than 2
+        batches were completed.
+        """
+        if self._n_full < 2:
+            return np.full(self.n_parameters, np.nan)
+
+        # First half of the batches, and second half with the batch being
+        # filled
+        half = self._n_full // 2
+        halves = [self._combine([self.batch_size] * half,
+                                self._means[:half],
+                                self._m2s[:half])]
+        counts = [self.batch_size] * (self._n_full - half)
+        means = self._means[half:self._n_full]
+        m2s = self._m2s[half:self._n_full]
+        if self._count > 0:
+            counts.append(self._count)
+            means = np.concatenate([means, self._mean[np.newaxis]])
+            m2s = np.concatenate([m2s, self._m2[np.newaxis]])
+        halves.append(self._combine(counts, means, m2s))
+
+        n = np.mean([count for count, mean, m2 in halves])
+        chain_means = np.concatenate([mean for count, mean, m2 in halves])
+        chain_variances = np.concatenate([m2 / (count - 1)
+                                          for count, mean, m2 in halves])
+        w = np.mean(chain_variances, axis=0)
+        b = n * np.var(chain_means, axis=0, ddof=1)
+        return np.sqrt(((n - 1) / n * w + b / n) / w)
+
+    def ess(self):
+        """
+        Returns the effective sample size of each parameter, summed over the
+        chains and estimated from the completed batches. 0 if fewer than 2
+        batches were completed.
+        """
+        if self._n_full < 2:
+            return np.zeros(self.n_parameters)
+
+        means = self._means[:self._n_full]
+        count, mean, m2 = self._combine([self.batch_size] * self._n_full,
+                                        means, self._m2s[:self._n_full])
+        variance = m2 / (count - 1)
+        # Variance of the mean estimated from the batch means
+        batch_variance = self.batch_size * np.var(means, axis=0, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ess = np.where(batch_variance > 0,
+                           count * variance / batch_variance,
+                           count)
+        return np.sum(ess, axis=0)
+
+    def has_converged(self, rhat_threshold=None, ess_target=None):
+        """
+        Returns whether the R-hat of every parameter is below rhat_threshold
+        and the ESS of every parameter is above ess_target. Criteria not
+        provided are not checked.
+        """
+        converged = True
+        if rhat_threshold is not None:
+            converged &= bool(np.all(self.rhat() < rhat_threshold))
+        if ess_target is not None:
+            converged &= bool(np.all(self.ess() > ess_target))
+        return converged
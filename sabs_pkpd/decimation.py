@@ -0,0 +1,197 @@
+import numpy as np
+
+import sabs_pkpd
+
+
+class DecimationReport():
+    """
+    This class reports how much the experimental data was decimated by
+    decimate_data_exp, and how well the decimated traces approximate the
+    original ones.
+
+    Attributes
+    ----------
+    n_samples : int
+        Number of time samples before decimation.
+    n_kept : int
+        Number of time samples kept.
+    compression_ratio : float
+        n_samples / n_kept.
+    max_error : numpy.array
+        For each output, maximal absolute difference between the original
+        samples and the decimated traces, linearly interpolated at the
+        original times.
+    rms_error : numpy.array
+        For each output, root mean square of the same differences.
+    """
+    def __init__(self, n_samples, n_kept, max_error, rms_error):
+        self.n_samples = n_samples
+        self.n_kept = n_kept
+        self.compression_ratio = n_samples / max(n_kept, 1)
+        self.max_error = max_error
+        self.rms_error = rms_error
+
+    def __repr__(self):
+        return ('Decimation of ' + str(self.n_samples) + ' samples to ' +
+                str(self.n_kept) + ' (compression ratio ' +
+                str(round(self.compression_ratio, 2)) + '), maximal error ' +
+                str(self.max_error) + ', RMS error ' + str(self.rms_error))
+
+
+def decimate_trace(times, values, tolerance):
+    """
+    Selects the samples of a trace to keep so that the linear interpolation
+    between them stays within tolerance of every sample (Douglas-Peucker
+    algorithm, with the error measured along the values). The samples are
+    kept densely around fast transients and sparsely on plateaus. The first
+    and last samples are always kept.
+
+    The tolerance should be above the noise level of the recording,
+    otherwise most of the noisy samples are kept.
+
+    :param times: numpy.array
+        Increasing sampling times.
+    :param values: numpy.array
+        Values of shape (len(times), ) or (len(times), n_outputs).
+    :param tolerance: float or list
+        Maximal absolute interpolation error, one per output if a list.
+    :return: kept : numpy.array
+        Increasing indices of the samples kept.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(times), -1)
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64),
+                                (values.shape[1], ))
+    if np.any(tolerance <= 0):
+        raise ValueError('The tolerance must be positive. Got ' +
+                         str(tolerance))
+    n = len(times)
+    if n <= 2:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    segments = [(0, n - 1)]
+    while segments:
+        a, b = segments.pop()
+        if b - a < 2:
+            continue
+        duration = times[b] - times[a]
+        if duration > 0:
+            fraction = (times[a + 1:b] - times[a]) / duration
+        else:
+            fraction = np.zeros(b - a - 1)
+        interpolated = values[a] + fraction[:, np.newaxis] * \
+            (values[b] - values[a])
+        error = np.max(np.abs(values[a + 1:b] - interpolated) / tolerance,
+                       axis=1)
+        i = np.argmax(error)
+        if error[i] > 1:
+            split = a + 1 + i
+            keep[split] = True
+            segments.append((a, split))
+            segments.append((split, b))
+    return np.flatnonzero(keep)
+
+
+def decimation_weights(times, kept, weights=None):
+    """
+    Distributes the weight of every sample between the two kept samples
+    surrounding it, proportionally to its proximity to them in time. The
+    weighted sum of squares over the kept samples is then equal to the sum
+    over all the samples when the squared residuals vary linearly between
+    kept samples, and the weights sum to the number of samples.
+
+    :param times: numpy.array
+        Sampling times of all the samples.
+    :param kept: numpy.array
+        Increasing indices of the samples kept, including the first and the
+        last one.
+    :param weights: numpy.array
+        Weights of all the samples. 1 if not specified.
+    :return: kept_weights : numpy.array
+        Weight of each kept sample.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(len(times))
+    if len(kept) == len(times):
+        return np.array(weights, dtype=np.float64)
+    segment = np.searchsorted(kept, np.arange(len(times)), side='right') - 1
+    segment = np.minimum(segment, len(kept) - 2)
+    start = times[kept[segment]]
+    duration = times[kept[segment + 1]] - start
+    fraction = np.divide(times - start, duration,
+                         out=np.zeros(len(times)), where=duration > 0)
+    fraction = np.clip(fraction, 0, 1)
+    kept_weights = np.bincount(segment, weights=weights * (1 - fraction),
+                               minlength=len(kept))
+    kept_weights += np.bincount(segment + 1, weights=weights * fraction,
+                                minlength=len(kept))
+    return kept_weights
+
+
+def decimate_data_exp(data_exp, tolerance):
+    """
+    Decimates each experiment of data_exp adaptively with decimate_trace,
+    and weights the samples kept with decimation_weights, so that the
+    weighted sum of squares and Gaussian log likelihood computed on the
+    decimated data approximate the ones of the full data. Fitting the
+    decimated data simulates and compares the model at the kept times only.
+
+    :param data_exp: Data_exp
+        Experimental data. If it already has weights, they are distributed
+        to the kept samples.
+    :param tolerance: float or list
+        Maximal absolute interpolation error of the decimated traces, one
+        per output if a list.
+    :return: decimated, report : tuple
+        The decimated Data_exp, with the same experiments, conditions and
+        fitting instructions, and a DecimationReport.
+    """
+    kept_indices = []
+    kept_weights = []
+    squared_errors = 0
+    max_error = 0
+    for k in range(len(data_exp.times)):
+        times = np.asarray(data_exp.times[k])
+        values = np.asarray(data_exp.values[k]).reshape(len(times), -1)
+        weights = None
+        if data_exp.weights is not None:
+            weights = data_exp.weights[k]
+        kept = decimate_trace(times, values, tolerance)
+        kept_indices.append(kept)
+        kept_weights.append(decimation_weights(times, kept, weights))
+
+        error = np.abs(values - np.column_stack(
+            [np.interp(times, times[kept], values[kept, j])
+             for j in range(values.shape[1])]))
+        if len(times) > 0:
+            max_error = np.maximum(max_error, np.max(error, axis=0))
+            squared_errors = squared_errors + np.sum(error ** 2, axis=0)
+
+    lengths = [len(kept) for kept in kept_indices]
+    rows = np.concatenate([kept + data_exp.offsets[k]
+                           for k, kept in enumerate(kept_indices)] +
+                          [np.zeros(0, dtype=np.intp)]).astype(np.intp)
+    times = sabs_pkpd.ragged_array.RaggedArray(
+        lengths, flat=data_exp.times.flat[rows])
+    values = sabs_pkpd.ragged_array.RaggedArray(
+        lengths, flat=data_exp.values.flat[rows])
+    weights = sabs_pkpd.ragged_array.RaggedArray(
+        lengths, flat=np.concatenate(kept_weights + [np.zeros(0)]))
+    decimated = sabs_pkpd.load_data.Data_exp(times,
+                                             values,
+                                             data_exp.exp_nums,
+                                             data_exp.exp_conds,
+                                             data_exp.experiment_conds,
+                                             weights=weights)
+    decimated.fitting_instructions = data_exp.fitting_instructions
+
+    n_samples = len(data_exp.times.flat)
+    rms_error = np.sqrt(squared_errors / max(n_samples, 1))
+    report = DecimationReport(n_samples, len(rows),
+                              np.atleast_1d(max_error),
+                              np.atleast_1d(rms_error))
+    return decimated, report
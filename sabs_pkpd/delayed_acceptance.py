@@ -0,0 +1,258 @@
+import numpy as np
+
+
+class QuadraticSurrogate():
+    """
+    Quadratic polynomial regression of a function of the parameters, fitted
+    by least squares. It is used as a cheap surrogate of the log-likelihood.
+
+    Attributes
+    ----------
+    n_parameters : int
+        Number of parameters.
+    """
+    def __init__(self, n_parameters):
+        self.n_parameters = n_parameters
+        self._coefficients = None
+        self._center = None
+        self._scale = None
+
+    def n_features(self):
+        """
+        Returns the number of coefficients of the polynomial.
+        """
+        d = self.n_parameters
+        return 1 + d + d * (d + 1) // 2
+
+    def _features(self, x):
+        z = (np.atleast_2d(x) - self._center) / self._scale
+        i, j = np.triu_indices(self.n_parameters)
+        return np.hstack([np.ones((len(z), 1)), z, z[:, i] * z[:, j]])
+
+    def is_fitted(self):
+        return self._coefficients is not None
+
+    def fit(self, x, f):
+        """
+        Fits the polynomial to the values f at the points x.
+
+        :param x: numpy.array
+            Array of shape (number of points, n_parameters).
+        :param f: numpy.array
+            Values of the function at the points.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        self._center = np.mean(x, axis=0)
+        self._scale = np.std(x, axis=0)
+        self._scale[self._scale == 0] = 1
+        self._coefficients = np.linalg.lstsq(self._features(x),
+                                             np.asarray(f), rcond=None)[0]
+
+    def __call__(self, x):
+        return float((self._features(x) @ self._coefficients)[0])
+
+
+class DelayedAcceptanceMCMC():
+    """
+    Delayed-acceptance Metropolis sampler (Christen and Fox, 2005), with an
+    adaptive Gaussian random walk proposal.
+
+    Each proposal is first screened with a cheap surrogate of the
+    log-likelihood, trained on the log-likelihoods already computed. The
+    log-likelihood is only computed for the proposals accepted by the
+    surrogate, and a second acceptance step corrects for the error of the
+    surrogate, so that the chain samples the exact posterior.
+
+    During the initial phase, the sampler is a Metropolis sampler whose
+    proposal covariance and scale are adapted as in pints.HaarioBardenetACMC,
+    and every log-likelihood computed is kept to train the surrogate. At the
+    end of the initial phase, the surrogate is fitted to the most recent
+    evaluations, and both the proposal and the surrogate are frozen so that
+    the chain is exactly reversible afterwards.
+
+    The agreement between the surrogate and the full model is the fraction
+    of the proposals accepted by the surrogate which are also accepted by
+    the second step. It is close to 1 when the surrogate is accurate.
+
+    Attributes
+    ----------
+    n_proposals : int
+        Number of proposals.
+    n_screened_out : int
+        Number of proposals rejected by the surrogate, without computing the
+        log-likelihood.
+    n_evaluations : int
+        Number of log-likelihood evaluations.
+    n_second_stage : int
+        Number of proposals accepted by the surrogate, and evaluated.
+    n_second_stage_accepted : int
+        Number of those proposals accepted by the second step.
+    """
+    def __init__(self, log_posterior, x0, sigma0=None, max_points=500):
+        """
+        :param log_posterior: pints.LogPosterior
+            Posterior to sample. Only its log-likelihood is approximated by
+            the surrogate.
+        :param x0: numpy.array
+            Starting point.
+        :param sigma0: numpy.array
+            Standard deviations or covariance matrix of the initial proposal.
+            If not specified, |x0| / 10.
+        :param max_points: int
+            Number of evaluations of the end of the initial phase used to fit
+            the surrogate. 500 if not specified.
+        """
+        self._log_likelihood = log_posterior.log_likelihood()
+        self._log_prior = log_posterior.log_prior()
+        self._x = np.array(x0, dtype=np.float64)
+        if sigma0 is None:
+            sigma0 = np.abs(self._x) / 10
+            sigma0[sigma0 == 0] = 1
+        sigma0 = np.asarray(sigma0, dtype=np.float64)
+        self._cov = np.diag(sigma0 ** 2) if sigma0.ndim == 1 else sigma0
+        self._mean = np.array(self._x)
+        self._log_lambda = 0
+        self._n_adapt = 0
+
+        self._prior_x = self._log_prior(self._x)
+        self._likelihood_x = self._log_likelihood(self._x)
+        if not np.isfinite(self._prior_x + self._likelihood_x):
+            raise ValueError('The log posterior must be finite at the '
+                             'starting point')
+
+        self._surrogate = QuadraticSurrogate(len(self._x))
+        self._max_points = max_points
+        self._points = [np.array(self._x)]
+        self._values = [self._likelihood_x]
+        self._surrogate_x = None
+        self._initial_phase = True
+
+        self.n_proposals = 0
+        self.n_screened_out = 0
+        self.n_evaluations = 1
+        self.n_second_stage = 0
+        self.n_second_stage_accepted = 0
+
+    def needs_initial_phase(self):
+        return True
+
+    def needs_sensitivities(self):
+        return False
+
+    def set_initial_phase(self, initial_phase):
+        """
+        Enables or disables the initial phase. The surrogate is fitted when
+        the initial phase ends.
+        """
+        self._initial_phase = bool(initial_phase)
+        if not self._initial_phase and not self._surrogate.is_fitted() and \
+                len(self._points) >= 2 * self._surrogate.n_features():
+            # Only the points in the bulk of the posterior are fitted, far
+            # points would distort the quadratic
+            values = np.array(self._values)
+            bulk = values >= np.max(values) - 4 * len(self._x)
+            if np.sum(bulk) < 2 * self._surrogate.n_features():
+                bulk[:] = True
+            self._surrogate.fit(np.array(self._points)[bulk], values[bulk])
+            self._surrogate_x = self._surrogate(self._x)
+            self._points = []
+            self._values = []
+
+    def agreement(self):
+        """
+        Returns the fraction of the proposals accepted by the surrogate which
+        are also accepted by the full model. nan if the surrogate was not
+        used yet.
+        """
+        if self.n_second_stage == 0:
+            return np.nan
+        return self.n_second_stage_accepted / self.n_second_stage
+
+    def _add_point(self, x, likelihood):
+        self._points.append(np.array(x))
+        self._values.append(likelihood)
+        if len(self._points) > self._max_points:
+            del self._points[0]
+            del self._values[0]
+
+    def _adapt(self, accepted):
+        # Adaptation of pints.HaarioBardenetACMC: running mean and covariance
+        # of the chain, and scale of the proposal targeting an acceptance
+        # rate of 0.234
+        self._n_adapt += 1
+        gamma = (self._n_adapt + 1) ** -0.6
+        dx = self._x - self._mean
+        self._mean += gamma * dx
+        self._cov = (1 - gamma) * self._cov + gamma * np.outer(dx, dx)
+        self._log_lambda += gamma * (accepted - 0.234)
+
+    def step(self):
+        """
+        Performs one iteration of the chain.
+
+        :return: x : numpy.array
+            Current position of the chain.
+        :return: log_pdf : float
+            Log posterior at x.
+        """
+        self.n_proposals += 1
+        y = np.random.multivariate_normal(
+            self._x, np.exp(self._log_lambda) * self._cov)
+        prior_y = self._log_prior(y)
+        accepted = False
+        if np.isfinite(prior_y):
+            accepted = self._accept_or_reject(y, prior_y)
+
+        if self._initial_phase:
+            self._adapt(accepted)
+        return np.array(self._x), self._prior_x + self._likelihood_x
+
+    def _accept_or_reject(self, y, prior_y):
+        use_surrogate = self._surrogate.is_fitted()
+        if use_surrogate:
+            # First stage: screen with the surrogate
+            surrogate_y = self._surrogate(y)
+            log_ratio = prior_y + surrogate_y - \
+                self._prior_x - self._surrogate_x
+            if np.log(np.random.uniform()) >= log_ratio:
+                self.n_screened_out += 1
+                return False
+
+        likelihood_y = self._log_likelihood(y)
+        self.n_evaluations += 1
+        if use_surrogate:
+            # Second stage: correct for the error of the surrogate. The prior
+            # was already accounted for in the first stage
+            self.n_second_stage += 1
+            log_ratio = likelihood_y - self._likelihood_x - \
+                (surrogate_y - self._surrogate_x)
+        else:
+            log_ratio = prior_y + likelihood_y - self._prior_x - \
+                self._likelihood_x
+            if np.isfinite(likelihood_y):
+                self._add_point(y, likelihood_y)
+
+        if np.log(np.random.uniform()) >= log_ratio:
+            return False
+        if use_surrogate:
+            self.n_second_stage_accepted += 1
+            self._surrogate_x = surrogate_y
+        self._x = y
+        self._prior_x = prior_y
+        self._likelihood_x = likelihood_y
+        return True
+
+    def __getstate__(self):
+        # The log pdfs are attached again with set_log_posterior, so that
+        # checkpoints do not contain the model
+        state = self.__dict__.copy()
+        state['_log_likelihood'] = None
+        state['_log_prior'] = None
+        return state
+
+    def set_log_posterior(self, log_posterior):
+        """
+        Sets the posterior sampled, after unpickling the sampler.
+        """
+        self._log_likelihood = log_posterior.log_likelihood()
+        self._log_prior = log_posterior.log_prior()
@@ -0,0 +1,145 @@
+import contextlib
+import time
+
+import sabs_pkpd
+
+
+# Phases of the evaluation of a parameter set whose wall time is recorded
+PHASES = ['set_parameters', 'pre_run', 'run', 'output', 'likelihood']
+
+
+class FitStats():
+    """
+    This class records where the time of a fit goes: the wall time spent in
+    each phase of the simulations, the number of simulations and of solver
+    failures, and the number of evaluations of the error measure or log
+    likelihood.
+
+    The phases are:
+        - set_parameters: resetting the simulation and setting the parameters
+          and the experimental condition (FittingPlan.set_parameters),
+        - pre_run: pre-run, or retrieval of its result from the PreRunCache,
+        - run: main s.run of each experimental condition,
+        - output: conversion of the simulation logs to the outputs,
+        - likelihood: whole evaluations of the error measure or log
+          likelihood, including the simulations.
+    The remaining wall time of the fit is spent in PINTS itself.
+
+    Recording is enabled while a FitStats is set as
+    sabs_pkpd.constants.fit_stats, which infer_params and MCMC_routine do
+    when called with return_stats=True. When it is None, the only overhead
+    is a check per phase. Simulations run in other processes (parallel
+    evaluations, ConditionPool workers) are not broken down into phases.
+
+    Attributes
+    ----------
+    times : dict
+        Wall time spent in each phase, in seconds.
+    n_simulations : int
+        Number of experimental conditions simulated.
+    n_failures : int
+        Number of simulations stopped by a myokit.SimulationError.
+    n_evaluations : int
+        Number of evaluations of the error measure or log likelihood.
+    wall_time : float
+        Wall time of the fit, updated by stop().
+    report_interval : float
+        If not None, a summary is printed at most every report_interval
+        seconds, after an evaluation.
+    """
+    def __init__(self, report_interval=None):
+        """
+        :param report_interval: float
+            Minimal time in seconds between two summaries printed during the
+            fit. If not specified, no summary is printed.
+        """
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.n_simulations = 0
+        self.n_failures = 0
+        self.n_evaluations = 0
+        self.wall_time = 0.0
+        self.report_interval = report_interval
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def add(self, phase, start):
+        """
+        Adds the time elapsed since start to phase.
+
+        :param phase: str
+            One of PHASES.
+        :param start: float
+            Value of time.perf_counter() at the start of the phase.
+        :return: now : float
+            Value of time.perf_counter() at the end of the phase, to be used
+            as the start of the next one.
+        """
+        now = time.perf_counter()
+        self.times[phase] += now - start
+        return now
+
+    def add_evaluation(self, start):
+        """
+        Records an evaluation of the error measure or log likelihood started
+        at start, and prints a summary if report_interval has elapsed.
+        """
+        now = self.add('likelihood', start)
+        self.n_evaluations += 1
+        if self.report_interval is not None and \
+                now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.wall_time = now - self._start
+            print(self.summary())
+
+    def stop(self):
+        """
+        Sets wall_time to the time elapsed since the creation of the object.
+        """
+        self.wall_time = time.perf_counter() - self._start
+
+    def summary(self):
+        """
+        Returns a summary of the statistics as a string.
+        """
+        lines = ['Fit statistics after ' + str(round(self.wall_time, 3)) +
+                 ' s: ' + str(self.n_evaluations) + ' evaluations, ' +
+                 str(self.n_simulations) + ' simulations, ' +
+                 str(self.n_failures) + ' solver failures']
+        phases = PHASES + ['pints']
+        times = dict(self.times)
+        times['pints'] = max(self.wall_time - times['likelihood'], 0)
+        for phase in phases:
+            if self.wall_time > 0:
+                share = ' (' + str(round(100 * times[phase] /
+                                         self.wall_time, 1)) + ' %)'
+            else:
+                share = ''
+            lines.append('  ' + phase.ljust(15) +
+                         str(round(times[phase], 3)) + ' s' + share)
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.summary()
+
+
+@contextlib.contextmanager
+def recording(stats):
+    """
+    Sets stats as sabs_pkpd.constants.fit_stats while the context is
+    active, then restores the previous value and stops stats. To use as:
+
+        with sabs_pkpd.fit_stats.recording(FitStats()) as stats:
+            ...
+
+    :param stats: FitStats
+        Statistics to record, or None to record nothing.
+    :return: stats : FitStats
+    """
+    previous = sabs_pkpd.constants.fit_stats
+    sabs_pkpd.constants.fit_stats = stats
+    try:
+        yield stats
+    finally:
+        sabs_pkpd.constants.fit_stats = previous
+        if stats is not None:
+            stats.stop()
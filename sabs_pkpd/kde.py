@@ -0,0 +1,117 @@
+import numpy as np
+
+
+def linear_binning(x, grid_min, grid_max, n_grid, weights=None):
+    """
+    Distributes the samples on a regular grid: each sample is shared
+    between its two neighbouring grid points, proportionally to its
+    proximity to them.
+
+    :param x: numpy.array
+        Samples.
+    :param grid_min: float
+        First point of the grid.
+    :param grid_max: float
+        Last point of the grid.
+    :param n_grid: int
+        Number of grid points.
+    :param weights: numpy.array
+        Number of occurrences of each sample. 1 if not specified.
+    :return: counts : numpy.array
+        Weight of the samples at each grid point, summing to the number of
+        samples.
+    """
+    if n_grid < 2:
+        raise ValueError('The grid must have at least 2 points. Got ' +
+                         str(n_grid))
+    x = np.asarray(x, dtype=np.float64).ravel()
+    if grid_max > grid_min:
+        position = (x - grid_min) / (grid_max - grid_min) * (n_grid - 1)
+    else:
+        position = np.zeros(len(x))
+    position = np.clip(position, 0, n_grid - 1)
+    left = np.minimum(np.floor(position).astype(np.intp), n_grid - 2)
+    right_weight = position - left
+    if weights is None:
+        weights = np.ones(len(x))
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    counts = np.bincount(left, weights=weights * (1 - right_weight),
+                         minlength=n_grid)
+    counts += np.bincount(left + 1, weights=weights * right_weight,
+                          minlength=n_grid)
+    return counts
+
+
+def binned_bandwidth(grid, counts):
+    """
+    Returns the bandwidth of the Gaussian kernel given by Scott's rule (as in
+    scipy.stats.gaussian_kde), computed from binned samples.
+
+    :param grid: numpy.array
+        Regular grid.
+    :param counts: numpy.array
+        Weight of the samples at each grid point, see linear_binning.
+    :return: bandwidth : float
+    """
+    n = np.sum(counts)
+    mean = np.sum(counts * grid) / n
+    variance = np.sum(counts * (grid - mean) ** 2) / (n - 1)
+    return np.sqrt(variance) * n ** (-1 / 5)
+
+
+def binned_kde(x, points, n_grid=1024, bandwidth=None, weights=None):
+    """
+    Estimates the probability density of the samples with a Gaussian kernel
+    density estimate, computed on a regular grid by linear binning of the
+    samples and FFT convolution with the kernel. It costs O(len(x) + n_grid
+    log(n_grid)) instead of O(len(x) * len(points)) for
+    scipy.stats.gaussian_kde, and gives the same density up to the binning
+    error.
+
+    :param x: numpy.array
+        Samples.
+    :param points: numpy.array
+        Points at which the density is evaluated.
+    :param n_grid: int
+        Number of grid points between the minimum and maximum of the
+        samples. 1024 if not specified.
+    :param bandwidth: float
+        Standard deviation of the kernel. If not specified, Scott's rule is
+        applied on the binned samples.
+    :param weights: numpy.array
+        Number of occurrences of each sample, for instance the counts of a
+        histogram whose bin centres are x. 1 if not specified.
+    :return: density : numpy.array
+        Density at the points.
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    if len(x) < 2:
+        raise ValueError('At least 2 samples are required to estimate the '
+                         'density. Got ' + str(len(x)))
+    xmin = np.min(x)
+    xmax = np.max(x)
+    grid = np.linspace(xmin, xmax, n_grid)
+    counts = linear_binning(x, xmin, xmax, n_grid, weights)
+    if bandwidth is None:
+        bandwidth = binned_bandwidth(grid, counts)
+    if bandwidth <= 0:
+        raise ValueError('The bandwidth must be positive. Got ' +
+                         str(bandwidth))
+
+    # Kernel truncated at 4 bandwidths, the density is computed on the grid
+    # extended by the half-width of the kernel on each side
+    delta = grid[1] - grid[0]
+    if delta == 0:
+        delta = bandwidth
+    half_width = int(min(np.ceil(4 * bandwidth / delta), 10 * n_grid))
+    offsets = np.arange(-half_width, half_width + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / \
+        (np.sqrt(2 * np.pi) * bandwidth * np.sum(counts))
+
+    # Linear convolution through zero-padded FFTs
+    n_fft = 1 << int(np.ceil(np.log2(n_grid + len(kernel) - 1)))
+    density = np.fft.irfft(np.fft.rfft(counts, n_fft) *
+                           np.fft.rfft(kernel, n_fft), n_fft)
+    density = np.maximum(density[:n_grid + len(kernel) - 1], 0)
+    extended_grid = xmin + (np.arange(len(density)) - half_width) * delta
+    return np.interp(points, extended_grid, density, left=0, right=0)
@@ -1,5 +1,10 @@
+import io
+import json
+import os
+
 import numpy as np
-from operator import itemgetter
+
+import sabs_pkpd
 
 
 class FittingInstructions():
@@ -15,8 +20,10 @@ class FittingInstructions():
         mmt model annotation of the variable specifying the experimental
         conditions. It should correspond to the annotation of the experimental
         condition varying when generating the data.
-    sim_output_param_annot : str
-        mmt model annotation of the simulation output of interest.
+    sim_output_param_annot : str or list of strings
+        mmt model annotation of the simulation output of interest. A list of
+        annotations when several outputs are fitted together, in the order of
+        the values columns of the data.
     """
     def __init__(self,
                  fitted_params_annot,
@@ -26,13 +33,96 @@ class FittingInstructions():
         self.exp_cond_param_annot = exp_cond_param_annot
         self.sim_output_param_annot = sim_output_param_annot
 
+    def n_outputs(self):
+        """
+        Returns the number of simulation outputs fitted.
+        """
+        if isinstance(self.sim_output_param_annot, str):
+            return 1
+        return len(self.sim_output_param_annot)
+
 
 class Data_exp():
-    def __init__(self, times, values, exp_nums, exp_conds):
-        self.times = times
-        self.values = values
+    """
+    This class stores the experimental data. The times and values of all
+    the experiments are stored in two contiguous arrays, indexed by the
+    offsets of the experiments, and times[k] and values[k] are views on the
+    data of the k-th experiment.
+
+    Attributes
+    ----------
+    times : RaggedArray
+        Sampling times of each experiment. times.flat contains the times of
+        all the experiments one after the other.
+    values : RaggedArray
+        Measured values of each experiment, of shape (number of times, ) or
+        (number of times, n_outputs). values.flat contains the values of all
+        the experiments one after the other.
+    offsets : numpy.array
+        The data of the k-th experiment is stored in
+        times.flat[offsets[k]:offsets[k + 1]] and values.flat[offsets[k]:
+        offsets[k + 1]].
+    exp_nums : list
+        Experiment numbers, in the order of the experiments.
+    exp_conds : list
+        Experimental conditions of the data.
+    experiment_conds : numpy.array
+        Experimental condition of each experiment, or None if unknown.
+    weights : RaggedArray
+        Weight of each time sample in the sum of squares and log likelihood,
+        or None if all the samples weigh 1. Set by
+        sabs_pkpd.decimation.decimate_data_exp.
+    fitting_instructions : FittingInstructions
+        Set by Add_fitting_instructions.
+    """
+    def __init__(self, times, values, exp_nums, exp_conds,
+                 experiment_conds=None, weights=None):
+        """
+        :param times: list or RaggedArray
+            Sampling times of each experiment. A list of arrays is copied in
+            a contiguous array.
+        :param values: list or RaggedArray
+            Measured values of each experiment, with the same lengths as the
+            times.
+        :param exp_nums: list
+            Experiment numbers.
+        :param exp_conds: list
+            Experimental conditions.
+        :param experiment_conds: list
+            Experimental condition of each experiment. Not specified if
+            unknown.
+        :param weights: list or RaggedArray
+            Weight of each time sample, with the same lengths as the times.
+            All the samples weigh 1 if not specified.
+        """
+        self.times = _contiguous(times)
+        self.values = _contiguous(values)
+        if not np.array_equal(self.times.offsets, self.values.offsets):
+            raise ValueError('The times and values must have the same '
+                             'length for each experiment. Got times of '
+                             'lengths ' + str(list(self.times.lengths())) +
+                             ' and values of lengths ' +
+                             str(list(self.values.lengths())))
+        if weights is not None:
+            weights = _contiguous(weights)
+            if not np.array_equal(self.times.offsets, weights.offsets):
+                raise ValueError('The times and weights must have the same '
+                                 'length for each experiment')
+            weights.offsets = self.times.offsets
+        self.weights = weights
+        # A single index for the times, the values and the weights
+        self.values.offsets = self.times.offsets
+        self.offsets = self.times.offsets
         self.exp_nums = exp_nums
         self.exp_conds = exp_conds
+        if experiment_conds is not None:
+            experiment_conds = np.asarray(experiment_conds, dtype=np.float64)
+            if len(experiment_conds) != len(self.times):
+                raise ValueError('One experimental condition per experiment '
+                                 'is expected. Got ' +
+                                 str(len(experiment_conds)) + ' for ' +
+                                 str(len(self.times)) + ' experiments')
+        self.experiment_conds = experiment_conds
         self.fitting_instructions = None
 
     def Add_fitting_instructions(self,
@@ -45,35 +135,209 @@ class Data_exp():
                                 sim_output_param_annot)
 
 
-def load_data_file(filename, headers: bool = True):
+def load_data_file(filename,
+                   headers: bool = True,
+                   n_outputs: int = 1,
+                   chunk_size: int = 2 ** 24):
     # Data should be provided in 4 columns:
     # time, data, experiment number, experiment condition
-    data = np.loadtxt(filename, delimiter=',', skiprows=int(headers))
+    # With several outputs, the data is provided in n_outputs columns:
+    # time, data 1, ..., data n_outputs, experiment number, experiment
+    # condition, and the values are loaded as arrays of shape
+    # (number of times, n_outputs)
+    # The file is parsed by blocks of about chunk_size characters, so that
+    # the text of the file is never held in memory as a whole.
+    n_columns = 3 + n_outputs
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1. Got ' +
+                         str(chunk_size))
+    data = _read_csv_chunks(filename, int(headers), chunk_size)
 
-    if len(data[:, 0]) != len(data[:, 1]):
-        raise ValueError('The times and values must have the same length')
-    if type(data[0][0]) == str:
-        raise ValueError('The CSV file is not in the standard format. '
-                         'Please refer to the documentation. (More than one '
-                         'line of headers)')
-
-    if len(data[0]) > 4:
+    if len(data) == 0:
+        raise ValueError('The CSV file does not contain any data')
+    if len(data[0]) > n_columns:
         raise ValueError('The CSV file is not in the standard format. Please '
                          'refer to the documentation. (Too many columns)')
 
-    # Sorting the list in increasing times and experimental condition
+    # Grouping the rows by experiment number, sorted in increasing
+    # experimental condition and times in each experiment. lexsort is
+    # stable, so that the rows are in the same order as with sorted().
+    order = np.lexsort((data[:, 0],
+                        data[:, n_columns - 1],
+                        data[:, n_columns - 2]))
+    unique_nums, starts = np.unique(data[order, n_columns - 2],
+                                    return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    # The lists of experiment numbers and conditions are in the order of
+    # the sets of their values inserted in the order of the sorted rows:
+    # the conditions in increasing order, and the experiment numbers in the
+    # order of the first row of each experiment
+    exp_conds_list = list(set(np.unique(data[:, n_columns - 1])))
+    first_rows = order[starts]
+    first_rows = first_rows[np.lexsort((first_rows,
+                                        data[first_rows, 0],
+                                        data[first_rows, n_columns - 1]))]
+    exp_nums_list = list(set(data[first_rows, n_columns - 2]))
+
+    # The experiments are stored one after the other, in the order of
+    # exp_nums_list
+    position = {num: i for i, num in enumerate(unique_nums)}
+    groups = [position[num] for num in exp_nums_list]
+    order = np.concatenate([order[starts[i]:ends[i]] for i in groups])
+    lengths = (ends - starts)[groups]
+    experiment_conds = data[order[np.cumsum(lengths) - lengths],
+                            n_columns - 1]
+    times = sabs_pkpd.ragged_array.RaggedArray(lengths,
+                                               flat=data[order, 0])
+    if n_outputs == 1:
+        values = sabs_pkpd.ragged_array.RaggedArray(lengths,
+                                                    flat=data[order, 1])
+    else:
+        values = sabs_pkpd.ragged_array.RaggedArray(
+            lengths, flat=data[order, 1:1 + n_outputs])
+
+    return Data_exp(times, values, exp_nums_list, exp_conds_list,
+                    experiment_conds)
+
+
+def save_data_exp(data_exp, directory):
+    """
+    Saves the experimental data and its fitting instructions in a binary
+    format, which load_data_exp opens without parsing. The directory
+    contains one .npy file per column (times, values, weights, experiment
+    numbers and conditions), the offsets of the experiments in the times
+    and values, and the fitting instructions in meta.json.
+
+    :param data_exp: Data_exp
+        Experimental data to save.
+    :param directory: str
+        Directory where the files are written. It is created if needed, and
+        files of a previous save are overwritten.
+    :return: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'times.npy'), data_exp.times.flat)
+    np.save(os.path.join(directory, 'values.npy'), data_exp.values.flat)
+    np.save(os.path.join(directory, 'offsets.npy'), data_exp.offsets)
+    np.save(os.path.join(directory, 'exp_nums.npy'),
+            np.asarray(data_exp.exp_nums, dtype=np.float64))
+    np.save(os.path.join(directory, 'exp_conds.npy'),
+            np.asarray(data_exp.exp_conds, dtype=np.float64))
+    for name, array in [('experiment_conds', data_exp.experiment_conds),
+                        ('weights', data_exp.weights)]:
+        filename = os.path.join(directory, name + '.npy')
+        if isinstance(array, sabs_pkpd.ragged_array.RaggedArray):
+            array = array.flat
+        if array is not None:
+            np.save(filename, array)
+        elif os.path.isfile(filename):
+            os.remove(filename)
+
+    instructions = data_exp.fitting_instructions
+    if instructions is not None:
+        instructions = {
+            'fitted_params_annot': list(instructions.fitted_params_annot),
+            'exp_cond_param_annot': instructions.exp_cond_param_annot,
+            'sim_output_param_annot': instructions.sim_output_param_annot}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'format_version': 1,
+                   'fitting_instructions': instructions}, f)
+
+
+def load_data_exp(directory, mmap: bool = True):
+    """
+    Loads experimental data saved by save_data_exp. The arrays are
+    memory-mapped by default: opening the data does not read it, and
+    processes reading the same files share their pages in memory.
+
+    :param directory: str
+        Directory written by save_data_exp.
+    :param mmap: bool
+        If False, the arrays are read in memory. True if not specified.
+    :return: data_exp : Data_exp
+        The times and values are RaggedArray: data_exp.times[k] and
+        data_exp.values[k] are views on the arrays of the k-th experiment.
+        They are read-only if memory-mapped.
+    """
+    meta_filename = os.path.join(directory, 'meta.json')
+    if not os.path.isfile(meta_filename):
+        raise ValueError('No experimental data saved in ' + directory)
+    with open(meta_filename) as f:
+        meta = json.load(f)
+    if meta['format_version'] != 1:
+        raise ValueError('Unknown version of the data format: ' +
+                         str(meta['format_version']))
 
-    data = sorted(data, key=itemgetter(3, 0))
-    data = np.concatenate([i for i in data])
-    data = data.reshape(len(data) // 4, 4)
-    exp_nums_list = list(set(data[:, 2]))
-    exp_conds_list = list(set(data[:, 3]))
-    times = []
-    values = []
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    for name in ['times', 'values', 'offsets', 'exp_nums', 'exp_conds']:
+        arrays[name] = np.load(os.path.join(directory, name + '.npy'),
+                               mmap_mode=mmap_mode)
+    for name in ['experiment_conds', 'weights']:
+        filename = os.path.join(directory, name + '.npy')
+        arrays[name] = None
+        if os.path.isfile(filename):
+            arrays[name] = np.load(filename, mmap_mode=mmap_mode)
+    lengths = np.diff(arrays['offsets'])
+    weights = None
+    if arrays['weights'] is not None:
+        weights = sabs_pkpd.ragged_array.RaggedArray(
+            lengths, flat=arrays['weights'])
+    times = sabs_pkpd.ragged_array.RaggedArray(lengths,
+                                               flat=arrays['times'])
+    values = sabs_pkpd.ragged_array.RaggedArray(lengths,
+                                                flat=arrays['values'])
+    data_exp = Data_exp(times,
+                        values,
+                        list(np.array(arrays['exp_nums'])),
+                        list(np.array(arrays['exp_conds'])),
+                        arrays['experiment_conds'],
+                        weights)
 
-    for i in range(len(exp_nums_list)):
-        temp = data[data[:, 2] == exp_nums_list[i]]
-        times.append(temp[:, 0])
-        values.append(temp[:, 1])
+    instructions = meta['fitting_instructions']
+    if instructions is not None:
+        data_exp.Add_fitting_instructions(
+            instructions['fitted_params_annot'],
+            instructions['exp_cond_param_annot'],
+            instructions['sim_output_param_annot'])
+    return data_exp
 
-    return Data_exp(times, values, exp_nums_list, exp_conds_list)
+
+def _read_csv_chunks(filename, skiprows, chunk_size):
+    """
+    Parses the comma-separated values of a file by blocks of about
+    chunk_size characters, and returns them as a 2D numpy.array.
+    """
+    chunks = []
+    with open(filename, 'r') as f:
+        for i in range(skiprows):
+            f.readline()
+        while True:
+            text = f.read(chunk_size)
+            if len(text) == 0:
+                break
+            # Completes the last line of the block
+            text += f.readline()
+            if not text.isspace():
+                chunks.append(np.loadtxt(io.StringIO(text), delimiter=',',
+                                         ndmin=2))
+    if len(chunks) == 0:
+        return np.zeros((0, 0))
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks)
+
+
+def _contiguous(arrays):
+    """
+    Returns the arrays as a RaggedArray, copying them in a contiguous
+    buffer unless they already are a RaggedArray.
+    """
+    if isinstance(arrays, sabs_pkpd.ragged_array.RaggedArray):
+        return arrays
+    arrays = [np.asarray(array, dtype=np.float64) for array in arrays]
+    if len(arrays) == 0:
+        return sabs_pkpd.ragged_array.RaggedArray([])
+    return sabs_pkpd.ragged_array.RaggedArray(
+        [len(array) for array in arrays], flat=np.concatenate(arrays))
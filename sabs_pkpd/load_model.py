@@ -115,7 +115,7 @@ def load_model_from_cellml(cellml_filename, mmt_filename):
     return sim
 
 
-def load_simulation_from_mmt(filename):
+def load_simulation_from_mmt(filename, cache=None):
     """Load a model into Myokit from MMT file format.
 
     Saves the default state to sabs_pkpd.constants.default_state.
@@ -124,14 +124,23 @@ def load_simulation_from_mmt(filename):
     ----------
     filename : str
         Path to the MMT file
+    cache : sabs_pkpd.simulation_cache.SimulationCache or bool
+        Cache of compiled simulations to load the simulation from, or to store
+        it in. If True, a SimulationCache in the default directory is used. If
+        not specified, the model is parsed and compiled.
 
     Returns
     -------
     myokit.Simulation
         Myokit Simulation object from the MMT file
     """
-    model, prot, script = myokit.load(filename)
-    s = myokit.Simulation(model, prot)
+    if cache is True:
+        cache = sabs_pkpd.simulation_cache.SimulationCache()
+    if cache:
+        s = cache.load(filename)
+    else:
+        model, prot, script = myokit.load(filename)
+        s = myokit.Simulation(model, prot)
     sabs_pkpd.constants.default_state = s.state()
 
     return s
@@ -4,22 +4,471 @@ import numpy as np
 import sabs_pkpd
 import matplotlib.pyplot as plt
 import scipy.stats as stats
+import multiprocessing
+import warnings
+import time
+import os
 
 
 class MyModel(pints.ForwardModel):
+    def __init__(self):
+        super(MyModel, self).__init__()
+        # Fitting plan, compiled at the first simulation
+        self._plan = None
+        self._plan_inputs = None
+
     def n_parameters(self):
         # Define the amount of fitted parameters
         return sabs_pkpd.constants.n
 
+    def n_outputs(self):
+        return sabs_pkpd.constants.data_exp.fitting_instructions.n_outputs()
+
     def simulate(self, parameters, times):
         sabs_pkpd.constants.n = len(parameters)
+        s = sabs_pkpd.constants.s
+        data_exp = sabs_pkpd.constants.data_exp
+
+        # Compile the fitting plan again only if the simulation or the data
+        # changed since the last call
+        plan_inputs = (s, data_exp, data_exp.fitting_instructions)
+        if self._plan_inputs is None or any(
+                a is not b for a, b in zip(plan_inputs, self._plan_inputs)):
+            self._plan = sabs_pkpd.run_model.compile_fitting_plan(data_exp, s)
+            self._plan_inputs = plan_inputs
+
+        memo = sabs_pkpd.constants.simulation_memo
+        if memo is not None:
+            default_state = sabs_pkpd.constants.default_state
+            memo_values = (sabs_pkpd.constants.pre_run,
+                           None if default_state is None
+                           else tuple(default_state))
+            output = memo.get(plan_inputs, memo_values, parameters)
+            if output is not None:
+                return output
+
+        out = sabs_pkpd.run_model.simulate_data(
+            parameters,
+            s,
+            data_exp,
+            pre_run=sabs_pkpd.constants.pre_run,
+            plan=self._plan,
+            condition_pool=sabs_pkpd.constants.condition_pool,
+            pre_run_cache=sabs_pkpd.constants.pre_run_cache)
+        output = _shape_outputs(out.flat, self.n_outputs())
+        if memo is not None:
+            memo.put(plan_inputs, memo_values, parameters, output)
+        return output
+
+
+def _shape_outputs(flat, n_outputs):
+    # PINTS expects the outputs of multi-output models with shape
+    # (number of times, number of outputs)
+    if n_outputs == 1:
+        return flat
+    return flat.reshape(-1, n_outputs)
+
+
+class ForwardModel(pints.ForwardModel):
+    """
+    PINTS forward model running a myokit simulation in the conditions of a
+    Data_exp. Unlike MyModel, it does not modify sabs_pkpd.constants, and
+    only reads sabs_pkpd.constants.fit_stats to record timings, so that
+    several problems can be defined side by side, and it can be pickled to
+    worker processes.
+
+    The simulation can be provided through a factory, for instance
+    functools.partial(sabs_pkpd.load_model.load_simulation_from_mmt,
+    filename, cache=True). Only the factory is then pickled, and the
+    simulation is built again (from the cache) in each process on first use.
+
+    Attributes
+    ----------
+    data_exp : Data_exp
+        Data the model is compared to, with its fitting instructions.
+    pre_run : int
+        Time for which the model is run before each simulation.
+    default_state : list
+        State from which the simulations start.
+    condition_pool : ConditionPool
+        Pool of worker processes across which the experimental conditions are
+        simulated. None to simulate them serially.
+    pre_run_cache : PreRunCache
+        Cache of the states reached after the pre-run. None to run the
+        pre-run every time.
+    simulation_memo : SimulationMemo
+        Memo of the outputs of simulate. None to simulate every time.
+    """
+    def __init__(self,
+                 s,
+                 data_exp,
+                 pre_run=0,
+                 default_state=None,
+                 condition_pool=None,
+                 pre_run_cache=None,
+                 simulation_memo=None):
+        """
+        :param s: myokit.Simulation, SimulationPool or function
+            Simulation of the model, or function without arguments returning
+            it.
+        :param data_exp: Data_exp
+            Data the model is compared to. The fitting instructions must have
+            been initialised.
+        :param pre_run: int
+            Time for which the model is run before each simulation.
+        :param default_state: list
+            State from which the simulations start. If not specified, the
+            default state of the simulation.
+        :param condition_pool: ConditionPool
+            Pool of worker processes across which the experimental conditions
+            are simulated.
+        :param pre_run_cache: PreRunCache
+            Cache of the states reached after the pre-run.
+        :param simulation_memo: SimulationMemo
+            Memo of the outputs of simulate, returned again when the same
+            parameters are simulated.
+        """
+        super(ForwardModel, self).__init__()
+        if data_exp.fitting_instructions is None:
+            raise ValueError('The fitting instructions of the data must be '
+                             'initialised before defining the model. See '
+                             'Data_exp.Add_fitting_instructions')
+        if callable(s):
+            self._factory = s
+            self._s = None
+        else:
+            self._factory = None
+            self._s = s
+        self.data_exp = data_exp
+        self.pre_run = pre_run
+        self.default_state = default_state
+        self.condition_pool = condition_pool
+        self.pre_run_cache = pre_run_cache
+        self.simulation_memo = simulation_memo
+        self._plan = None
+        self._plan_instructions = None
+
+    def n_parameters(self):
+        return len(self.data_exp.fitting_instructions.fitted_params_annot)
+
+    def n_outputs(self):
+        return self.data_exp.fitting_instructions.n_outputs()
+
+    def simulation(self):
+        """
+        Returns the simulation of the model, building it if needed.
+        """
+        if self._s is None:
+            self._s = self._factory()
+        return self._s
+
+    def fitting_plan(self):
+        """
+        Returns the FittingPlan of the model, compiled again only if the
+        fitting instructions of data_exp changed.
+        """
+        instructions = self.data_exp.fitting_instructions
+        if self._plan is None or self._plan_instructions is not instructions:
+            s = self.simulation()
+            self._plan = sabs_pkpd.run_model.compile_fitting_plan(
+                self.data_exp, s)
+            if self.default_state is None:
+                if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+                    s = s.template
+                self.default_state = s.default_state()
+            self._plan.default_state = self.default_state
+            self._plan_instructions = instructions
+        return self._plan
+
+    def simulate(self, parameters, times):
+        plan = self.fitting_plan()
+        memo = self.simulation_memo
+        if memo is not None:
+            memo_objects = (self.simulation(), self.data_exp,
+                            self.data_exp.fitting_instructions)
+            memo_values = (self.pre_run, tuple(self.default_state))
+            output = memo.get(memo_objects, memo_values, parameters)
+            if output is not None:
+                return output
+
         out = sabs_pkpd.run_model.simulate_data(
             parameters,
-            sabs_pkpd.constants.s,
-            sabs_pkpd.constants.data_exp,
-            pre_run=sabs_pkpd.constants.pre_run)
-        out = np.concatenate(out)
-        return out
+            self.simulation(),
+            self.data_exp,
+            pre_run=self.pre_run,
+            plan=plan,
+            condition_pool=self.condition_pool,
+            pre_run_cache=self.pre_run_cache)
+        output = _shape_outputs(out.flat, self.n_outputs())
+        if memo is not None:
+            memo.put(memo_objects, memo_values, parameters, output)
+        return output
+
+    def __getstate__(self):
+        # A simulation built by the factory is built again after unpickling
+        state = self.__dict__.copy()
+        if self._factory is not None:
+            state['_s'] = None
+        return state
+
+
+class ForwardModelS1(ForwardModel, pints.ForwardModelS1):
+    """
+    ForwardModel which also returns the derivatives of the model output with
+    respect to the fitted parameters, computed with myokit's forward
+    sensitivities (CVODES). It can be used with the gradient-based optimisers
+    and samplers of PINTS.
+
+    simulateS1 runs a second simulation of the model, compiled with the
+    sensitivities on first use. The experimental conditions are simulated
+    serially and without the pre-run cache, while simulate behaves exactly as
+    in ForwardModel. The sensitivities with respect to state variables are
+    not available with a pre-run.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ForwardModelS1, self).__init__(*args, **kwargs)
+        self._s_sensitivities = None
+        self._sensitivities_plan = None
+
+    def sensitivity_simulation(self):
+        """
+        Returns the simulation computing the sensitivities, compiling it if
+        the fitting plan changed.
+        """
+        plan = self.fitting_plan()
+        if self._sensitivities_plan is not plan:
+            self._s_sensitivities = sabs_pkpd.run_model.sensitivity_simulation(
+                self.simulation(), plan)
+            self._sensitivities_plan = plan
+        return self._s_sensitivities
+
+    def simulateS1(self, parameters, times):
+        s = self.sensitivity_simulation()
+        out, derivatives = sabs_pkpd.run_model.simulate_data_sensitivities(
+            parameters,
+            s,
+            self.data_exp,
+            pre_run=self.pre_run,
+            plan=self.fitting_plan())
+        if self.n_outputs() > 1:
+            derivatives = derivatives.reshape(
+                -1, self.n_outputs(), self.n_parameters())
+        return _shape_outputs(out.flat, self.n_outputs()), derivatives
+
+    def __getstate__(self):
+        # The sensitivity simulation is compiled again after unpickling
+        state = super(ForwardModelS1, self).__getstate__()
+        state['_s_sensitivities'] = None
+        state['_sensitivities_plan'] = None
+        return state
+
+
+class EarlyRejectionSumOfSquares(pints.ErrorMeasure):
+    """
+    Sum of squares error between the model output and
+    sabs_pkpd.constants.data_exp, which stops simulating parameter sets
+    clearly worse than the best one found so far.
+
+    The experimental conditions are simulated in time chunks, and the
+    simulation is aborted once the partial sum of squares exceeds the best
+    error found so far multiplied by factor. The partial sum of squares,
+    extrapolated to all the time points, is then returned as a penalty. Low
+    factors reject more simulations, but give population-based optimisers a
+    poorer ranking of the rejected parameter sets.
+
+    When evaluated in parallel, each worker process keeps track of its own
+    best error.
+
+    If a ForwardModel is provided, its simulation, data and settings are used
+    instead of the ones stored in sabs_pkpd.constants.
+
+    Attributes
+    ----------
+    best_error : float
+        Lowest sum of squares of a completed simulation.
+    n_evaluations : int
+        Number of evaluations of the error.
+    n_rejected : int
+        Number of evaluations for which the simulation was aborted.
+    """
+    def __init__(self, n_parameters, factor=10, n_chunks=10, model=None):
+        """
+        :param n_parameters: int
+            Number of fitted parameters.
+        :param factor: float
+            The simulation is aborted when the partial error exceeds
+            factor * best_error.
+        :param n_chunks: int
+            Number of time chunks per experimental condition.
+        :param model: ForwardModel
+            Model to evaluate. If not specified, the model is defined by
+            sabs_pkpd.constants.
+        """
+        super(EarlyRejectionSumOfSquares, self).__init__()
+        if factor < 1:
+            raise ValueError('The early rejection factor must be at least 1.'
+                             ' Got ' + str(factor))
+        self._n_parameters = n_parameters
+        self.factor = factor
+        self.n_chunks = n_chunks
+        self.best_error = np.inf
+        self.n_evaluations = 0
+        self.n_rejected = 0
+        self._model = model
+        self._plan = None
+        self._plan_inputs = None
+
+    def n_parameters(self):
+        return self._n_parameters
+
+    def __call__(self, x):
+        if self._model is not None:
+            s = self._model.simulation()
+            data_exp = self._model.data_exp
+            plan = self._model.fitting_plan()
+            pre_run = self._model.pre_run
+            pre_run_cache = self._model.pre_run_cache
+        else:
+            s = sabs_pkpd.constants.s
+            data_exp = sabs_pkpd.constants.data_exp
+            pre_run = sabs_pkpd.constants.pre_run
+            pre_run_cache = sabs_pkpd.constants.pre_run_cache
+
+            plan_inputs = (s, data_exp, data_exp.fitting_instructions)
+            if self._plan_inputs is None or any(
+                    a is not b
+                    for a, b in zip(plan_inputs, self._plan_inputs)):
+                self._plan = sabs_pkpd.run_model.compile_fitting_plan(
+                    data_exp, s)
+                self._plan_inputs = plan_inputs
+            plan = self._plan
+
+        error, completed = \
+            sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+                x,
+                s,
+                data_exp,
+                self.best_error * self.factor,
+                n_chunks=self.n_chunks,
+                pre_run=pre_run,
+                plan=plan,
+                pre_run_cache=pre_run_cache)
+
+        self.n_evaluations += 1
+        if completed:
+            self.best_error = min(self.best_error, error)
+        else:
+            self.n_rejected += 1
+        return error
+
+    def evaluateS1(self, x):
+        raise NotImplementedError('EarlyRejectionSumOfSquares does not '
+                                  'compute sensitivities, as the simulations '
+                                  'of rejected parameter sets have no '
+                                  'gradient. Use a pints.SumOfSquaresError '
+                                  'with a ForwardModelS1 instead')
+
+
+class WeightedSumOfSquaresError(pints.ProblemErrorMeasure):
+    """
+    Sum of squares error in which the squared residual at each time sample
+    is multiplied by the weight of the sample, for instance the weights of
+    data decimated by sabs_pkpd.decimation.decimate_data_exp.
+
+    Attributes
+    ----------
+    weights : numpy.array
+        Weight of each time sample of the problem.
+    """
+    def __init__(self, problem, weights):
+        """
+        :param problem: pints.SingleOutputProblem or pints.MultiOutputProblem
+            Problem defined by define_problem.
+        :param weights: numpy.array
+            Weight of each time sample, for instance data_exp.weights.flat.
+        """
+        super(WeightedSumOfSquaresError, self).__init__(problem)
+        self.weights = _sample_weights(weights, self._n_times)
+
+    def __call__(self, x):
+        r = self._problem.evaluate(x) - self._values
+        return np.sum(self.weights * r.reshape(self._n_times, -1) ** 2)
+
+    def evaluateS1(self, x):
+        y, dy = self._problem.evaluateS1(x)
+        dy = dy.reshape((self._n_times, self._n_outputs, self._n_parameters))
+        r = (y - self._values).reshape(self._n_times, self._n_outputs)
+        e = np.sum(self.weights * r ** 2)
+        de = 2 * np.sum((self.weights * r)[:, :, np.newaxis] * dy,
+                        axis=(0, 1))
+        return e, de
+
+
+class WeightedGaussianLogLikelihood(pints.ProblemLogLikelihood):
+    """
+    Log likelihood of independent Gaussian noise of unknown standard
+    deviation on each output, as pints.GaussianLogLikelihood, in which the
+    log density at each time sample is multiplied by the weight of the
+    sample. With the weights of decimated data, it approximates the log
+    likelihood of the full data. One parameter, the standard deviation of
+    the noise, is added per output.
+
+    Attributes
+    ----------
+    weights : numpy.array
+        Weight of each time sample of the problem.
+    """
+    def __init__(self, problem, weights):
+        """
+        :param problem: pints.SingleOutputProblem or pints.MultiOutputProblem
+            Problem defined by define_problem.
+        :param weights: numpy.array
+            Weight of each time sample, for instance data_exp.weights.flat.
+        """
+        super(WeightedGaussianLogLikelihood, self).__init__(problem)
+        self._nt = len(self._times)
+        self._no = problem.n_outputs()
+        self._n_parameters = problem.n_parameters() + self._no
+        self.weights = _sample_weights(weights, self._nt)
+        self._total_weight = np.sum(self.weights)
+        self._logn = 0.5 * self._total_weight * np.log(2 * np.pi)
+
+    def __call__(self, x):
+        sigma = np.asarray(x[-self._no:])
+        if any(sigma <= 0):
+            return -np.inf
+        r = self._values - self._problem.evaluate(x[:-self._no])
+        r = r.reshape(self._nt, self._no)
+        return np.sum(-self._logn - self._total_weight * np.log(sigma) -
+                      np.sum(self.weights * r ** 2, axis=0) /
+                      (2 * sigma ** 2))
+
+    def evaluateS1(self, x):
+        sigma = np.asarray(x[-self._no:])
+        log_likelihood = self(x)
+        if np.isneginf(log_likelihood):
+            return log_likelihood, np.tile(np.nan, self._n_parameters)
+        y, dy = self._problem.evaluateS1(x[:-self._no])
+        dy = dy.reshape(self._nt, self._no, self._n_parameters - self._no)
+        r = (self._values - y).reshape(self._nt, self._no)
+        dl = np.sum((self.weights * r / sigma ** 2)[:, :, np.newaxis] * dy,
+                    axis=(0, 1))
+        dsigma = -self._total_weight / sigma + \
+            np.sum(self.weights * r ** 2, axis=0) / sigma ** 3
+        return log_likelihood, np.concatenate((dl, dsigma))
+
+
+def _sample_weights(weights, n_times):
+    """
+    Returns the weights of the time samples as a column, multiplying the
+    squared residuals of shape (n_times, n_outputs).
+    """
+    weights = np.asarray(weights, dtype=np.float64).ravel()
+    if len(weights) != n_times:
+        raise ValueError('One weight per time sample is expected. Got ' +
+                         str(len(weights)) + ' weights for ' + str(n_times) +
+                         ' time samples')
+    return weights[:, np.newaxis]
 
 
 def parameter_is_state(param_annot, myokit_simulation):
@@ -77,20 +526,93 @@ def find_index_of_state(param_annot, myokit_simulation):
     not be found.
     """
     index = None
-    for i in range(len(myokit_simulation._model._state)):
-        if myokit_simulation._model._state[i]._component._name + '.' \
-                + myokit_simulation._model._state[i]._name == param_annot:
+    for i, state in enumerate(myokit_simulation._model.states()):
+        if state.qname() == param_annot:
             index = i
 
     return index
 
 
+class _TimedErrorMeasure(pints.ErrorMeasure):
+    """
+    Error measure recording its evaluations in sabs_pkpd.constants.fit_stats.
+    """
+    def __init__(self, error_measure):
+        super(_TimedErrorMeasure, self).__init__()
+        self._error_measure = error_measure
+
+    def n_parameters(self):
+        return self._error_measure.n_parameters()
+
+    def __call__(self, x):
+        return _timed_evaluation(self._error_measure, x)
+
+    def evaluateS1(self, x):
+        return _timed_evaluation(self._error_measure.evaluateS1, x)
+
+
+class _TimedLogLikelihood(pints.LogLikelihood):
+    """
+    Log likelihood recording its evaluations in
+    sabs_pkpd.constants.fit_stats.
+    """
+    def __init__(self, log_likelihood):
+        super(_TimedLogLikelihood, self).__init__()
+        self._log_likelihood = log_likelihood
+
+    def n_parameters(self):
+        return self._log_likelihood.n_parameters()
+
+    def __call__(self, x):
+        return _timed_evaluation(self._log_likelihood, x)
+
+    def evaluateS1(self, x):
+        return _timed_evaluation(self._log_likelihood.evaluateS1, x)
+
+
+def _timed_evaluation(f, x):
+    fit_stats = sabs_pkpd.constants.fit_stats
+    if fit_stats is None:
+        return f(x)
+    start = time.perf_counter()
+    try:
+        return f(x)
+    finally:
+        fit_stats.add_evaluation(start)
+
+
+def define_problem(model, data_exp):
+    """
+    Defines the PINTS problem comparing the output of the model to the
+    experimental data. A pints.MultiOutputProblem is defined if several
+    simulation outputs are fitted, a pints.SingleOutputProblem otherwise.
+
+    :param model: pints.ForwardModel
+        Model returning the outputs in the conditions of data_exp.
+    :param data_exp: Data_exp
+        Contains the data that the model is fitted too. See documentation for
+        sabs_pkpd.load_data for further info
+    :return: problem : pints.SingleOutputProblem or pints.MultiOutputProblem
+    """
+    fit_values = data_exp.values.flat
+    times = np.linspace(0, 1, len(fit_values))
+    if data_exp.fitting_instructions.n_outputs() == 1:
+        return pints.SingleOutputProblem(model, times, fit_values)
+    return pints.MultiOutputProblem(model, times, fit_values)
+
+
 def infer_params(initial_point,
                  data_exp,
                  boundaries_low,
                  boundaries_high,
                  pints_method=pints.XNES,
-                 parallel=False):
+                 parallel=False,
+                 early_rejection_factor=None,
+                 n_chunks=10,
+                 model=None,
+                 log_to_screen=True,
+                 return_stats=False,
+                 stats_interval=None):
     """
     Infers parameters using PINTS library pnits.optimise() function, using
     method pints.XNES, and rectangular boundaries.
@@ -107,8 +629,36 @@ def infer_params(initial_point,
     :param boundaries_high: list
         List of lower boundaries for the fitted parameters. It has to match the
         length of fitting parameters annotations
+    :param early_rejection_factor: float
+        If provided, the simulations of parameter sets whose partial sum of
+        squares exceeds early_rejection_factor times the best error found so
+        far are aborted. See EarlyRejectionSumOfSquares. If the data has
+        weights, the sums of squares are weighted, see
+        WeightedSumOfSquaresError.
+    :param n_chunks: int
+        Number of time chunks per experimental condition used for early
+        rejection.
+    :param model: ForwardModel
+        Model fitted to data_exp. If not specified, a MyModel defined by
+        sabs_pkpd.constants is used.
+    :param log_to_screen: bool
+        Whether the progress of the optimisation and the result are printed.
+        True if not specified.
+    :param return_stats: bool
+        If True, the time spent in each phase of the evaluations and the
+        number of simulations and solver failures are recorded, and returned
+        as a sabs_pkpd.fit_stats.FitStats. With parallel=True, the
+        evaluations run in worker processes and only the total time is
+        recorded. False if not specified.
+    :param stats_interval: float
+        If provided with return_stats, a summary of the statistics is printed
+        at most every stats_interval seconds.
     :return: found_parameters : numpy.array
         List of parameters values after optimisation routine.
+    :return: found_value : float
+        Error of the parameters found.
+    :return: stats : FitStats
+        Only if return_stats is True.
     """
 
     if len(initial_point) != \
@@ -129,28 +679,230 @@ def infer_params(initial_point,
                          'as the fitted parameters annotations '
                          '(defined in data_exp.fitting_instructions')
 
-    fit_values = np.concatenate(data_exp.values)
+    if model is None:
+        sabs_pkpd.constants.n = len(
+            sabs_pkpd.constants.data_exp.fitting_instructions.
+            fitted_params_annot)
+        model = MyModel()
+        error_model = None
+    else:
+        error_model = model
 
-    sabs_pkpd.constants.n = len(
-        sabs_pkpd.constants.data_exp.fitting_instructions.fitted_params_annot)
+    if early_rejection_factor is not None and \
+            pints_method(initial_point).needs_sensitivities():
+        raise ValueError('Early rejection cannot be used with an optimiser '
+                         'requiring sensitivities, such as ' +
+                         pints_method.__name__ + ', as the simulations of '
+                         'rejected parameter sets have no gradient')
 
-    problem = pints.SingleOutputProblem(
-        model=MyModel(),
-        times=np.linspace(0, 1, len(fit_values)),
-        values=fit_values)
+    problem = define_problem(model, data_exp)
     boundaries = pints.RectangularBoundaries(boundaries_low, boundaries_high)
-    error_measure = pints.SumOfSquaresError(problem)
+    if early_rejection_factor is None and data_exp.weights is not None:
+        error_measure = WeightedSumOfSquaresError(problem,
+                                                  data_exp.weights.flat)
+    elif early_rejection_factor is None:
+        error_measure = pints.SumOfSquaresError(problem)
+    else:
+        error_measure = EarlyRejectionSumOfSquares(model.n_parameters(),
+                                                   early_rejection_factor,
+                                                   n_chunks,
+                                                   model=error_model)
+    fit_stats = None
+    if return_stats:
+        fit_stats = sabs_pkpd.fit_stats.FitStats(stats_interval)
+        error_measure = _TimedErrorMeasure(error_measure)
     optimiser = pints.OptimisationController(error_measure,
                                              initial_point,
                                              boundaries=boundaries,
                                              method=pints_method)
     optimiser.set_parallel(parallel=parallel)
-    found_parameters, found_value = optimiser.run()
-    print(data_exp.fitting_instructions.fitted_params_annot)
-    print(found_parameters)
+    optimiser.set_log_to_screen(log_to_screen)
+    with sabs_pkpd.fit_stats.recording(fit_stats):
+        found_parameters, found_value = optimiser.run()
+    if log_to_screen:
+        print(data_exp.fitting_instructions.fitted_params_annot)
+        print(found_parameters)
+    if return_stats:
+        return found_parameters, found_value, fit_stats
     return found_parameters, found_value
 
 
+def sample_starting_points(n_starts,
+                           boundaries_low,
+                           boundaries_high,
+                           sampling='lhs',
+                           seed=None):
+    """
+    Draws starting points for the optimisation spread within the
+    rectangular boundaries.
+
+    :param n_starts: int
+        Number of starting points.
+    :param boundaries_low: list
+        Lower boundaries for each of the parameters.
+    :param boundaries_high: list
+        Upper boundaries for each of the parameters.
+    :param sampling: str
+        'lhs' for a Latin hypercube sample, 'sobol' for a scrambled Sobol
+        sequence.
+    :param seed: int
+        Seed of the random number generator.
+    :return: starting_points : numpy.array
+        Array of shape (n_starts, number of parameters).
+    """
+    if sampling == 'lhs':
+        sampler = stats.qmc.LatinHypercube(d=len(boundaries_low), seed=seed)
+    elif sampling == 'sobol':
+        sampler = stats.qmc.Sobol(d=len(boundaries_low), seed=seed)
+    else:
+        raise ValueError('The sampling must be either \'lhs\' or '
+                         '\'sobol\'. Got ' + str(sampling))
+
+    with warnings.catch_warnings():
+        # Sobol sequences are only balanced for powers of 2 points
+        warnings.simplefilter('ignore', UserWarning)
+        sample = sampler.random(n_starts)
+    return stats.qmc.scale(sample, boundaries_low, boundaries_high)
+
+
+def _run_start(task):
+    (index, initial_point, data_exp, boundaries_low, boundaries_high,
+     pints_method, model, seed) = task
+    # Forked workers would otherwise share the state of the random generator
+    np.random.seed(seed)
+    found_parameters, found_value = infer_params(initial_point,
+                                                 data_exp,
+                                                 boundaries_low,
+                                                 boundaries_high,
+                                                 pints_method=pints_method,
+                                                 model=model,
+                                                 log_to_screen=False)
+    return index, found_parameters, found_value
+
+
+def infer_params_multistart(data_exp,
+                            boundaries_low,
+                            boundaries_high,
+                            n_starts=10,
+                            sampling='lhs',
+                            pints_method=pints.XNES,
+                            model=None,
+                            n_workers=None,
+                            time_budget=None,
+                            n_agree=None,
+                            agree_tolerance=1e-3,
+                            callback=None,
+                            seed=None):
+    """
+    Infers parameters by running infer_params from several starting points
+    spread within the boundaries, concurrently in worker processes.
+
+    If no model is provided, the workers use MyModel, which is only defined
+    in the workers if they are forked (the default on Linux). Provide a
+    ForwardModel to use other start methods.
+
+    :param data_exp: Data_exp
+        Contains the data that the model is fitted too. See documentation for
+        sabs_pkpd.load_data for further info
+    :param boundaries_low: list
+        List of lower boundaries for the fitted parameters.
+    :param boundaries_high: list
+        List of upper boundaries for the fitted parameters.
+    :param n_starts: int
+        Number of optimisations, each from a different starting point.
+    :param sampling: str
+        Sampling of the starting points, 'lhs' or 'sobol'. See
+        sample_starting_points.
+    :param pints_method: pints.Optimiser
+        Optimisation method, pints.XNES if not specified.
+    :param model: ForwardModel
+        Model fitted to data_exp. If not specified, MyModel.
+    :param n_workers: int
+        Number of worker processes. One per CPU if not specified.
+    :param time_budget: float
+        Wall-clock time in seconds after which the optimisations still
+        running are stopped. If not specified, all the optimisations are run.
+    :param n_agree: int
+        If provided, the optimisations still running are stopped once
+        n_agree optimisations found the best parameters found so far, within
+        agree_tolerance.
+    :param agree_tolerance: float
+        Two optimisations agree if the parameters they found differ by less
+        than agree_tolerance times the width of the boundaries.
+    :param callback: function
+        Called as callback(start index, found_parameters, found_value) each
+        time an optimisation completes.
+    :param seed: int
+        Seed used for the starting points and the optimisations.
+    :return: best_parameters : numpy.array
+        Parameters with the lowest error. None if no optimisation completed
+        within the time budget.
+    :return: best_value : float
+        Lowest error found.
+    :return: optima : numpy.array
+        Table of the completed optimisations, of shape (number of completed
+        optimisations, 2 * number of parameters + 1), sorted by increasing
+        error. Each row contains the starting point, the parameters found and
+        the error.
+    """
+    n_params = len(data_exp.fitting_instructions.fitted_params_annot)
+    if len(boundaries_low) != n_params or len(boundaries_high) != n_params:
+        raise ValueError('The boundaries should have the same length as the '
+                         'fitted parameters annotations '
+                         '(defined in data_exp.fitting_instructions')
+    if n_agree is not None and not 1 <= n_agree <= n_starts:
+        raise ValueError('The number of agreeing optimisations must be '
+                         'between 1 and n_starts. Got ' + str(n_agree))
+
+    starting_points = sample_starting_points(n_starts, boundaries_low,
+                                             boundaries_high, sampling, seed)
+    seeds = np.random.SeedSequence(seed).generate_state(n_starts)
+    tasks = [(k, starting_points[k], data_exp, boundaries_low,
+              boundaries_high, pints_method, model, seeds[k])
+             for k in range(n_starts)]
+
+    widths = np.array(boundaries_high) - np.array(boundaries_low)
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if time_budget is not None:
+        deadline = time.time() + time_budget
+
+    optima = []
+    # Leaving the block terminates the workers still running
+    with multiprocessing.Pool(min(n_workers, n_starts)) as pool:
+        results = pool.imap_unordered(_run_start, tasks)
+        for i in range(n_starts):
+            try:
+                if time_budget is None:
+                    index, found_parameters, found_value = next(results)
+                else:
+                    index, found_parameters, found_value = results.next(
+                        timeout=max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                break
+
+            optima.append(np.concatenate([starting_points[index],
+                                          found_parameters,
+                                          [found_value]]))
+            if callback is not None:
+                callback(index, found_parameters, found_value)
+
+            if n_agree is not None:
+                found = np.array(optima)[:, n_params:]
+                best = found[np.argmin(found[:, -1]), :-1]
+                n_agreeing = np.sum(np.all(
+                    np.abs(found[:, :-1] - best) <= agree_tolerance * widths,
+                    axis=1))
+                if n_agreeing >= n_agree:
+                    break
+
+    optima = np.array(optima).reshape(-1, 2 * n_params + 1)
+    optima = optima[np.argsort(optima[:, -1], kind='stable')]
+    if len(optima) == 0:
+        return None, np.inf, optima
+    return optima[0, n_params:2 * n_params], optima[0, -1], optima
+
+
 def MCMC_routine(starting_point,
                  max_iter=4000,
                  adapt_start=None,
@@ -161,15 +913,25 @@ def MCMC_routine(starting_point,
                  log_likelihood='GaussianLogLikelihood',
                  method='HaarioBardenetACMC',
                  sigma0=None,
-                 parallel=False):
+                 parallel=False,
+                 model=None,
+                 chain_store=None,
+                 checkpoint_interval=1000,
+                 rhat_threshold=None,
+                 ess_target=None,
+                 check_interval=100,
+                 delayed_acceptance=False,
+                 return_stats=False,
+                 stats_interval=None):
     """
     Runs a MCMC routine for the selected model
 
     :param starting_point:
         List of numpy.array. List of starting values for the MCMC for the
         optimisation parameters. Must have the same length as
-        data_exp.fitting_parms_annot + 1 (for Noise). len(starting_point)
-        defines the amount of MCMC chains.
+        data_exp.fitting_parms_annot + 1 (for Noise), or + the number of
+        outputs when several outputs are fitted (one Noise per output).
+        len(starting_point) defines the amount of MCMC chains.
 
     :param max_iter:
         int. Maximal iterations for the whole MCMC. Should be higher than
@@ -196,7 +958,9 @@ def MCMC_routine(starting_point,
 
     :param log_likelihood: pints.LogLikelihood
         Type of log likelihood. If not specified,
-        pints.UnknownNoiseLogLikelihood.
+        pints.UnknownNoiseLogLikelihood. If the data has weights, a
+        WeightedGaussianLogLikelihood is used instead of
+        pints.GaussianLogLikelihood, and other types are not supported.
 
     :param method: pints.method:
         method of optimisation. If not specified, pints.HaarioBardenetACMC.
@@ -211,24 +975,88 @@ def MCMC_routine(starting_point,
     Boolean. Enables or not the parallelisation of the MCMC among the available
     CPUs. False as default.
 
+    :param model: ForwardModel
+        Model to sample the parameters of. If provided, the data and the
+        simulation are taken from the model instead of sabs_pkpd.constants,
+        and mmt_model_filename is ignored.
+
+    :param chain_store: sabs_pkpd.chain_store.ChainStore or str
+        If provided, the chains are written to this binary chain store (or to
+        a ChainStore in this directory). It cannot be combined with
+        chain_filename and pdf_filename. The state of the samplers is
+        checkpointed with the chains, and the MCMC is resumed from the last
+        checkpoint of the store, if any, until max_iter iterations are
+        reached.
+
+    :param checkpoint_interval: int
+        Number of iterations between two checkpoints of the chain store. 1000
+        if not specified.
+
+    :param rhat_threshold: float
+        If provided, the split R-hat of each parameter is computed while
+        sampling, after the adapting phase, and the MCMC stops before max_iter
+        once it is below rhat_threshold for all parameters (and the ESS
+        criterion is met). See sabs_pkpd.convergence.OnlineConvergence.
+
+    :param ess_target: float
+        If provided, the MCMC stops before max_iter once the effective sample
+        size, summed over the chains, exceeds ess_target for all parameters
+        (and the R-hat criterion is met).
+
+    :param check_interval: int
+        Number of iterations between two checks (and reports) of the
+        convergence criteria. 100 if not specified.
+
+    :param delayed_acceptance: bool
+        If True, the chains are sampled with
+        sabs_pkpd.delayed_acceptance.DelayedAcceptanceMCMC instead of method:
+        a surrogate of the log-likelihood, trained on the simulations already
+        run, screens the proposals and the model is only simulated for the
+        proposals accepted by the surrogate. The agreement between the
+        surrogate and the model is reported while sampling. The chains are
+        run sequentially. False if not specified.
+
+    :param return_stats: bool
+        If True, the time spent in each phase of the evaluations and the
+        number of simulations and solver failures are recorded, and returned
+        as a sabs_pkpd.fit_stats.FitStats. With parallel=True, the
+        evaluations run in worker processes and only the total time is
+        recorded. False if not specified.
+
+    :param stats_interval: float
+        If provided with return_stats, a summary of the statistics is printed
+        at most every stats_interval seconds.
+
     :return: chains
-        The chain for the MCMC routine.
+        The chain for the MCMC routine. A sabs_pkpd.chain_store.LazyChains
+        reading the chains from disk when a chain store is used.
+
+    :return: stats
+        FitStats of the routine, only if return_stats is True.
 
     """
-    sabs_pkpd.constants.n = len(starting_point[0]) - 1
+    if model is None:
+        data_exp = sabs_pkpd.constants.data_exp
+    else:
+        data_exp = model.data_exp
 
+    n_outputs = data_exp.fitting_instructions.n_outputs()
     if len(starting_point[0]) != \
-            len(sabs_pkpd.constants.data_exp.
-                fitting_instructions.fitted_params_annot) + 1:
+            len(data_exp.fitting_instructions.fitted_params_annot) + \
+            n_outputs:
         raise ValueError('Starting point and Parameters annotations + Noise '
                          'must have the same length')
 
-    if mmt_model_filename is not None:
-        sabs_pkpd.constants.s = \
-            sabs_pkpd.load_model.load_simulation_from_mmt(mmt_model_filename)
+    if model is None:
+        sabs_pkpd.constants.n = len(starting_point[0]) - n_outputs
 
-    # Then create an instance of our new model class
-    model = sabs_pkpd.pints_problem_def.MyModel()
+        if mmt_model_filename is not None:
+            sabs_pkpd.constants.s = \
+                sabs_pkpd.load_model.load_simulation_from_mmt(
+                    mmt_model_filename)
+
+        # Then create an instance of our new model class
+        model = sabs_pkpd.pints_problem_def.MyModel()
 
     # log_prior within [0.5 * starting_point ,  2 * starting_point] if not
     # specified
@@ -240,20 +1068,70 @@ def MCMC_routine(starting_point,
         log_prior = pints.UniformLogPrior(np.array(mini * 0.5).tolist(),
                                           np.array(maxi * 2).tolist())
 
-    fit_values = np.concatenate(sabs_pkpd.constants.data_exp.values)
-
-    problem = pints.SingleOutputProblem(
-        model,
-        times=np.linspace(0, 1, len(fit_values)),
-        values=fit_values)
+    problem = define_problem(model, data_exp)
 
     # Create a log-likelihood function (adds an extra parameter!)
-    log_likelihood = eval('pints.' + log_likelihood + '(problem)')
+    if data_exp.weights is not None:
+        if log_likelihood not in ['GaussianLogLikelihood',
+                                  'UnknownNoiseLogLikelihood']:
+            raise ValueError('Only the GaussianLogLikelihood can be '
+                             'weighted for data with weights. Got ' +
+                             str(log_likelihood))
+        log_likelihood = WeightedGaussianLogLikelihood(
+            problem, data_exp.weights.flat)
+    else:
+        log_likelihood = eval('pints.' + log_likelihood + '(problem)')
+    fit_stats = None
+    if return_stats:
+        fit_stats = sabs_pkpd.fit_stats.FitStats(stats_interval)
+        log_likelihood = _TimedLogLikelihood(log_likelihood)
 
     # Create a posterior log-likelihood (log(likelihood * prior))
     log_posterior = pints.LogPosterior(log_likelihood, log_prior)
 
-    method = eval('pints.' + method)
+    if delayed_acceptance:
+        method = sabs_pkpd.delayed_acceptance.DelayedAcceptanceMCMC
+    else:
+        method = eval('pints.' + method)
+
+    if chain_store is not None and (chain_filename is not None or
+                                    pdf_filename is not None):
+        raise ValueError('The chains are written to the chain store, and '
+                         'cannot be written to chain_filename or '
+                         'pdf_filename as well')
+
+    if chain_store is not None or rhat_threshold is not None or \
+            ess_target is not None or delayed_acceptance:
+        if adapt_start is not None and adapt_start > max_iter:
+            raise ValueError('The maximum number of iterations should be '
+                             'higher than the adapting phase length. Got ' +
+                             str(max_iter) + ' maximum iterations, ' +
+                             str(adapt_start) + 'iterations in adapting phase')
+        if chain_store is not None and not isinstance(
+                chain_store, sabs_pkpd.chain_store.ChainStore):
+            chain_store = sabs_pkpd.chain_store.ChainStore(
+                chain_store, len(starting_point),
+                log_posterior.n_parameters())
+        print('Running...')
+        with sabs_pkpd.fit_stats.recording(fit_stats):
+            chains = _run_mcmc_loop(log_posterior,
+                                    starting_point,
+                                    method,
+                                    sigma0,
+                                    max_iter,
+                                    adapt_start,
+                                    parallel,
+                                    chain_store,
+                                    checkpoint_interval,
+                                    rhat_threshold,
+                                    ess_target,
+                                    check_interval,
+                                    chain_filename,
+                                    pdf_filename)
+        print('Done!')
+        if return_stats:
+            return chains, fit_stats
+        return chains
 
     # Create mcmc routine
     mcmc = pints.MCMCController(log_posterior,
@@ -283,12 +1161,203 @@ def MCMC_routine(starting_point,
 
     # Run!
     print('Running...')
-    chains = mcmc.run()
+    with sabs_pkpd.fit_stats.recording(fit_stats):
+        chains = mcmc.run()
     print('Done!')
 
+    if return_stats:
+        return chains, fit_stats
     return chains
 
 
+def _run_mcmc_loop(log_posterior,
+                   starting_point,
+                   method,
+                   sigma0,
+                   max_iter,
+                   adapt_start,
+                   parallel,
+                   store,
+                   checkpoint_interval,
+                   rhat_threshold,
+                   ess_target,
+                   check_interval,
+                   chain_filename=None,
+                   pdf_filename=None):
+    """
+    Runs the MCMC samplers with an ask and tell loop, and returns the chains.
+
+    If a chain store is provided, the iterations are appended to it and the
+    samplers are checkpointed every checkpoint_interval iterations, and the
+    loop resumes from the last checkpoint of the store if there is one.
+    Otherwise the chains are kept in memory, and written at the end to
+    chain_filename and pdf_filename if provided, in the CSV format of
+    pints.MCMCController. If convergence criteria are provided, the loop
+    stops once they are met.
+
+    Delayed-acceptance samplers evaluate the posterior themselves, so they
+    are stepped sequentially.
+    """
+    n_chains = len(starting_point)
+    delayed = method is sabs_pkpd.delayed_acceptance.DelayedAcceptanceMCMC
+    single_chain = delayed or issubclass(method, pints.SingleChainMCMC)
+
+    state = None if store is None else store.load_checkpoint()
+    if state is None:
+        if delayed:
+            samplers = [method(log_posterior, x, sigma0)
+                        for x in starting_point]
+        elif single_chain:
+            samplers = [method(x, sigma0) for x in starting_point]
+        else:
+            samplers = [method(n_chains, starting_point, sigma0)]
+        for sampler in samplers:
+            if sampler.needs_initial_phase():
+                sampler.set_initial_phase(True)
+        # Sample produced by each chain for the next iteration
+        pending = [None] * n_chains
+        monitor = sabs_pkpd.convergence.OnlineConvergence(
+            n_chains, log_posterior.n_parameters())
+    else:
+        samplers, pending, random_state, monitor = state
+        np.random.set_state(random_state)
+        if delayed:
+            for sampler in samplers:
+                sampler.set_log_posterior(log_posterior)
+        print('Resuming from iteration ' + str(store.n_iterations()))
+
+    # Same default length of the initial phase as pints.MCMCController. The
+    # convergence is only monitored after the initial phase.
+    initial_phase_iterations = 200 if adapt_start is None else adapt_start
+    if not samplers[0].needs_initial_phase():
+        initial_phase_iterations = 0
+    needs_sensitivities = samplers[0].needs_sensitivities()
+    check_convergence = rhat_threshold is not None or ess_target is not None
+
+    f = log_posterior.evaluateS1 if needs_sensitivities else log_posterior
+    if parallel:
+        evaluator = pints.ParallelEvaluator(
+            f, n_workers=min(pints.ParallelEvaluator.cpu_count(), n_chains))
+    else:
+        evaluator = pints.SequentialEvaluator(f)
+
+    def log_pdf(fy):
+        return fy[0] if needs_sensitivities else fy
+
+    def checkpoint():
+        store.checkpoint((samplers, pending, np.random.get_state(), monitor))
+
+    def report_agreement():
+        n_proposals = sum(sampler.n_proposals for sampler in samplers)
+        n_screened_out = sum(sampler.n_screened_out for sampler in samplers)
+        n_second_stage = sum(sampler.n_second_stage for sampler in samplers)
+        n_accepted = sum(sampler.n_second_stage_accepted
+                         for sampler in samplers)
+        agreement = n_accepted / n_second_stage if n_second_stage else np.nan
+        print('Delayed acceptance: ' + str(n_screened_out) + ' of ' +
+              str(n_proposals) + ' proposals screened out by the surrogate, '
+              'agreement with the model ' + str(round(agreement, 4)))
+
+    samples = []
+    log_pdfs = []
+    iteration = 0 if store is None else store.n_iterations()
+    while iteration < max_iter:
+        if iteration == initial_phase_iterations:
+            for sampler in samplers:
+                if sampler.needs_initial_phase():
+                    sampler.set_initial_phase(False)
+
+        # Chains waiting for the others keep their sample
+        if delayed:
+            pending = [sampler.step() for sampler in samplers]
+        elif single_chain:
+            active = [i for i in range(n_chains) if pending[i] is None]
+            xs = [samplers[i].ask() for i in active]
+            fxs = evaluator.evaluate(xs)
+            for i, fx in zip(active, fxs):
+                reply = samplers[i].tell(fx)
+                if reply is not None:
+                    y, fy, accepted = reply
+                    pending[i] = (y, log_pdf(fy))
+        else:
+            fxs = evaluator.evaluate(samplers[0].ask())
+            reply = samplers[0].tell(fxs)
+            if reply is not None:
+                ys, fys, accepted = reply
+                pending = [(y, log_pdf(fy)) for y, fy in zip(ys, fys)]
+
+        if any(sample is None for sample in pending):
+            continue
+
+        ys = np.array([sample[0] for sample in pending])
+        if store is None:
+            samples.append(ys)
+            log_pdfs.append([sample[1] for sample in pending])
+        else:
+            store.append(ys, [sample[1] for sample in pending])
+        pending = [None] * n_chains
+        iteration += 1
+        if iteration > initial_phase_iterations:
+            monitor.update(ys)
+
+        if store is not None and iteration % checkpoint_interval == 0:
+            checkpoint()
+
+        if check_convergence and iteration % check_interval == 0 and \
+                iteration > initial_phase_iterations:
+            print('Iteration ' + str(iteration) + ': max R-hat ' +
+                  str(round(np.max(monitor.rhat()), 4)) + ', min ESS ' +
+                  str(round(np.min(monitor.ess()), 1)))
+            if monitor.has_converged(rhat_threshold, ess_target):
+                print('Convergence criteria met after ' + str(iteration) +
+                      ' iterations')
+                break
+
+        if delayed and iteration % check_interval == 0 and \
+                iteration < max_iter:
+            report_agreement()
+
+    if delayed:
+        report_agreement()
+    if store is None:
+        chains = np.stack(samples, axis=1).reshape(
+            n_chains, -1, log_posterior.n_parameters())
+        _write_chain_files(chains, np.array(log_pdfs).T, log_posterior,
+                           chain_filename, pdf_filename)
+        return chains
+    checkpoint()
+    return store.chains()
+
+
+def _write_chain_files(chains, log_pdfs, log_posterior, chain_filename,
+                       pdf_filename):
+    """
+    Writes one CSV file per chain for the samples and for the log pdfs,
+    named and formatted as by pints.MCMCController.set_chain_filename and
+    set_log_pdf_filename.
+    """
+    for filename, arrays, header in [
+            (chain_filename, chains,
+             ['p' + str(k) for k in range(chains.shape[2])]),
+            (pdf_filename, log_pdfs, None)]:
+        if filename is None:
+            continue
+        base, extension = os.path.splitext(str(filename))
+        for i, array in enumerate(arrays):
+            if header is None:
+                # Log posterior, log likelihood and log prior, as in PINTS
+                log_prior = np.array([log_posterior.log_prior()(x)
+                                      for x in chains[i]])
+                array = np.column_stack([array, array - log_prior,
+                                         log_prior])
+                columns = ['logposterior', 'loglikelihood', 'logprior']
+            else:
+                columns = header
+            np.savetxt(base + '_' + str(i) + extension, array,
+                       delimiter=',', comments='',
+                       header=','.join('"' + c + '"' for c in columns))
+
+
 def plot_distribution_parameters(mcmc_chains: list,
                                  bound_min: list,
                                  bound_max: list,
@@ -298,7 +1367,9 @@ def plot_distribution_parameters(mcmc_chains: list,
     """
     :param mcmc_chains:
     list. The list containing the MCMC chains obtained after running the MCMC
-    routine. chain[i] returns the i-th chain.
+    routine. chain[i] returns the i-th chain. It can also be a list of
+    sabs_pkpd.chain_analysis.ChainSummary, for chains too long to be loaded
+    in memory.
 
     :param bound_min:
     list. List of length the amount of parameters sampled during the MCMC
@@ -319,7 +1390,8 @@ def plot_distribution_parameters(mcmc_chains: list,
 
     :param explor_iter:
     int. Length of the exploratory phase, which is excluded when plotting the
-    distribution of parameters.
+    distribution of parameters. Ignored for summaries, which exclude it when
+    they are computed.
 
     :return: fig, axes
     The matplotlib.pyplot.fig and -.axes corresponding to the desired figure.
@@ -329,23 +1401,34 @@ def plot_distribution_parameters(mcmc_chains: list,
                          'reach for chain no. ' + str(chain_index) + '. Only '
                          + str(len(mcmc_chains)) +
                          ' chains in this MCMC output.')
+    summaries = isinstance(mcmc_chains[0],
+                           sabs_pkpd.chain_analysis.ChainSummary)
+    if summaries:
+        n_params = mcmc_chains[0].n_parameters
+    else:
+        n_params = len(mcmc_chains[0][0])
+
     # Compute the amount of graphs, given the amount of chains
-    if len(mcmc_chains[0, 0]) < 4:
-        n_columns = len(mcmc_chains[0, 0])
+    if n_params < 4:
+        n_columns = n_params
     else:
         n_columns = 4
-    n_rows = 1 + len(mcmc_chains[0, 0]) // 4
+    n_rows = 1 + n_params // 4
 
     # Generate the subplots
     fig, axes = plt.subplots(n_rows, n_columns, figsize=fig_size)
 
     # Loop over the subplots
-    for i in range(len(mcmc_chains[0][0]) - 1):
+    for i in range(n_params - 1):
         if n_rows == 1:
             ax = axes[i]
         else:
             ax = axes[i // 4, i % 4]
-        hist_1d(mcmc_chains[chain_index][explor_iter:, i], ax=ax)
+        if summaries:
+            edges, counts = mcmc_chains[chain_index].histogram(i)
+            hist_1d((edges[1:] + edges[:-1]) / 2, ax=ax, weights=counts)
+        else:
+            hist_1d(mcmc_chains[chain_index][explor_iter:, i], ax=ax)
         ax.set_title(sabs_pkpd.constants.data_exp.
                      fitting_instructions.fitted_params_annot[i])
         ax.set_xlim((bound_min[i], bound_max[i]))
@@ -355,7 +1438,7 @@ def plot_distribution_parameters(mcmc_chains: list,
     return fig, axes
 
 
-def hist_1d(x, ax):
+def hist_1d(x, ax, exact=False, weights=None):
     """
     Creates a 1d histogram and an estimate of the PDF using KDE.
     :param x : list
@@ -364,16 +1447,29 @@ def hist_1d(x, ax):
     :param ax :matplotlib.axes._subplots.AxesSubplot
     Axes of the figure that we want to plot the histogram on
 
+    :param exact : bool
+    If True, the KDE is computed with scipy.stats.gaussian_kde, which is slow
+    for long chains. Otherwise, it is computed on binned samples with
+    sabs_pkpd.kde.binned_kde. False if not specified.
+
+    :param weights : list
+    Number of occurrences of each value of x, for instance the counts of a
+    histogram whose bin centres are x. 1 if not specified.
+
     :returns None
     """
+    x = np.asarray(x)
     xmin = np.min(x)
     xmax = np.max(x)
     x1 = np.linspace(xmin, xmax, 100)
     x2 = np.linspace(xmin, xmax, 50)
 
-    ax.hist(x, bins=x2, density=True)
-    kernel = stats.gaussian_kde(x)
-    f = kernel(x1)
+    ax.hist(x, bins=x2, density=True, weights=weights)
+    if exact:
+        kernel = stats.gaussian_kde(x, weights=weights)
+        f = kernel(x1)
+    else:
+        f = sabs_pkpd.kde.binned_kde(x, x1, weights=weights)
     ax.plot(x1, f)
 
 
@@ -381,14 +1477,22 @@ def plot_MCMC_convergence(mcmc_chains,
                           expected_values,
                           bound_max,
                           bound_min,
-                          parameters_annotations=None):
+                          parameters_annotations=None,
+                          max_points=2000):
     """
     Plots the convergence of the MCMC chains, with boundaries and expected
     values.
 
+    Long traces are decimated before plotting, keeping the minimum and the
+    maximum of each bucket of iterations (see
+    sabs_pkpd.chain_analysis.decimate_minmax), so that the plot looks the same
+    but renders quickly.
+
     :param mcmc_chains:
     list. List of length number of chains, each chain having a shape:
         (number of iterations, number of parameters + 1 for Noise)
+    It can also be a list of sabs_pkpd.chain_analysis.ChainSummary, whose
+    downsampled traces are plotted.
 
     :param expected_values:
     list. List containing the expected values of all of the parameters fitted
@@ -404,10 +1508,22 @@ def plot_MCMC_convergence(mcmc_chains,
     List of strings. Names of the model parameters fitted (with noise being the
     last parameter) during MCMC
 
+    :param max_points:
+    int. Maximal number of points plotted per chain and parameter, of the
+    order of the width of the plot in pixels. 2000 if not specified. If None,
+    all the iterations are plotted.
+
     :return: (fig, axes)
     """
 
-    n_params = len(mcmc_chains[0, 0, :])
+    summaries = isinstance(mcmc_chains[0],
+                           sabs_pkpd.chain_analysis.ChainSummary)
+    if summaries:
+        n_params = mcmc_chains[0].n_parameters
+        traces = [summary.trace() for summary in mcmc_chains]
+    else:
+        n_params = len(mcmc_chains[0][0])
+        traces = [(np.arange(len(chain)), chain) for chain in mcmc_chains]
 
     if len(bound_min) != len(bound_max) or len(bound_min) != n_params:
         raise ValueError('Boundaries length must match the amount of '
@@ -428,13 +1544,15 @@ def plot_MCMC_convergence(mcmc_chains,
         if n_params > 2:
             row = i // 2
             col = i % 2
-            axes[row, col].axhline(expected_values[i], c='k', LineWidth=3)
-            axes[row, col].axhline(bound_max[i], c='r', LineWidth=3)
-            axes[row, col].axhline(bound_min[i], c='r', LineWidth=3)
-            for j in range(len(mcmc_chains)):
-                axes[row, col].plot(mcmc_chains[j, :, i],
+            axes[row, col].axhline(expected_values[i], c='k', linewidth=3)
+            axes[row, col].axhline(bound_max[i], c='r', linewidth=3)
+            axes[row, col].axhline(bound_min[i], c='r', linewidth=3)
+            for j, (iterations, chain) in enumerate(traces):
+                x, y = sabs_pkpd.chain_analysis.decimate_minmax(
+                    iterations, chain[:, i], max_points)
+                axes[row, col].plot(x, y,
                                     label='chain ' + str(j),
-                                    LineWidth=1.5)
+                                    linewidth=1.5)
             axes[row, col].legend()
             if parameters_annotations is None:
                 axes[row, col].set_title('Parameter ' + str(i))
@@ -442,13 +1560,15 @@ def plot_MCMC_convergence(mcmc_chains,
                 axes[row, col].set_title(parameters_annotations[i])
         else:
             col = i % 2
-            axes[col].axhline(expected_values[i], c='k', LineWidth=3)
-            axes[col].axhline(bound_max[i], c='r', LineWidth=3)
-            axes[col].axhline(bound_min[i], c='r', LineWidth=3)
-            for j in range(len(mcmc_chains)):
-                axes[col].plot(mcmc_chains[j, :, i],
+            axes[col].axhline(expected_values[i], c='k', linewidth=3)
+            axes[col].axhline(bound_max[i], c='r', linewidth=3)
+            axes[col].axhline(bound_min[i], c='r', linewidth=3)
+            for j, (iterations, chain) in enumerate(traces):
+                x, y = sabs_pkpd.chain_analysis.decimate_minmax(
+                    iterations, chain[:, i], max_points)
+                axes[col].plot(x, y,
                                label='chain ' + str(j),
-                               LineWidth=1.5)
+                               linewidth=1.5)
             axes[col].legend()
             if parameters_annotations is None:
                 axes[col].set_title('Parameter ' + str(i))
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class RaggedArray():
+    """
+    This class stores a sequence of arrays of different lengths in one
+    contiguous buffer. ragged[k] returns a view on the k-th array, and
+    ragged.flat the concatenation of all of them, without copying.
+
+    Attributes
+    ----------
+    flat : numpy.array
+        Contiguous buffer containing all the arrays one after the other.
+    offsets : numpy.array
+        Array of length len(ragged) + 1. The k-th array is stored in
+        flat[offsets[k]:offsets[k + 1]].
+    """
+    def __init__(self, lengths, dtype=np.float64, flat=None):
+        """
+        :param lengths: list
+            Length of each of the arrays.
+        :param dtype: numpy.dtype
+            Type of the values stored. float64 if not specified.
+        :param flat: numpy.array
+            Buffer to use for the values. Its length must be the sum of the
+            lengths. If not provided, an uninitialised buffer is allocated.
+        """
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.intp)
+        np.cumsum(lengths, out=self.offsets[1:])
+        if flat is None:
+            flat = np.empty(self.offsets[-1], dtype=dtype)
+        elif len(flat) != self.offsets[-1]:
+            raise ValueError('The buffer length (' + str(len(flat)) + ') '
+                             'does not match the sum of the lengths (' +
+                             str(self.offsets[-1]) + ')')
+        self.flat = flat
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('RaggedArray index out of range')
+        return self.flat[self.offsets[k]:self.offsets[k + 1]]
+
+    def __setitem__(self, k, values):
+        self[k][:] = values
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def lengths(self):
+        """
+        Returns the length of each of the arrays.
+        """
+        return np.diff(self.offsets)
+
+    def tolist(self):
+        """
+        Returns the arrays as a list of lists.
+        """
+        return [self[k].tolist() for k in range(len(self))]
+
+
+def ragged_array_from_arrays(arrays, dtype=np.float64):
+    """
+    Copies a list of arrays of different lengths in a RaggedArray.
+
+    :param arrays: list
+        List of 1-D lists or numpy.array.
+    :param dtype: numpy.dtype
+        Type of the values stored. float64 if not specified.
+    :return: ragged : RaggedArray
+    """
+    ragged = RaggedArray([len(array) for array in arrays], dtype=dtype)
+    for k, array in enumerate(arrays):
+        ragged[k] = array
+    return ragged
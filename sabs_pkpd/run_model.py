@@ -2,9 +2,627 @@ import myokit
 import sabs_pkpd
 import numpy as np
 import matplotlib.pyplot as plt
+import multiprocessing
+import collections
+import threading
+import hashlib
+import copy
+import os
+import time
 
 
-def simulate_data(fitted_params_values, s, data_exp, pre_run=0):
+class FittingPlan():
+    """
+    This class stores how a vector of parameter values is applied to a
+    myokit.Simulation. The model annotations are resolved once when the plan
+    is compiled, so that running the model only requires setting the values
+    and calling the solver.
+
+    Attributes
+    ----------
+    params_annot : list of strings
+        mmt model annotations of the parameters set from the values vector.
+    state_params : list of tuples
+        (position in the values vector, index in the state vector) for the
+        parameters which are state variables of the model.
+    constant_params : list of tuples
+        (position in the values vector, mmt model annotation) for the
+        parameters which are constants of the model.
+    exp_cond_param_annot : str
+        mmt model annotation of the experimental condition. None if no
+        experimental condition is set.
+    read_out : str or list of strings
+        mmt model annotation(s) of the simulation output(s) of interest.
+    read_outs : list of strings
+        mmt model annotations of the simulation outputs of interest.
+    n_outputs : int
+        Number of simulation outputs.
+    log : list of strings
+        Variables logged by myokit when running the simulation. Only the
+        read outs are logged.
+    exp_conds : list
+        Values of the experimental condition for each simulation. Only set
+        when the plan is compiled from a Data_exp.
+    times : list
+        Time points logged for each experimental condition. Only set when the
+        plan is compiled from a Data_exp.
+    durations : list
+        Duration of the simulation for each experimental condition. Only set
+        when the plan is compiled from a Data_exp.
+    lengths : list
+        Number of values returned for each experimental condition (number of
+        time points times number of outputs). Only set when the plan is
+        compiled from a Data_exp.
+    default_state : list
+        State from which the simulations start. If None,
+        sabs_pkpd.constants.default_state is used, or the default state of
+        the simulation if it is not set either.
+    """
+    def __init__(self,
+                 s,
+                 params_annot,
+                 read_out,
+                 exp_cond_param_annot=None):
+        # Resolve the annotations on the template of a SimulationPool
+        if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+            s = s.template
+
+        self.params_annot = list(params_annot)
+        self.read_out = read_out
+        if isinstance(read_out, str):
+            self.read_outs = [read_out]
+        else:
+            self.read_outs = list(read_out)
+        self.n_outputs = len(self.read_outs)
+        self.log = list(self.read_outs)
+        self.exp_cond_param_annot = exp_cond_param_annot
+        self.state_params = []
+        self.constant_params = []
+        for i, annot in enumerate(self.params_annot):
+            if sabs_pkpd.pints_problem_def.parameter_is_state(annot, s):
+                index = sabs_pkpd.pints_problem_def.find_index_of_state(
+                    annot, s)
+                self.state_params.append((i, index))
+            else:
+                self.constant_params.append((i, annot))
+
+        self.exp_conds = None
+        self.times = None
+        self.durations = None
+        self.lengths = None
+        self.default_state = None
+
+    def set_parameters(self, s, params_values, exp_cond_value=None):
+        """
+        Resets the simulation, then sets the initial state, the constants and
+        the experimental condition to the provided values.
+
+        :param s: myokit.Simulation
+            Simulation in which the parameters are set.
+        :param params_values: list
+            Values of the parameters, matching self.params_annot.
+        :param exp_cond_value: float
+            Value of the experimental condition. Not set if None.
+        :return: None
+        """
+        s.reset()
+        # reset timer
+        s.set_time(0)
+
+        # Set initial value of state variable parameters
+        if self.default_state is not None:
+            state_to_set = list(self.default_state)
+        elif sabs_pkpd.constants.default_state is not None:
+            state_to_set = list(sabs_pkpd.constants.default_state)
+        else:
+            state_to_set = s.state()
+        for i, index in self.state_params:
+            state_to_set[index] = params_values[i]
+        s.set_state(state_to_set)
+
+        # Set constant parameters values
+        for i, annot in self.constant_params:
+            s.set_constant(annot, params_values[i])
+
+        # set the right experimental conditions
+        if exp_cond_value is not None:
+            s.set_constant(self.exp_cond_param_annot, exp_cond_value)
+
+
+def compile_fitting_plan(data_exp, s):
+    """
+    Compiles the FittingPlan used to run the model in the same conditions
+    (and with the same time sampling) as the experimental data loaded in
+    data_exp.
+
+    :param data_exp: Data_exp
+        Contains the data that the model is fitted too. The fitting
+        instructions must have been initialised previously.
+    :param s: myokit.Simulation or SimulationPool
+        Myokit simulation defined by the chosen model and protocol.
+    :return: plan : FittingPlan
+        Plan with one simulation per experiment, in the condition of the
+        experiment. If data_exp.experiment_conds is not known, one simulation
+        per experimental condition.
+    """
+    plan = FittingPlan(s,
+                       data_exp.fitting_instructions.fitted_params_annot,
+                       data_exp.fitting_instructions.sim_output_param_annot,
+                       data_exp.fitting_instructions.exp_cond_param_annot)
+
+    if data_exp.experiment_conds is not None:
+        # Each experiment is simulated in its own condition
+        n_experiments = len(data_exp.times)
+        plan.exp_conds = list(data_exp.experiment_conds)
+    else:
+        # Without the condition of each experiment, experiment k is assumed
+        # to be in condition exp_conds[k]
+        n_experiments = len(set(data_exp.exp_conds))
+        plan.exp_conds = list(data_exp.exp_conds)[:n_experiments]
+    plan.times = [data_exp.times[k] for k in range(n_experiments)]
+    plan.durations = [times[-1] * 1.00001 for times in plan.times]
+    plan.lengths = [len(times) * plan.n_outputs for times in plan.times]
+
+    return plan
+
+
+class PreRunCache():
+    """
+    Least recently used cache of the states reached at the end of the
+    pre-run. As the result of the pre-run only depends on the model, the
+    constants set, the experimental condition, the starting state and the
+    pre-run length, it is reused when all of those are identical to a
+    previous pre-run.
+
+    Constants set on the simulation outside of the FittingPlan are not part
+    of the key: clear the cache after changing them.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Memory bound for the cached states and their keys.
+    n_bytes : int
+        Current memory used by the cached states and their keys.
+    hits : int
+        Number of pre-runs retrieved from the cache.
+    misses : int
+        Number of pre-runs which had to be simulated.
+    """
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        # Identity of the model and protocol of each simulation
+        self._model_keys = {}
+        # The cache can be shared by the simulations of a SimulationPool
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all the cached states and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._model_keys.clear()
+            self.n_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __getstate__(self):
+        # The lock and the simulations identities are not carried over to
+        # other processes
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_model_keys'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _model_key(self, s):
+        with self._lock:
+            key = self._model_keys.get(id(s))
+        if key is None or key[0] is not s:
+            code = s._model.code() + ''.join(
+                [p.code() for p in s._protocols if p is not None])
+            key = (s, hashlib.sha1(code.encode()).hexdigest())
+            with self._lock:
+                self._model_keys[id(s)] = key
+        return key[1]
+
+    def pre(self, s, plan, params_values, exp_cond, pre_run):
+        """
+        Runs s.pre(pre_run), or sets the state of s to the cached result of
+        an identical pre-run.
+
+        :param s: myokit.Simulation
+            Simulation on which plan.set_parameters() was called.
+        :param plan: FittingPlan
+            Plan used to set the parameters.
+        :param params_values: list
+            Values of the parameters, matching plan.params_annot.
+        :param exp_cond: float
+            Value of the experimental condition.
+        :param pre_run: int
+            Defines the time for which the model is run without returning
+            output.
+        :return: None
+        """
+        if pre_run == 0:
+            s.pre(pre_run)
+            return
+
+        state = [float(x) for x in s.state()]
+        key = (self._model_key(s),
+               exp_cond,
+               tuple([float(params_values[i])
+                      for i, _ in plan.constant_params]),
+               pre_run,
+               tuple(state))
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+        if cached is not None:
+            s.set_default_state(cached[0])
+            s.set_state(cached[0])
+            return
+
+        s.pre(pre_run)
+        state = [float(x) for x in s.state()]
+
+        # Keep the cache within its memory bound
+        size = 8 * (len(key[2]) + 2 * len(state))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            while self.n_bytes + size > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.n_bytes -= old_size
+            self._entries[key] = (state, size)
+            self.n_bytes += size
+
+
+class SimulationMemo():
+    """
+    Least recently used memo of the outputs of a forward model, so that
+    evaluating exactly the same parameters again (as population-based
+    optimisers and clipped proposals often do) does not run the simulation.
+
+    The outputs are keyed by the exact bytes of the parameters, by the
+    identity of the objects they depend on (simulation, data, fitting
+    instructions) and by settings compared by value (pre-run, default
+    state). Like PreRunCache, constants set on the simulation outside of the
+    FittingPlan are not part of the key: clear the memo after changing them.
+
+    When pickled, for instance to the workers of pints.ParallelEvaluator, the
+    memo is copied empty, so that each process keeps its own memo.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Memory bound for the memoised outputs and their keys.
+    n_bytes : int
+        Current memory used by the memoised outputs and their keys.
+    hits : int
+        Number of outputs retrieved from the memo.
+    misses : int
+        Number of outputs which had to be simulated.
+    """
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all the memoised outputs and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self):
+        """
+        Returns the fraction of the lookups answered by the memo, nan if no
+        lookup was made.
+        """
+        n_lookups = self.hits + self.misses
+        if n_lookups == 0:
+            return np.nan
+        return self.hits / n_lookups
+
+    def __getstate__(self):
+        # Each process starts with an empty memo
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_entries'] = collections.OrderedDict()
+        state['n_bytes'] = 0
+        state['hits'] = 0
+        state['misses'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _key(self, objects, values, parameters):
+        return (tuple([id(obj) for obj in objects]),
+                values,
+                np.asarray(parameters, dtype=np.float64).tobytes())
+
+    def get(self, objects, values, parameters):
+        """
+        Returns a copy of the output memoised for the parameters, or None.
+
+        :param objects: tuple
+            Objects the output depends on, compared by identity.
+        :param values: tuple
+            Hashable settings the output depends on, compared by value.
+        :param parameters: list
+            Parameters of the simulation.
+        :return: output : numpy.array or None
+        """
+        key = self._key(objects, values, parameters)
+        with self._lock:
+            entry = self._entries.get(key)
+            # The objects are kept in the entry, so that their ids are not
+            # reused by other objects while it is memoised
+            if entry is not None and all(
+                    a is b for a, b in zip(entry[0], objects)):
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return np.array(entry[1])
+            self.misses += 1
+        return None
+
+    def put(self, objects, values, parameters, output):
+        """
+        Memoises the output simulated for the parameters.
+
+        :param objects: tuple
+            Objects the output depends on, compared by identity.
+        :param values: tuple
+            Hashable settings the output depends on, compared by value.
+        :param parameters: list
+            Parameters of the simulation.
+        :param output: numpy.array
+            Output of the simulation.
+        """
+        key = self._key(objects, values, parameters)
+        output = np.array(output)
+        size = output.nbytes + len(key[2])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            while self.n_bytes + size > self.max_bytes:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self.n_bytes -= old_size
+            self._entries[key] = (tuple(objects), output, size)
+            self.n_bytes += size
+
+
+def _run_logged(s, plan, duration, log_times, log_start=None):
+    """
+    Runs s for duration, logging only the variables in plan.log at the time
+    points log_times. If log_start is provided, the simulation is first run
+    without logging until log_start.
+    """
+    if log_start:
+        s.run(log_start, log=myokit.LOG_NONE)
+        duration = duration - log_start
+    return s.run(duration, log=plan.log, log_times=log_times)
+
+
+def _simulate_condition(s, plan, params_values, exp_cond, times, duration,
+                        pre_run, pre_run_cache=None):
+    """
+    Runs the model for one experimental condition of the plan and returns the
+    read out at the requested time points.
+    """
+    stats = sabs_pkpd.constants.fit_stats
+    if stats is not None:
+        start = time.perf_counter()
+
+    plan.set_parameters(s, params_values, exp_cond)
+    if stats is not None:
+        start = stats.add('set_parameters', start)
+
+    # Eventually run a pre-run to reach steady-state
+    if pre_run_cache is None:
+        s.pre(pre_run)
+    else:
+        pre_run_cache.pre(s, plan, params_values, exp_cond, pre_run)
+    if stats is not None:
+        start = stats.add('pre_run', start)
+
+    # Run the simulation with starting parameters
+    a = _run_logged(s, plan, duration, times)
+    if stats is not None:
+        start = stats.add('run', start)
+
+    output = _read_outputs(plan, a)
+    if stats is not None:
+        stats.add('output', start)
+    return output
+
+
+def _read_outputs(plan, log):
+    """
+    Returns the read outs of the plan from the simulation log. With several
+    read outs, the outputs at each time point are stored one after the
+    other.
+    """
+    if plan.n_outputs == 1:
+        return log[plan.read_outs[0]]
+    return np.column_stack([log[read_out] for read_out in plan.read_outs]
+                           ).ravel()
+
+
+# Simulation held by each worker process of a ConditionPool
+_worker_simulation = None
+
+
+def _init_condition_worker(s):
+    global _worker_simulation
+    _worker_simulation = s
+
+
+def _simulate_condition_in_worker(task):
+    default_state = task[-1]
+    sabs_pkpd.constants.default_state = default_state
+    return _simulate_condition(_worker_simulation, *task[:-1])
+
+
+class ConditionPool():
+    """
+    Persistent pool of worker processes used by simulate_data to run the
+    experimental conditions in parallel. Each worker holds its own copy of the
+    myokit.Simulation, compiled when the worker starts.
+
+    The pool can only be used from the process which created it. In other
+    processes (for example the workers started by PINTS when set_parallel is
+    enabled, which are not allowed to have children), simulate_data falls
+    back to running the conditions serially, so that cores are never
+    oversubscribed.
+
+    Attributes
+    ----------
+    n_workers : int
+        Number of worker processes.
+    """
+    def __init__(self, s, n_workers=None):
+        """
+        :param s: myokit.Simulation
+            Myokit simulation defined by the chosen model and protocol. It is
+            copied to each worker.
+        :param n_workers: int
+            Number of worker processes. If not specified, one per CPU.
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        if n_workers < 1:
+            raise ValueError('The condition pool needs at least one worker. '
+                             'Got n_workers = ' + str(n_workers))
+        self.n_workers = n_workers
+        self._pid = os.getpid()
+        self._pool = multiprocessing.Pool(n_workers,
+                                          initializer=_init_condition_worker,
+                                          initargs=(s,))
+
+    def is_available(self):
+        """
+        Returns whether the pool can be used from the current process.
+        """
+        return self._pool is not None and os.getpid() == self._pid and \
+            not multiprocessing.current_process().daemon
+
+    def map(self, fn, args):
+        """
+        Applies fn to each element of args in the worker processes, where
+        the simulation is available as the module variable
+        _worker_simulation.
+
+        :param fn: function
+            Function of one argument, defined at the top level of a module
+            so that it can be pickled.
+        :param args: iterable
+            Arguments of fn.
+        :return: results : iterator
+            fn(arg) for each arg, in the order of args, yielded as soon as
+            they are available.
+        """
+        if not self.is_available():
+            raise ValueError('The condition pool can only be used from the '
+                             'process which created it, before it is '
+                             'closed')
+        return self._pool.imap(fn, args)
+
+    def simulate(self, params_values, plan, pre_run=0):
+        """
+        Runs all the experimental conditions of the plan in the worker
+        processes.
+
+        :param params_values: list
+            Values of the parameters, matching plan.params_annot.
+        :param plan: FittingPlan
+            Plan compiled with compile_fitting_plan.
+        :param pre_run: int
+            Defines the time for which the model is run without returning
+            output.
+        :return: output : RaggedArray
+            Model output for each experimental condition, in the order of
+            plan.exp_conds.
+        """
+        # Only send to the workers the part of the plan which is common to
+        # all the conditions
+        worker_plan = copy.copy(plan)
+        worker_plan.exp_conds = None
+        worker_plan.times = None
+        worker_plan.durations = None
+        worker_plan.lengths = None
+
+        tasks = [(worker_plan, list(params_values), exp_cond, plan.times[k],
+                  plan.durations[k], pre_run,
+                  sabs_pkpd.constants.default_state)
+                 for k, exp_cond in enumerate(plan.exp_conds)]
+        output = sabs_pkpd.ragged_array.RaggedArray(plan.lengths)
+        for k, values in enumerate(
+                self.map(_simulate_condition_in_worker, tasks)):
+            output[k] = values
+        return output
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self._pool is not None and os.getpid() == self._pid:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # The worker processes belong to the process which created the pool
+        state = dict(self.__dict__)
+        state['_pool'] = None
+        return state
+
+
+def simulate_data(fitted_params_values,
+                  s,
+                  data_exp,
+                  pre_run=0,
+                  plan=None,
+                  condition_pool=None,
+                  pre_run_cache=None):
     """
     This function runs the model in the same conditions (and with the same time
     sampling) as the experimental data loaded in data_exp.
@@ -12,23 +630,34 @@ def simulate_data(fitted_params_values, s, data_exp, pre_run=0):
     :param fitted_params_values: list
         List of the values for the fitted parameters. It has to match the
         length of fitting parameters annotations.
-    :param s: Myokit.Simulation
-        Myokit simulation defined by the chosen model and protocol.
+    :param s: Myokit.Simulation or SimulationPool
+        Myokit simulation defined by the chosen model and protocol. If a
+        SimulationPool is provided, one of its simulations is used.
     :param data_exp: Data_exp
         Contains the data that the model is fitted too. See documentation for
         sabs_pkpd.load_data for further info
     :param pre_run: int
         Defines the time for which the model is run without returning output.
         Useful for reaching (quasi-) steady-state
-    :return: output : list
-        List of the same shape as data_exp.times. It contains the model output
-        in the given conditions at the time points used to generate the
-        experimental data.
+    :param plan: FittingPlan
+        Plan compiled with compile_fitting_plan(data_exp, s). If not provided,
+        it is compiled at each call.
+    :param condition_pool: ConditionPool
+        Pool of worker processes used to run the experimental conditions in
+        parallel. If not provided, or if the pool cannot be used from the
+        current process, the conditions are run serially with s.
+    :param pre_run_cache: PreRunCache
+        Cache of the states reached at the end of the pre-run, used when the
+        conditions are run serially.
+    :return: output : RaggedArray
+        Of the same shape as data_exp.times. output[k] contains the model
+        output in the k-th experimental condition at the time points used to
+        generate the experimental data, and output.flat the outputs for all
+        conditions concatenated. With several read outs, the outputs at each
+        time point are stored one after the other, so that output[k] can be
+        reshaped to (number of time points, number of read outs).
     """
 
-    # Allocate memory for the output
-    output = []
-
     # Verify that the parameters for fitting and their values have the same
     # length
     if len(fitted_params_values) != \
@@ -36,67 +665,325 @@ def simulate_data(fitted_params_values, s, data_exp, pre_run=0):
         raise ValueError('Fitted parameters annotations and values should '
                          'have the same length')
 
-    # Run the model solving for all experiment conditions
-    for k in range(0, len(set(data_exp.exp_conds))):
-        s.reset()
-        # reset timer
-        s.set_time(0)
+    if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+        with s.simulation() as pool_simulation:
+            return simulate_data(fitted_params_values,
+                                 pool_simulation,
+                                 data_exp,
+                                 pre_run,
+                                 plan,
+                                 condition_pool,
+                                 pre_run_cache)
+
+    if plan is None:
+        plan = compile_fitting_plan(data_exp, s)
+
+    stats = sabs_pkpd.constants.fit_stats
+    if condition_pool is not None and condition_pool.is_available():
+        if stats is None:
+            return condition_pool.simulate(fitted_params_values, plan,
+                                           pre_run)
+        # The phases of the workers are counted as run
+        start = time.perf_counter()
+        try:
+            return condition_pool.simulate(fitted_params_values, plan,
+                                           pre_run)
+        except myokit.SimulationError:
+            stats.n_failures += 1
+            raise
+        finally:
+            stats.n_simulations += len(plan.exp_conds)
+            stats.add('run', start)
 
-        # Set initial value of state variable parameters
-        if sabs_pkpd.constants.default_state is not None:
-            state_to_set = sabs_pkpd.constants.default_state
-        else:
-            state_to_set = s.state()
+    # Allocate memory for the output
+    output = sabs_pkpd.ragged_array.RaggedArray(plan.lengths)
+
+    # Run the model solving for all experiment conditions. The output of the
+    # solver is copied in place in the buffer
+    for k, exp_cond in enumerate(plan.exp_conds):
+        if stats is not None:
+            stats.n_simulations += 1
+        try:
+            output[k] = _simulate_condition(s,
+                                            plan,
+                                            fitted_params_values,
+                                            exp_cond,
+                                            plan.times[k],
+                                            plan.durations[k],
+                                            pre_run,
+                                            pre_run_cache)
+        except myokit.SimulationError:
+            if stats is not None:
+                stats.n_failures += 1
+            raise
 
-        for i in range(0,
-                       len(data_exp.fitting_instructions.fitted_params_annot)):
-            if sabs_pkpd.pints_problem_def.parameter_is_state(
-                    data_exp.fitting_instructions.fitted_params_annot[i],
-                    s):
-                index = sabs_pkpd.pints_problem_def.find_index_of_state(
-                    data_exp.fitting_instructions.fitted_params_annot[i],
-                    s)
-                state_to_set[index] = fitted_params_values[i]
+    return output
 
-        # Set the value of the initial state to what it should be
-        s.set_state(state_to_set)
 
-        # Set constant parameters values.
-        for i in range(0,
-                       len(data_exp.fitting_instructions.fitted_params_annot)):
-            if not sabs_pkpd.pints_problem_def.parameter_is_state(
-                    data_exp.fitting_instructions.fitted_params_annot[i],
-                    s):
-                s.set_constant(
-                    data_exp.fitting_instructions.fitted_params_annot[i],
-                    fitted_params_values[i])
+def sensitivity_simulation(s, plan):
+    """
+    Compiles a copy of s which computes the sensitivities of the read out of
+    the plan with respect to each of its parameters, using myokit's forward
+    sensitivities. The sensitivities with respect to parameters which are
+    state variables are computed with respect to their initial value.
+
+    :param s: myokit.Simulation or SimulationPool
+        Simulation of the model. Its model, protocol and tolerance are copied.
+    :param plan: FittingPlan
+        Plan defining the read out and the parameters.
+    :return: s_sensitivities : myokit.Simulation
+    """
+    if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+        s = s.template
 
-        # set the right experimental conditions
-        s.set_constant(data_exp.fitting_instructions.exp_cond_param_annot,
-                       list(data_exp.exp_conds)[k])
+    independents = list(plan.params_annot)
+    for i, index in plan.state_params:
+        independents[i] = 'init(' + plan.params_annot[i] + ')'
+    protocols = dict(zip(s._pacing_labels, s._protocols))
 
-        # Eventually run a pre-run to reach steady-state
+    s_sensitivities = myokit.Simulation(
+        s._model, protocols, sensitivities=(plan.read_outs, independents))
+    s_sensitivities.set_tolerance(*s._tolerance)
+
+    return s_sensitivities
+
+
+def simulate_data_sensitivities(fitted_params_values,
+                                s,
+                                data_exp,
+                                pre_run=0,
+                                plan=None):
+    """
+    This function runs the model in the same conditions as the experimental
+    data loaded in data_exp, and returns the model output together with its
+    derivatives with respect to the fitted parameters.
+
+    :param fitted_params_values: list
+        Contains the values of the fitted parameters.
+    :param s: Myokit.Simulation
+        Simulation compiled with sensitivity_simulation(s, plan).
+    :param data_exp: Data_exp
+        Contains the data that the model is fitted too. See documentation for
+        sabs_pkpd.load_data for further info
+    :param pre_run: int
+        Defines the time for which the model is run without returning output.
+        Not supported when some of the fitted parameters are state variables.
+    :param plan: FittingPlan
+        Plan compiled with compile_fitting_plan(data_exp, s). If not provided,
+        it is compiled at each call.
+    :return: output : RaggedArray
+        output[k] contains the model output for the k-th experimental
+        condition.
+    :return: derivatives : numpy.array
+        Array of shape (len(output.flat), number of fitted parameters).
+        derivatives[i, j] is the derivative of output.flat[i] with respect to
+        the j-th fitted parameter. With several read outs, the derivatives of
+        the outputs at each time point are stored one after the other.
+    """
+    if len(fitted_params_values) != \
+            len(data_exp.fitting_instructions.fitted_params_annot):
+        raise ValueError('Fitted parameters annotations and values should '
+                         'have the same length')
+
+    if plan is None:
+        plan = compile_fitting_plan(data_exp, s)
+
+    if s._sensitivities is None or \
+            len(s._sensitivities[1]) != len(plan.params_annot):
+        raise ValueError('The simulation does not compute the sensitivities '
+                         'with respect to the fitted parameters. See '
+                         'sensitivity_simulation')
+
+    if pre_run and plan.state_params:
+        raise ValueError('The sensitivities with respect to state variables '
+                         'cannot be computed with a pre-run')
+
+    # Sensitivities of the state at time 0: 1 for the initial value of the
+    # fitted state variables, 0 otherwise
+    n_states = len(s.default_state())
+    initial_sensitivities = [[0.0] * n_states for p in plan.params_annot]
+    for i, index in plan.state_params:
+        initial_sensitivities[i][index] = 1.0
+
+    output = sabs_pkpd.ragged_array.RaggedArray(plan.lengths)
+    derivatives = np.empty((len(output.flat), len(plan.params_annot)))
+    for k, exp_cond in enumerate(plan.exp_conds):
+        # The pre-run overwrites the default state sensitivities, restore
+        # them before resetting the simulation
+        s._s_default_state = [list(x) for x in initial_sensitivities]
+        plan.set_parameters(s, fitted_params_values, exp_cond)
         s.pre(pre_run)
 
-        # Run the simulation with starting parameters
-        a = s.run(data_exp.times[k][-1] * 1.00001, log_times=data_exp.times[k])
+        log, sensitivities = s.run(plan.durations[k],
+                                   log=plan.log,
+                                   log_times=plan.times[k])
+        output[k] = _read_outputs(plan, log)
+        derivatives[output.offsets[k]:output.offsets[k + 1]] = \
+            np.reshape(sensitivities, (-1, len(plan.params_annot)))
 
-        # Convert output in concentration
-        output.append(
-            list(a[data_exp.fitting_instructions.sim_output_param_annot]))
+    return output, derivatives
 
-    return output
+
+def sum_of_squares_with_early_stop(fitted_params_values,
+                                   s,
+                                   data_exp,
+                                   threshold,
+                                   n_chunks=10,
+                                   pre_run=0,
+                                   plan=None,
+                                   pre_run_cache=None):
+    """
+    This function computes the sum of squares between the model output and
+    the experimental data, simulating each experimental condition in time
+    chunks. The simulation is aborted as soon as the partial sum of squares
+    exceeds threshold. If the data has weights, the squared residuals are
+    multiplied by the weights of their time samples.
+
+    :param fitted_params_values: list
+        List of the values for the fitted parameters. It has to match the
+        length of fitting parameters annotations.
+    :param s: Myokit.Simulation or SimulationPool
+        Myokit simulation defined by the chosen model and protocol. If a
+        SimulationPool is provided, one of its simulations is used.
+    :param data_exp: Data_exp
+        Contains the data that the model is fitted too. See documentation for
+        sabs_pkpd.load_data for further info
+    :param threshold: float
+        Value of the sum of squares above which the simulation is aborted.
+    :param n_chunks: int
+        Number of chunks in which the time points of each experimental
+        condition are split.
+    :param pre_run: int
+        Defines the time for which the model is run without returning output.
+        Useful for reaching (quasi-) steady-state
+    :param plan: FittingPlan
+        Plan compiled with compile_fitting_plan(data_exp, s). If not provided,
+        it is compiled at each call.
+    :param pre_run_cache: PreRunCache
+        Cache of the states reached at the end of the pre-run.
+    :return: error, completed : tuple
+        The sum of squares, and whether all the conditions were simulated. If
+        the simulation was aborted, error is the partial sum of squares
+        extrapolated to all the time points, in proportion of their weights
+        if the data has weights, which is always higher than threshold.
+    """
+    if len(fitted_params_values) != \
+            len(data_exp.fitting_instructions.fitted_params_annot):
+        raise ValueError('Fitted parameters annotations and values should '
+                         'have the same length')
+
+    if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+        with s.simulation() as pool_simulation:
+            return sum_of_squares_with_early_stop(fitted_params_values,
+                                                  pool_simulation,
+                                                  data_exp,
+                                                  threshold,
+                                                  n_chunks,
+                                                  pre_run,
+                                                  plan,
+                                                  pre_run_cache)
+
+    if plan is None:
+        plan = compile_fitting_plan(data_exp, s)
+
+    stats = sabs_pkpd.constants.fit_stats
+    error = 0
+    if data_exp.weights is not None:
+        # Weight of the time samples simulated so far, and in total
+        weight_done = 0
+        total_weight = sum(np.sum(data_exp.weights[k])
+                           for k in range(len(plan.exp_conds)))
+    for k, exp_cond in enumerate(plan.exp_conds):
+        if stats is not None:
+            stats.n_simulations += 1
+            start = time.perf_counter()
+        plan.set_parameters(s, fitted_params_values, exp_cond)
+        if stats is not None:
+            start = stats.add('set_parameters', start)
+
+        # Eventually run a pre-run to reach steady-state
+        if pre_run_cache is None:
+            s.pre(pre_run)
+        else:
+            pre_run_cache.pre(s, plan, fitted_params_values, exp_cond,
+                              pre_run)
+        if stats is not None:
+            start = stats.add('pre_run', start)
+
+        times = np.asarray(plan.times[k])
+        values = np.asarray(data_exp.values[k])
+        if data_exp.weights is not None:
+            weights = np.repeat(data_exp.weights[k], plan.n_outputs)
+        chunks = np.array_split(np.arange(len(times)),
+                                min(n_chunks, len(times)))
+        for j, chunk in enumerate(chunks):
+            # Each chunk is run until the first time point of the next one
+            if j < len(chunks) - 1:
+                end = times[chunks[j + 1][0]]
+            else:
+                end = plan.durations[k]
+            try:
+                a = s.run(end - s.time(), log=plan.log,
+                          log_times=times[chunk])
+            except myokit.SimulationError:
+                if stats is not None:
+                    stats.n_failures += 1
+                raise
+            if stats is not None:
+                start = stats.add('run', start)
+            squared_residuals = (np.asarray(_read_outputs(plan, a)) -
+                                 values[chunk].ravel()) ** 2
+            if data_exp.weights is not None:
+                squared_residuals *= weights[chunk[0] * plan.n_outputs:
+                                             (chunk[-1] + 1) *
+                                             plan.n_outputs]
+                weight_done += np.sum(data_exp.weights[k][chunk])
+            error += np.sum(squared_residuals)
+            if stats is not None:
+                start = stats.add('output', start)
+            if error > threshold:
+                # Extrapolate the partial error to all the time points, in
+                # proportion of their weight if the data has weights
+                if data_exp.weights is not None:
+                    return error * total_weight / weight_done, False
+                n_done = sum(plan.lengths[:k]) + \
+                    (chunk[-1] + 1) * plan.n_outputs
+                return error * sum(plan.lengths) / n_done, False
+
+    return error, True
+
+
+def _check_log_window(log_window, time_max, time_samples):
+    """
+    Verifies that the logging window is within (0, time_max) and contains
+    the time samples, and returns the time at which logging starts.
+    """
+    if log_window is None:
+        return None
+    if len(log_window) != 2 or not \
+            0 <= log_window[0] < log_window[1] <= time_max:
+        raise ValueError('The log window must be provided as (start, end), '
+                         'with 0 <= start < end <= time_max. Got ' +
+                         str(log_window))
+    if time_samples is not None:
+        if np.min(time_samples) < log_window[0] or \
+                np.max(time_samples) > log_window[1]:
+            raise ValueError('The time samples have to be within the log '
+                             'window ' + str(log_window))
+    return log_window[0]
 
 
 def quick_simulate(s,
                    time_max,
-                   read_out: str,
+                   read_out,
                    exp_cond_param_annot=None,
                    exp_cond_param_values=None,
                    fixed_params_annot=None,
                    fixed_params_values=None,
                    pre_run=0,
-                   time_samples=None):
+                   time_samples=None,
+                   plan=None,
+                   log_window=None):
 
     """
     This function returns a simulation for any desired conditions.
@@ -106,15 +993,16 @@ def quick_simulate(s,
     either reset manually the constant's value (s.set_constant()) or reload the
     mmt model.
 
-    :param s: Myokit.Simulation
-        Myokit simulation defined by the chosen model and protocol.
+    :param s: Myokit.Simulation or SimulationPool
+        Myokit simulation defined by the chosen model and protocol. If a
+        SimulationPool is provided, one of its simulations is used.
 
     :param time_max: int
         Maximal time for which the model is run
 
-    :param read_out: str
+    :param read_out: str or list of str
         MMT model annotation of the variable read out as output from the model
-        simulation.
+        simulation. A list of annotations to read out several variables.
 
     :param exp_cond_param_annot: str
         MMT model annotation of the experimental condition varying when
@@ -139,10 +1027,22 @@ def quick_simulate(s,
     :param time_samples: list
         time points for which the model output is returned.
 
-    :return: output : list
-        List of shape (len(experimental condition values), time_samples). It
+    :param plan: FittingPlan
+        Plan compiled for s, fixed_params_annot, read_out and
+        exp_cond_param_annot. If not provided, it is compiled at each call.
+
+    :param log_window: tuple
+        (start, end) times of the window in which the output is logged, for
+        example the last beat. The simulation is run without logging until
+        start. If time_samples is not specified, 100 points linearly spaced
+        in the window are returned.
+
+    :return: output : RaggedArray
+        Of shape (len(experimental condition values), time_samples). It
         contains the model output in the given conditions at the time points
-        used to generate the experimental data.
+        used to generate the experimental data. With several read outs,
+        output[k] has len(time_samples) * len(read_out) values, the read outs
+        at each time point being stored one after the other.
     """
     if sabs_pkpd.constants.default_state is None:
         print('No default state was provided in '
@@ -154,6 +1054,8 @@ def quick_simulate(s,
             raise ValueError('The time samples have to be within the range '
                              '(0 , time_max)')
 
+    log_start = _check_log_window(log_window, time_max, time_samples)
+
     if fixed_params_values is not None or fixed_params_annot is not None:
         if len(fixed_params_annot) != len(fixed_params_values):
             raise ValueError('The parameters clamped for the simulation must '
@@ -172,78 +1074,233 @@ def quick_simulate(s,
                              'have the same length for names and values')
 
     if time_samples is None:
-        time_samples = np.linspace(0, time_max, 100)
+        if log_window is None:
+            time_samples = np.linspace(0, time_max, 100)
+        else:
+            time_samples = np.linspace(log_window[0], log_window[1], 100)
+
+    if isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+        with s.simulation() as pool_simulation:
+            return quick_simulate(pool_simulation,
+                                  time_max,
+                                  read_out,
+                                  exp_cond_param_annot,
+                                  exp_cond_param_values,
+                                  fixed_params_annot,
+                                  fixed_params_values,
+                                  pre_run,
+                                  time_samples,
+                                  plan,
+                                  log_window)
+
+    if plan is None:
+        if fixed_params_annot is None:
+            plan = FittingPlan(s, [], read_out, exp_cond_param_annot)
+        else:
+            plan = FittingPlan(s,
+                               fixed_params_annot,
+                               read_out,
+                               exp_cond_param_annot)
 
     # Prepare variable for the output
-    output = []
+    if exp_cond_param_values is not None:
+        n_runs = len(exp_cond_param_values)
+    else:
+        n_runs = 1
+    output = sabs_pkpd.ragged_array.RaggedArray(
+        [len(time_samples) * plan.n_outputs] * n_runs)
 
     # Run the model solving for all experiment conditions
     # In case the user wants some parameter to vary between simulations
     if exp_cond_param_values is not None:
         for k, exp_val in enumerate(exp_cond_param_values):
-            s.reset()
-            # reset timer
-            s.set_time(0)
-
-            # Set initial value of state variable parameters
-            if sabs_pkpd.constants.default_state is not None:
-                state_to_set = sabs_pkpd.constants.default_state
-            else:
-                state_to_set = s.state()
-            if fixed_params_annot is not None:
-                for i, annot in enumerate(fixed_params_annot):
-                    if sabs_pkpd.pints_problem_def.\
-                            parameter_is_state(annot, s):
-                        index = sabs_pkpd.pints_problem_def.\
-                            find_index_of_state(annot, s)
-                        state_to_set[index] = fixed_params_values[i]
-                    else:
-                        s.set_constant(annot, fixed_params_values[i])
-
-            s.set_state(state_to_set)
-
-            # set the right experimental conditions
-            s.set_constant(exp_cond_param_annot, exp_val)
+            plan.set_parameters(s, fixed_params_values, exp_val)
 
             # Eventually run a pre-run to reach steady-state
             s.pre(pre_run)
 
             # Run the simulation with starting parameters
-            a = s.run(time_max * 1.000001, log_times=time_samples)
-            # Convert output in concentration
-            output.append(list(a[read_out]))
+            a = _run_logged(s, plan, time_max * 1.000001, time_samples,
+                            log_start)
+            output[k] = _read_outputs(plan, a)
     else:
-        s.reset()
-
-        # Set initial value of state variable parameters
-        if sabs_pkpd.constants.default_state is not None:
-            state_to_set = sabs_pkpd.constants.default_state
-        else:
-            state_to_set = s.state()
-        # reset timer
-        s.set_time(0)
-
-        # Set parameters for simulation
-        if fixed_params_annot is not None:
-            for i, annot in enumerate(fixed_params_annot):
-                if sabs_pkpd.pints_problem_def.parameter_is_state(annot, s):
-                    index = sabs_pkpd.pints_problem_def.\
-                        find_index_of_state(annot, s)
-                    state_to_set[index] = fixed_params_values[i]
-                else:
-                    s.set_constant(annot, fixed_params_values[i])
-
-        # Set the state to the value corresponding to the eventual clamp or exp
-        # condition
-        s.set_state(state_to_set)
+        # Set the parameters for simulation
+        plan.set_parameters(s, fixed_params_values)
 
         # Eventually run a pre-run to reach steady-state
         s.pre(pre_run)
 
         # Run the simulation with starting parameters
-        a = s.run(time_max * 1.00001, log_times=time_samples)
-        # Convert output in concentration
-        output.append(list(a[read_out]))
+        a = _run_logged(s, plan, time_max * 1.00001, time_samples,
+                        log_start)
+        output[0] = _read_outputs(plan, a)
+
+    return output
+
+
+def _simulate_batch_chunk(s, plan, params_chunk, exp_conds, time_samples,
+                          duration, pre_run, log_start):
+    """
+    Runs the model for a chunk of parameter sets and all the experimental
+    conditions, and returns the read out as an array of shape
+    (len(params_chunk), len(exp_conds), len(time_samples)).
+    """
+    output = np.empty((len(params_chunk), len(exp_conds), len(time_samples)),
+                      dtype=np.float64)
+    for i, params_values in enumerate(params_chunk):
+        for k, exp_cond in enumerate(exp_conds):
+            plan.set_parameters(s, params_values, exp_cond)
+            s.pre(pre_run)
+            a = _run_logged(s, plan, duration, time_samples, log_start)
+            output[i, k, :] = a[plan.read_out]
+    return output
+
+
+def _simulate_batch_chunk_in_worker(task):
+    default_state = task[-1]
+    sabs_pkpd.constants.default_state = default_state
+    return _simulate_batch_chunk(_worker_simulation, *task[:-1])
+
+
+def _simulate_batch_chunk_in_pool(pool, task):
+    with pool.simulation() as s:
+        return _simulate_batch_chunk(s, *task)
+
+
+def quick_simulate_batch(s,
+                         time_max,
+                         read_out: str,
+                         fixed_params_annot,
+                         fixed_params_values,
+                         exp_cond_param_annot=None,
+                         exp_cond_param_values=None,
+                         pre_run=0,
+                         time_samples=None,
+                         chunk_size=None,
+                         condition_pool=None,
+                         progress=None,
+                         log_window=None):
+    """
+    This function runs the model for many sets of parameters values and
+    experimental conditions, and returns the outputs in a single array.
+
+    :param s: Myokit.Simulation or SimulationPool
+        Myokit simulation defined by the chosen model and protocol. If a
+        SimulationPool is provided, a simulation is checked out for each
+        chunk.
+
+    :param time_max: int
+        Maximal time for which the model is run
+
+    :param read_out: str
+        MMT model annotation of the variable read out as output from the model
+        simulation.
+
+    :param fixed_params_annot: list of str
+        List of the P MMT model annotations of the constants set for the
+        simulations.
+
+    :param fixed_params_values: numpy.array
+        Array of shape (N, P). Each row contains one set of values for the
+        constants annotated with fixed_params_annot.
+
+    :param exp_cond_param_annot: str
+        MMT model annotation of the experimental condition.
+
+    :param exp_cond_param_values: list
+        List of the M values for the experimental condition in which the model
+        should be run. If not specified, the model is run once per parameter
+        set without changing the experimental condition (M = 1).
+
+    :param pre_run: int
+        Defines the time for which the model is run without returning output.
+        Useful for reaching (quasi-) steady-state
+
+    :param time_samples: list
+        The T time points for which the model output is returned. If not
+        specified, 100 points linearly spaced between 0 and time_max.
+
+    :param chunk_size: int
+        Number of parameter sets simulated in one go, and sent to a worker
+        process when condition_pool is used. If not specified, the parameter
+        sets are split in 4 chunks per worker.
+
+    :param condition_pool: ConditionPool
+        Pool of worker processes over which the chunks are spread. If not
+        provided, or if the pool cannot be used from the current process,
+        the chunks are run serially with s.
+
+    :param progress: function
+        Called as progress(n_done, N) each time a chunk is completed.
+
+    :param log_window: tuple
+        (start, end) times of the window in which the output is logged. See
+        quick_simulate.
+
+    :return: output : numpy.array
+        Array of shape (N, M, T) and dtype float64. output[i, k] contains the
+        model output for the i-th set of parameters in the k-th experimental
+        condition.
+    """
+    fixed_params_values = np.asarray(fixed_params_values, dtype=np.float64)
+    if fixed_params_values.ndim != 2 or \
+            fixed_params_values.shape[1] != len(fixed_params_annot):
+        raise ValueError('The parameters values must be provided as an array '
+                         'of shape (number of parameter sets, ' +
+                         str(len(fixed_params_annot)) + '). Got shape ' +
+                         str(np.shape(fixed_params_values)))
+
+    # Use the same simulation durations as quick_simulate
+    if exp_cond_param_values is not None:
+        if not isinstance(exp_cond_param_annot, str):
+            raise ValueError('The parameter annotation must be a string '
+                             'matching with the variable name in the MMT '
+                             'model')
+        exp_conds = list(exp_cond_param_values)
+        duration = time_max * 1.000001
+    else:
+        exp_conds = [None]
+        duration = time_max * 1.00001
+
+    if time_samples is not None and time_samples[-1] > time_max:
+        raise ValueError('The time samples have to be within the range '
+                         '(0 , time_max)')
+    log_start = _check_log_window(log_window, time_max, time_samples)
+    if time_samples is None:
+        if log_window is None:
+            time_samples = np.linspace(0, time_max, 100)
+        else:
+            time_samples = np.linspace(log_window[0], log_window[1], 100)
+
+    plan = FittingPlan(s, fixed_params_annot, read_out, exp_cond_param_annot)
+
+    use_pool = condition_pool is not None and condition_pool.is_available()
+    n_sets = len(fixed_params_values)
+    if chunk_size is None:
+        n_workers = condition_pool.n_workers if use_pool else 1
+        chunk_size = max(1, int(np.ceil(n_sets / (4 * n_workers))))
+    starts = range(0, n_sets, chunk_size)
+    tasks = [(plan, fixed_params_values[start:start + chunk_size], exp_conds,
+              time_samples, duration, pre_run, log_start)
+             for start in starts]
+
+    if use_pool:
+        default_state = sabs_pkpd.constants.default_state
+        chunks = condition_pool.map(
+            _simulate_batch_chunk_in_worker,
+            [task + (default_state, ) for task in tasks])
+    elif isinstance(s, sabs_pkpd.simulation_pool.SimulationPool):
+        chunks = (_simulate_batch_chunk_in_pool(s, task) for task in tasks)
+    else:
+        chunks = (_simulate_batch_chunk(s, *task) for task in tasks)
+
+    # Fill in the output as the chunks are completed
+    output = np.empty((n_sets, len(exp_conds), len(time_samples)),
+                      dtype=np.float64)
+    for start, chunk in zip(starts, chunks):
+        output[start:start + len(chunk)] = chunk
+        if progress is not None:
+            progress(start + len(chunk), n_sets)
 
     return output
 
@@ -325,13 +1382,24 @@ def plot_model_vs_data(plotting_parameters_annot,
                                   time_samples=time_samples,
                                   pre_run=pre_run)
 
-        # Plot the results
-        plt.plot(time_samples, sim_data[0], label='Simulated values')
-        plt.plot(time_samples, data_exp.values[i], label='Experimental data')
+        # Plot the results, each read out against its column of the data
+        if isinstance(read_out, str):
+            plt.plot(time_samples, sim_data[0], label='Simulated values')
+            plt.plot(time_samples, data_exp.values[i],
+                     label='Experimental data')
+            plt.ylabel(read_out)
+        else:
+            simulated = np.reshape(sim_data[0], (len(time_samples), -1))
+            values = np.reshape(data_exp.values[i], (len(time_samples), -1))
+            for j, annot in enumerate(read_out):
+                plt.plot(time_samples, simulated[:, j],
+                         label='Simulated ' + annot)
+                plt.plot(time_samples, values[:, j],
+                         label='Experimental data ' + annot)
+            plt.ylabel(', '.join(read_out))
         plt.title('Experimental conditions : ' + exp_cond_param_annot + ' = '
                   + str(exp_cond_param_values))
         plt.xlabel('Time')
-        plt.ylabel(data_exp.fitting_instructions.sim_output_param_annot)
         plt.legend()
 
     return 0
@@ -0,0 +1,186 @@
+import glob
+import hashlib
+import os
+import platform
+import sys
+import tempfile
+
+import myokit
+
+
+def default_cache_directory():
+    """
+    Returns the directory used by SimulationCache when none is specified. It
+    is read from the SABS_PKPD_CACHE environment variable if defined, and
+    is ~/.cache/sabs_pkpd/simulations otherwise.
+    """
+    directory = os.environ.get('SABS_PKPD_CACHE')
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'sabs_pkpd', 'simulations')
+    return directory
+
+
+class SimulationCache():
+    """
+    This class stores compiled myokit.Simulation objects on disk, so that
+    loading a model a second time does not need to parse the MMT file and
+    compile the C extension again.
+
+    Each simulation is stored as a zip file (see myokit.Simulation.from_path)
+    named after a hash of the content of the MMT file (model and protocol),
+    of the sensitivities, of the myokit version and of the platform. Editing
+    the MMT file or upgrading myokit therefore builds a new entry, and the
+    least recently used entries are deleted when the cache exceeds its size.
+
+    Attributes
+    ----------
+    directory : str
+        Directory in which the compiled simulations are stored.
+    max_bytes : int
+        Maximal total size of the stored simulations.
+    hits : int
+        Number of simulations loaded from the cache.
+    misses : int
+        Number of simulations compiled and added to the cache.
+    """
+    def __init__(self, directory=None, max_bytes=512 * 1024 ** 2):
+        """
+        :param directory: str
+            Directory in which the compiled simulations are stored. It is
+            created if needed. If not specified, see default_cache_directory.
+        :param max_bytes: int
+            Maximal total size of the stored simulations, 512 MB if not
+            specified.
+        """
+        if max_bytes <= 0:
+            raise ValueError('The maximal size of the cache must be positive.'
+                             ' Got ' + str(max_bytes))
+        if directory is None:
+            directory = default_cache_directory()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, filename, sensitivities=None):
+        """
+        Returns the key under which the simulation of the MMT file is stored.
+
+        :param filename: str
+            Path to the MMT file.
+        :param sensitivities: tuple
+            Sensitivities argument passed to myokit.Simulation.
+        :return: key : str
+        """
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+        h.update(repr(sensitivities).encode())
+        h.update(myokit.__version__.encode())
+        h.update(sys.version.encode())
+        h.update(platform.platform().encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.zip')
+
+    def load(self, filename, sensitivities=None):
+        """
+        Returns the simulation of the model and protocol of the MMT file,
+        loaded from the cache if possible, and compiled and stored in the
+        cache otherwise.
+
+        :param filename: str
+            Path to the MMT file.
+        :param sensitivities: tuple
+            Sensitivities argument passed to myokit.Simulation.
+        :return: s : myokit.Simulation
+        """
+        path = self._path(self.key(filename, sensitivities))
+        if os.path.isfile(path):
+            try:
+                s = myokit.Simulation.from_path(path)
+            except Exception:
+                # Incomplete or incompatible entry, build it again
+                os.remove(path)
+            else:
+                self.hits += 1
+                # Mark the entry as recently used
+                os.utime(path)
+                return s
+
+        self.misses += 1
+        model, prot, script = myokit.load(filename)
+
+        # Write to a temporary file first, so that other processes never
+        # load a partially written entry
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            s = myokit.Simulation(model, prot, sensitivities, path=tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict()
+        return s
+
+    def n_bytes(self):
+        """
+        Returns the total size of the stored simulations.
+        """
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.directory, '*.zip'))
+
+    def evict(self):
+        """
+        Deletes the least recently used simulations until the cache fits in
+        max_bytes.
+        """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        n_bytes = sum(entry[1] for entry in entries)
+        for mtime, size, path in entries:
+            if n_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            n_bytes -= size
+
+    def clear(self):
+        """
+        Deletes all the stored simulations.
+        """
+        for path in self._entries():
+            os.remove(path)
+
+    def prewarm(self, directory='./mmt_models'):
+        """
+        Compiles and stores the simulations of all the MMT files of the
+        directory which are not already in the cache.
+
+        :param directory: str
+            Directory containing the MMT files. ./mmt_models if not specified.
+        :return: n_built : int
+            Number of simulations compiled.
+        """
+        n_built = 0
+        for filename in sorted(glob.glob(os.path.join(directory, '*.mmt'))):
+            if not os.path.isfile(self._path(self.key(filename))):
+                self.load(filename)
+                n_built += 1
+        return n_built
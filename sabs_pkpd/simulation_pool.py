@@ -0,0 +1,96 @@
+import contextlib
+import pickle
+import queue
+import os
+
+
+class SimulationPool():
+    """
+    This class owns several independent copies of a myokit.Simulation, and
+    hands them out one at a time, so that simulations of the same model can
+    be run from several threads, or several fits can run side by side in the
+    same process.
+
+    The pool can be passed instead of a myokit.Simulation to
+    sabs_pkpd.run_model.simulate_data, quick_simulate, quick_simulate_batch
+    and to the PINTS model wrappers. Each call then checks out one of the
+    simulations for its duration. When a simulation is returned to the pool,
+    its constants, default state, state and time are reset to the ones of
+    the template simulation.
+
+    Attributes
+    ----------
+    template : myokit.Simulation
+        Simulation from which the copies were made. It is not handed out,
+        and is used to resolve the model annotations.
+    size : int
+        Number of simulations owned by the pool.
+    """
+    def __init__(self, s, size=None):
+        """
+        :param s: myokit.Simulation
+            Template simulation. The simulations of the pool are copies of s
+            (including its constants, default state and tolerance), each
+            compiled separately.
+        :param size: int
+            Number of simulations in the pool. If not specified, one per CPU.
+        """
+        if size is None:
+            size = os.cpu_count()
+        if size < 1:
+            raise ValueError('The simulation pool needs at least one '
+                             'simulation. Got size = ' + str(size))
+        self.template = s
+        self.size = size
+
+        # Values restored when a simulation is returned to the pool
+        self._default_state = s.default_state()
+        self._constants = [(var.qname(), value) for var, value in
+                           list(s._literals.items()) +
+                           list(s._parameters.items())]
+
+        self._available = queue.LifoQueue()
+        for i in range(size):
+            self._available.put(pickle.loads(pickle.dumps(s)))
+
+    @contextlib.contextmanager
+    def simulation(self, timeout=None):
+        """
+        Checks out one simulation from the pool, blocking until one is
+        available. To use as:
+
+            with pool.simulation() as s:
+                s.run(1000)
+
+        :param timeout: float
+            Maximal time to wait for a simulation, in seconds. If not
+            specified, waits as long as needed.
+        :return: s : myokit.Simulation
+        """
+        try:
+            s = self._available.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('No simulation of the pool became available '
+                               'within ' + str(timeout) + ' s')
+        try:
+            yield s
+        finally:
+            self._reset(s)
+            self._available.put(s)
+
+    def n_available(self):
+        """
+        Returns the number of simulations currently not checked out.
+        """
+        return self._available.qsize()
+
+    def _reset(self, s):
+        for var, value in self._constants:
+            s.set_constant(var, value)
+        s.set_default_state(self._default_state)
+        s.reset()
+
+    def __reduce__(self):
+        # The simulations are compiled again in the process unpickling the
+        # pool
+        return (self.__class__, (self.template, self.size))
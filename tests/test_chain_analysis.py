@@ -0,0 +1,129 @@
+import sabs_pkpd
+
+import os
+import shutil
+import tempfile
+import matplotlib.pyplot as plt
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_read_chain_chunks(self):
+        np.random.seed(1)
+        chain = np.random.normal(size=(25, 2))
+        directory = tempfile.mkdtemp()
+        try:
+            # CSV written by PINTS, and .npy file
+            csv_filename = os.path.join(directory, 'chain_0.csv')
+            np.savetxt(csv_filename, chain, delimiter=',',
+                       header='"p0","p1"', comments='')
+            npy_filename = os.path.join(directory, 'chain_0.npy')
+            np.save(npy_filename, chain)
+
+            for source in [csv_filename, npy_filename, chain]:
+                chunks = list(sabs_pkpd.chain_analysis.read_chain_chunks(
+                    source, chunk_size=10, start=3))
+                assert [len(chunk) for chunk in chunks] == [10, 10, 2]
+                assert np.allclose(np.concatenate(chunks), chain[3:])
+        finally:
+            shutil.rmtree(directory)
+
+        with self.assertRaises(ValueError) as context:
+            list(sabs_pkpd.chain_analysis.read_chain_chunks(chain, 0))
+        assert 'at least 1' in str(context.exception)
+
+    def test_tdigest(self):
+        np.random.seed(1)
+        x = np.random.standard_t(3, size=100000)
+        digest = sabs_pkpd.chain_analysis.TDigest()
+        for chunk in np.split(x, 20):
+            digest.update(chunk)
+        assert digest.n_samples == 100000
+        # Error on the rank of the estimated quantiles
+        q = np.array([0.001, 0.025, 0.5, 0.975, 0.999])
+        ranks = np.searchsorted(np.sort(x), digest.quantile(q)) / len(x)
+        assert np.all(np.abs(ranks - q) < 1e-3)
+        assert digest.quantile(0) == np.min(x)
+        assert digest.quantile(1) == np.max(x)
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.chain_analysis.TDigest().quantile(0.5)
+        assert 'any sample' in str(context.exception)
+
+    def test_chain_summary(self):
+        np.random.seed(1)
+        chains = np.random.multivariate_normal(
+            [1, 2, 3], [[1, 0.5, 0], [0.5, 2, 0], [0, 0, 0.1]],
+            size=(2, 10000))
+        chains[:, :, 0] += np.linspace(0, 5, 10000)
+
+        summaries = sabs_pkpd.chain_analysis.summarise_chains(
+            chains, chunk_size=999, start=1000, n_bins=64, trace_points=100)
+        summary = summaries[0]
+        x = chains[0, 1000:]
+        assert summary.n_samples == 9000
+        assert np.allclose(summary.mean(), np.mean(x, axis=0))
+        assert np.allclose(summary.covariance(), np.cov(x.T))
+        assert np.allclose(summary.quantiles([0.05, 0.5, 0.95]),
+                           np.quantile(x, [0.05, 0.5, 0.95], axis=0).T,
+                           atol=0.05)
+
+        # The bins cover the samples, and were widened as the first
+        # parameter drifted
+        edges, counts = summary.histogram(0)
+        assert np.sum(counts) == 9000
+        assert edges[0] <= np.min(x[:, 0]) and edges[-1] >= np.max(x[:, 0])
+        assert len(counts) <= 64
+        # Up to samples on the edges of the bins
+        assert np.sum(np.abs(counts - np.histogram(x[:, 0], edges)[0])) <= 4
+
+        iterations, trace = summary.trace()
+        assert 100 <= len(iterations) <= 200
+        assert iterations[0] == 1000
+        assert np.all(np.diff(iterations) == summary.stride)
+        assert np.array_equal(trace, chains[0, iterations])
+
+        # The summaries are plotted in place of the chains
+        sabs_pkpd.constants.data_exp.fitting_instructions = \
+            sabs_pkpd.load_data.FittingInstructions(['a', 'b'], 'c', 'd')
+        fig, axes = sabs_pkpd.pints_problem_def.plot_distribution_parameters(
+            summaries, [0, 0, 0], [10, 10, 10])
+        plt.close(fig)
+        fig, axes = sabs_pkpd.pints_problem_def.plot_MCMC_convergence(
+            summaries, [1, 2, 3], [10, 10, 10], [0, 0, 0])
+        plt.close(fig)
+
+        with self.assertRaises(ValueError) as context:
+            summary.update(np.zeros((3, 2)))
+        assert 'must have shape' in str(context.exception)
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.chain_analysis.summarise_chain(chains[0], start=10000)
+        assert 'more than 10000 iterations' in str(context.exception)
+
+    def test_decimate_minmax(self):
+        np.random.seed(1)
+        y = np.cumsum(np.random.normal(size=100001))
+        x = np.arange(len(y))
+        x_kept, y_kept = sabs_pkpd.chain_analysis.decimate_minmax(x, y, 1000)
+        assert len(x_kept) <= 1002
+        assert np.array_equal(y_kept, y[x_kept])
+        assert np.all(np.diff(x_kept) > 0)
+        assert x_kept[0] == 0 and x_kept[-1] == 100000
+
+        # The envelope of each bucket is kept
+        size = int(np.ceil(len(y) / 500))
+        for start in range(0, len(y), size):
+            bucket = y[start:start + size]
+            assert np.min(bucket) in y_kept and np.max(bucket) in y_kept
+
+        x_kept, y_kept = sabs_pkpd.chain_analysis.decimate_minmax(x, y, None)
+        assert len(x_kept) == len(y)
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.chain_analysis.decimate_minmax(x, y, 1)
+        assert 'At least 2 points' in str(context.exception)
+
+        fig, axes = sabs_pkpd.pints_problem_def.plot_MCMC_convergence(
+            y.reshape(1, -1, 1), [0], [1], [-1], max_points=100)
+        assert len(axes[0].lines[-1].get_xdata()) <= 102
+        plt.close(fig)
@@ -0,0 +1,54 @@
+import sabs_pkpd
+
+import shutil
+import tempfile
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_chain_store(self):
+        directory = tempfile.mkdtemp()
+        try:
+            samples = np.random.rand(3, 11, 2)
+            log_pdfs = np.random.rand(3, 11)
+            store = sabs_pkpd.chain_store.ChainStore(directory, 3, 2,
+                                                     chunk_size=4)
+            for i in range(6):
+                store.append(samples[:, i], log_pdfs[:, i])
+            store.checkpoint('state')
+            for i in range(6, 11):
+                store.append(samples[:, i], log_pdfs[:, i])
+            assert store.n_iterations() == 11
+
+            chains = store.chains()
+            assert chains.shape == (3, 11, 2)
+            assert np.array_equal(np.asarray(chains), samples)
+            assert np.array_equal(np.asarray(store.log_pdfs()), log_pdfs)
+            for key in [(1, slice(2, 9)),
+                        (slice(None), slice(None), 1),
+                        (2, slice(None, None, -1), 0),
+                        (slice(0, 2), 7, 1),
+                        (slice(None), [1, 9, 2])]:
+                assert np.array_equal(chains[key], samples[key])
+            assert np.array_equal(chains[1][3:, 0], samples[1][3:, 0])
+            assert np.array_equal(chains[0][0], samples[0][0])
+
+            # Reopening the store discards the iterations after the
+            # checkpoint
+            store = sabs_pkpd.chain_store.ChainStore(directory)
+            assert (store.n_chains, store.n_parameters) == (3, 2)
+            assert store.n_iterations() == 11
+            assert store.load_checkpoint() == 'state'
+            assert store.n_iterations() == 6
+            assert np.array_equal(np.asarray(store.chains()),
+                                  samples[:, :6])
+
+            with self.assertRaises(ValueError) as context:
+                store.append(np.zeros((2, 2)), np.zeros(2))
+            assert 'must have shape' in str(context.exception)
+            with self.assertRaises(ValueError) as context:
+                sabs_pkpd.chain_store.ChainStore(directory, 4, 2)
+            assert 'has 3 chains' in str(context.exception)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,45 @@
+import sabs_pkpd
+
+import pints
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_online_convergence(self):
+        np.random.seed(1)
+        chains = np.random.normal(size=(3, 1024, 2))
+        chains[0] += 0.3
+
+        monitor = sabs_pkpd.convergence.OnlineConvergence(3, 2)
+        assert np.all(np.isnan(monitor.rhat()))
+        assert np.array_equal(monitor.ess(), [0, 0])
+        for i in range(chains.shape[1]):
+            monitor.update(chains[:, i])
+        assert monitor.n_samples == 1024
+
+        # With a number of samples multiple of the batches, the split R-hat
+        # is the one of PINTS
+        assert np.allclose(monitor.rhat(), pints.rhat(chains))
+
+        # Independent samples: the ESS is close to the number of samples
+        ess = monitor.ess()
+        assert np.all(ess > 0.5 * 3 * 1024) and np.all(ess < 1.5 * 3 * 1024)
+
+        # Correlated samples
+        correlated = np.zeros((2, 8000, 1))
+        for i in range(1, 8000):
+            correlated[:, i] = 0.9 * correlated[:, i - 1] + \
+                np.random.normal(size=(2, 1))
+        monitor = sabs_pkpd.convergence.OnlineConvergence(2, 1)
+        for i in range(correlated.shape[1]):
+            monitor.update(correlated[:, i])
+        expected_ess = 2 * 8000 * 0.1 / 1.9
+        assert 0.5 * expected_ess < monitor.ess()[0] < 1.5 * expected_ess
+
+        assert monitor.has_converged(rhat_threshold=1.1)
+        assert not monitor.has_converged(rhat_threshold=1.1, ess_target=1e4)
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.convergence.OnlineConvergence(2, 1, n_batches=1)
+        assert 'at least 2' in str(context.exception)
@@ -0,0 +1,158 @@
+import sabs_pkpd
+
+import os
+import pints
+import pints.toy
+import shutil
+import tempfile
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_decimate_trace(self):
+        # Relaxations after voltage steps sampled at 20 kHz
+        times = np.arange(0, 2, 5e-5)
+        values = np.zeros(len(times))
+        for step, amplitude in [(0.2, 1), (0.9, -2), (1.5, 0.5)]:
+            after = times >= step
+            values[after] += amplitude * \
+                (1 - np.exp(-(times[after] - step) / 0.01))
+
+        kept = sabs_pkpd.decimation.decimate_trace(times, values, 1e-3)
+        assert kept[0] == 0 and kept[-1] == len(times) - 1
+        assert len(kept) < len(times) / 50
+        error = values - np.interp(times, times[kept], values[kept])
+        assert np.max(np.abs(error)) <= 1e-3
+        # The samples are denser right after the steps
+        assert np.sum((times[kept] >= 0.2) & (times[kept] < 0.25)) > \
+            np.sum((times[kept] >= 0.6) & (times[kept] < 0.85))
+
+        # The weights sum to the number of samples, and the weighted sum of
+        # a linear function of time is exact
+        weights = sabs_pkpd.decimation.decimation_weights(times, kept)
+        assert np.isclose(np.sum(weights), len(times))
+        assert np.isclose(np.sum(weights * (3 * times[kept] + 1)),
+                          np.sum(3 * times + 1))
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.decimation.decimate_trace(times, values, 0)
+        assert 'must be positive' in str(context.exception)
+
+    def test_weighted_error_measures(self):
+        model = pints.toy.LogisticModel()
+        times = np.linspace(0, 100, 50)
+        values = model.simulate([0.1, 50], times) + \
+            np.random.RandomState(1).normal(0, 1, len(times))
+        problem = pints.SingleOutputProblem(model, times, values)
+        x = [0.11, 48]
+
+        # With unit weights, the PINTS error and likelihood are recovered
+        error = sabs_pkpd.pints_problem_def.WeightedSumOfSquaresError(
+            problem, np.ones(len(times)))
+        expected = pints.SumOfSquaresError(problem)
+        assert np.isclose(error(x), expected(x))
+        assert np.allclose(error.evaluateS1(x)[1], expected.evaluateS1(x)[1])
+
+        log_likelihood = \
+            sabs_pkpd.pints_problem_def.WeightedGaussianLogLikelihood(
+                problem, np.ones(len(times)))
+        expected = pints.GaussianLogLikelihood(problem)
+        assert log_likelihood.n_parameters() == 3
+        assert np.isclose(log_likelihood(x + [2]), expected(x + [2]))
+        assert np.allclose(log_likelihood.evaluateS1(x + [2])[1],
+                           expected.evaluateS1(x + [2])[1])
+        assert log_likelihood(x + [-1]) == -np.inf
+
+        # Doubling the weights doubles the error
+        error = sabs_pkpd.pints_problem_def.WeightedSumOfSquaresError(
+            problem, 2 * np.ones(len(times)))
+        assert np.isclose(error(x), 2 * pints.SumOfSquaresError(problem)(x))
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.WeightedSumOfSquaresError(
+                problem, np.ones(3))
+        assert 'One weight per time sample' in str(context.exception)
+
+    def test_decimate_data_exp(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+
+        # Densely sampled synthetic data
+        times = [np.linspace(0, 5, 5001) for k in range(len(data_exp.times))]
+        dense = sabs_pkpd.load_data.Data_exp(
+            times, times, data_exp.exp_nums, data_exp.exp_conds,
+            data_exp.experiment_conds)
+        dense.fitting_instructions = data_exp.fitting_instructions
+        output = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, dense)
+        dense = sabs_pkpd.load_data.Data_exp(
+            times, output, data_exp.exp_nums, data_exp.exp_conds,
+            data_exp.experiment_conds)
+        dense.fitting_instructions = data_exp.fitting_instructions
+
+        decimated, report = sabs_pkpd.decimation.decimate_data_exp(dense,
+                                                                   1e-3)
+        assert report.n_samples == 10002
+        assert report.n_kept == len(decimated.times.flat)
+        assert report.compression_ratio > 20
+        assert report.max_error[0] <= 1e-3
+        assert report.rms_error[0] <= report.max_error[0]
+        assert decimated.fitting_instructions is dense.fitting_instructions
+        for k in range(len(dense.times)):
+            assert np.isclose(np.sum(decimated.weights[k]), 5001)
+
+        # The weighted sum of squares approximates the one of the full data
+        full = sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+            [0.12, 0.09], s, dense, np.inf)[0]
+        weighted = sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+            [0.12, 0.09], s, decimated, np.inf)[0]
+        assert abs(weighted - full) < 1e-2 * full
+
+        # With a constant residual, the penalty of a rejected parameter set
+        # is the full weighted sum of squares
+        shifted = sabs_pkpd.load_data.Data_exp(
+            list(decimated.times), [v + 0.1 for v in decimated.values],
+            decimated.exp_nums, decimated.exp_conds,
+            decimated.experiment_conds, list(decimated.weights))
+        shifted.fitting_instructions = decimated.fitting_instructions
+        full = sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+            [0.1, 0.1], s, shifted, np.inf)[0]
+        penalty, completed = \
+            sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+                [0.1, 0.1], s, shifted, 1e-3)
+        assert not completed
+        assert np.isclose(full, 0.01 * np.sum(decimated.weights.flat),
+                          rtol=1e-3)
+        assert np.isclose(penalty, full, rtol=1e-3)
+
+        # The weights round-trip through the binary format
+        directory = tempfile.mkdtemp()
+        try:
+            sabs_pkpd.load_data.save_data_exp(decimated, directory)
+            loaded = sabs_pkpd.load_data.load_data_exp(directory)
+            assert np.array_equal(loaded.weights.flat, decimated.weights.flat)
+            sabs_pkpd.load_data.save_data_exp(dense, directory)
+            assert not os.path.isfile(os.path.join(directory, 'weights.npy'))
+        finally:
+            shutil.rmtree(directory)
+
+        # Fitting the decimated data
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, decimated)
+        np.random.seed(19580)
+        found_parameters, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5], decimated, [0, 0], [1, 1], model=model,
+                log_to_screen=False)
+        assert np.linalg.norm(found_parameters - 0.1) < 0.01
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.MCMC_routine(
+                [np.array([0.1, 0.1, 0.01])], max_iter=10, model=model,
+                log_likelihood='StudentTLogLikelihood')
+        assert 'Only the GaussianLogLikelihood' in str(context.exception)
@@ -0,0 +1,82 @@
+import sabs_pkpd
+
+import pickle
+import pints
+import pints.toy
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_quadratic_surrogate(self):
+        np.random.seed(1)
+        x = np.random.uniform(size=(30, 2))
+        f = 1 + x[:, 0] - 2 * x[:, 0] * x[:, 1] + 3 * x[:, 1] ** 2
+
+        surrogate = sabs_pkpd.delayed_acceptance.QuadraticSurrogate(2)
+        assert surrogate.n_features() == 6
+        assert not surrogate.is_fitted()
+        surrogate.fit(x, f)
+        assert surrogate.is_fitted()
+        assert np.isclose(surrogate([2, -1]), 1 + 2 + 4 + 3)
+
+    def test_delayed_acceptance_mcmc(self):
+        # The log-likelihood of a constant model with known Gaussian noise is
+        # quadratic, so the surrogate is exact
+        np.random.seed(1)
+        values = 3 + np.random.normal(scale=0.5, size=(25, 1))
+        problem = pints.SingleOutputProblem(pints.toy.ConstantModel(1),
+                                            np.arange(25), values)
+        log_posterior = pints.LogPosterior(
+            pints.GaussianKnownSigmaLogLikelihood(problem, 0.5),
+            pints.UniformLogPrior([0], [10]))
+
+        sampler = sabs_pkpd.delayed_acceptance.DelayedAcceptanceMCMC(
+            log_posterior, [1])
+        assert np.isnan(sampler.agreement())
+        samples = []
+        for i in range(6000):
+            if i == 1000:
+                sampler.set_initial_phase(False)
+            x, log_pdf = sampler.step()
+            assert np.isclose(log_pdf, log_posterior(x))
+            samples.append(x[0])
+        samples = np.array(samples[1000:])
+
+        assert abs(np.mean(samples) - np.mean(values)) < 0.02
+        assert abs(np.std(samples) - 0.1) < 0.02
+        assert sampler.n_screened_out > 0
+        assert sampler.n_evaluations < sampler.n_proposals + 1
+        assert np.isclose(sampler.agreement(), 1)
+
+        # The posterior is not pickled with the sampler
+        sampler = pickle.loads(pickle.dumps(sampler))
+        sampler.set_log_posterior(log_posterior)
+        sampler.step()
+
+    def test_delayed_acceptance_mcmc_prior(self):
+        # With a Gaussian prior, the posterior of the constant is Gaussian
+        # with a precision equal to the sum of the precisions of the prior
+        # and of the likelihood
+        np.random.seed(1)
+        values = 3 + np.random.normal(scale=0.5, size=(25, 1))
+        problem = pints.SingleOutputProblem(pints.toy.ConstantModel(1),
+                                            np.arange(25), values)
+        log_posterior = pints.LogPosterior(
+            pints.GaussianKnownSigmaLogLikelihood(problem, 0.5),
+            pints.GaussianLogPrior(0, 0.1))
+        posterior_mean = np.sum(values) / 0.25 / (25 / 0.25 + 1 / 0.01)
+
+        sampler = sabs_pkpd.delayed_acceptance.DelayedAcceptanceMCMC(
+            log_posterior, [1])
+        samples = []
+        for i in range(6000):
+            if i == 1000:
+                sampler.set_initial_phase(False)
+            x, log_pdf = sampler.step()
+            samples.append(x[0])
+        samples = np.array(samples[1000:])
+
+        assert sampler.n_second_stage > 0
+        assert abs(np.mean(samples) - posterior_mean) < 0.02
+        assert abs(np.std(samples) - 200 ** -0.5) < 0.02
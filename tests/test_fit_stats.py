@@ -0,0 +1,85 @@
+import sabs_pkpd
+
+import pints
+import time
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_fit_stats(self):
+        stats = sabs_pkpd.fit_stats.FitStats()
+        start = time.perf_counter()
+        start = stats.add('run', start)
+        stats.add_evaluation(start)
+        assert stats.n_evaluations == 1
+        assert stats.times['run'] >= 0
+        assert stats.times['likelihood'] >= 0
+
+        with sabs_pkpd.fit_stats.recording(stats) as recorded:
+            assert sabs_pkpd.constants.fit_stats is stats
+            assert recorded is stats
+        assert sabs_pkpd.constants.fit_stats is None
+        assert stats.wall_time > 0
+        summary = stats.summary()
+        for phase in sabs_pkpd.fit_stats.PHASES + ['pints']:
+            assert phase in summary
+
+    def test_infer_params_stats(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, data_exp)
+
+        np.random.seed(19580)
+        inferred_params, found_value, stats = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5], data_exp, [0, 0], [1, 1], model=model,
+                log_to_screen=False, return_stats=True)
+        assert np.linalg.norm(inferred_params - 0.1) < 0.01
+        assert sabs_pkpd.constants.fit_stats is None
+        assert stats.n_evaluations > 0
+        assert stats.n_simulations == \
+            stats.n_evaluations * len(data_exp.exp_conds)
+        assert stats.n_failures == 0
+        for phase in ['set_parameters', 'run', 'output']:
+            assert stats.times[phase] > 0
+        assert stats.times['likelihood'] >= stats.times['run']
+        assert stats.wall_time >= stats.times['likelihood']
+
+        np.random.seed(1)
+        chains, stats = sabs_pkpd.pints_problem_def.MCMC_routine(
+            [np.array([0.1, 0.1, 0.01])], max_iter=200, model=model,
+            return_stats=True)
+        assert chains.shape == (1, 200, 3)
+        assert stats.n_evaluations > 0
+        assert stats.n_simulations > 0
+        assert sabs_pkpd.constants.fit_stats is None
+
+    def test_infer_params_stats_gradient(self):
+        # The evaluations of the gradient-based optimisers are recorded too
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModelS1(s, data_exp)
+
+        np.random.seed(1)
+        inferred_params, found_value, stats = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5], data_exp, [0, 0], [1, 1], model=model,
+                pints_method=pints.Adam, log_to_screen=False,
+                return_stats=True)
+        assert len(inferred_params) == 2
+        assert stats.n_evaluations > 0
+        assert stats.times['likelihood'] > 0
+        assert sabs_pkpd.constants.fit_stats is None
@@ -0,0 +1,47 @@
+import sabs_pkpd
+
+import matplotlib.pyplot as plt
+import numpy as np
+import scipy.stats as stats
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_linear_binning(self):
+        counts = sabs_pkpd.kde.linear_binning([0, 0.25, 1, 2], 0, 1, 3)
+        assert np.allclose(counts, [1.5, 0.5, 2])
+        assert np.sum(sabs_pkpd.kde.linear_binning(
+            np.random.uniform(size=100), 0, 1, 10)) == 100
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.kde.linear_binning([0, 1], 0, 1, 1)
+        assert 'at least 2 points' in str(context.exception)
+
+    def test_binned_kde(self):
+        np.random.seed(1)
+        x = np.concatenate([np.random.normal(size=5000),
+                            np.random.normal(4, 0.3, size=2000)])
+        points = np.linspace(-5, 8, 100)
+
+        # Same density and bandwidth as scipy.stats.gaussian_kde
+        kernel = stats.gaussian_kde(x)
+        density = sabs_pkpd.kde.binned_kde(x, points)
+        assert np.max(np.abs(density - kernel(points))) < \
+            1e-3 * np.max(kernel(points))
+        grid = np.linspace(np.min(x), np.max(x), 1024)
+        counts = sabs_pkpd.kde.linear_binning(x, grid[0], grid[-1], 1024)
+        assert np.isclose(sabs_pkpd.kde.binned_bandwidth(grid, counts),
+                          np.sqrt(kernel.covariance[0, 0]), rtol=1e-3)
+
+        density = sabs_pkpd.kde.binned_kde(x, points, bandwidth=0.5)
+        kernel = stats.gaussian_kde(x, bw_method=0.5 / np.std(x, ddof=1))
+        assert np.max(np.abs(density - kernel(points))) < \
+            1e-3 * np.max(kernel(points))
+
+        fig, ax = plt.subplots()
+        sabs_pkpd.pints_problem_def.hist_1d(x, ax)
+        plt.close(fig)
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.kde.binned_kde([1], points)
+        assert 'At least 2 samples' in str(context.exception)
@@ -18,3 +18,169 @@ def test_load_data_file():
                           np.transpose(np.array([0, 0.0198, 0.094, 0.1772,
                                                  0.4263, 0.5851, 0.7913,
                                                  0.9967])))
+
+
+def test_load_data_file_multi_output():
+    """Test a CSV file with several values columns is correctly loaded"""
+
+    a = sabs_pkpd.load_data.load_data_file(
+        './tests/test resources/load_data_multi_output_test.csv',
+        n_outputs=2)
+
+    assert np.array_equal(a.times[0], [0, 0.01, 0.05, 0.1, 0.3, 0.5, 1, 5])
+    assert a.values[0].shape == (8, 2)
+    assert np.array_equal(a.values[1][-1], [0.37037, 0.37037])
+    assert sorted(a.exp_conds) == [20, 37]
+
+    a.Add_fitting_instructions(['constants.unknown_cst'],
+                               'constants.T',
+                               ['comp1.y', 'comp1.x'])
+    assert a.fitting_instructions.n_outputs() == 2
+
+
+def _load_data_file_sorted(filename, n_outputs):
+    """Loads the CSV file as the rows sorted with sorted(), then grouped by
+    boolean masks"""
+    n_columns = 3 + n_outputs
+    data = np.loadtxt(filename, delimiter=',', skiprows=1)
+    data = np.array(sorted(data, key=lambda row: (row[n_columns - 1],
+                                                  row[0])))
+    exp_nums_list = list(set(data[:, n_columns - 2]))
+    exp_conds_list = list(set(data[:, n_columns - 1]))
+    times = []
+    values = []
+    for num in exp_nums_list:
+        temp = data[data[:, n_columns - 2] == num]
+        times.append(temp[:, 0])
+        if n_outputs == 1:
+            values.append(temp[:, 1])
+        else:
+            values.append(temp[:, 1:1 + n_outputs])
+    return exp_nums_list, exp_conds_list, times, values
+
+
+def test_load_data_file_chunks(tmp_path):
+    """Test the data is grouped and sorted as with a sort of the rows of the
+    whole file, whatever the size of the chunks parsed"""
+
+    np.random.seed(1)
+    for n_outputs in [1, 3]:
+        n_rows = 500
+        exp_nums = np.random.randint(20191106000, 20191106040, size=n_rows)
+        exp_conds = exp_nums % 7 * 10.5
+        times = np.random.randint(0, 50, size=n_rows) / 10
+        rows = np.column_stack([times,
+                                np.random.normal(size=(n_rows, n_outputs)),
+                                exp_nums,
+                                exp_conds])
+        filename = str(tmp_path / ('data_' + str(n_outputs) + '.csv'))
+        np.savetxt(filename, rows, delimiter=',', header='header',
+                   fmt='%.17g')
+
+        exp_nums_list, exp_conds_list, times, values = \
+            _load_data_file_sorted(filename, n_outputs)
+        for chunk_size in [100, 2 ** 24]:
+            a = sabs_pkpd.load_data.load_data_file(
+                filename, n_outputs=n_outputs, chunk_size=chunk_size)
+            assert a.exp_nums == exp_nums_list
+            assert a.exp_conds == exp_conds_list
+            for i in range(len(exp_nums_list)):
+                assert np.array_equal(a.times[i], times[i])
+                assert np.array_equal(a.values[i], values[i])
+
+    with pytest.raises(ValueError, match='at least 1'):
+        sabs_pkpd.load_data.load_data_file(filename, chunk_size=0)
+    with pytest.raises(ValueError, match='Too many columns'):
+        sabs_pkpd.load_data.load_data_file(filename)
+    with open(filename, 'w') as f:
+        f.write('header\n')
+    with pytest.raises(ValueError, match='does not contain any data'):
+        sabs_pkpd.load_data.load_data_file(filename)
+
+
+def test_save_load_data_exp(tmp_path):
+    """Test the data and its fitting instructions round-trip through the
+    binary format"""
+
+    for filename, n_outputs, output in [
+            ('load_data_test.csv', 1, 'comp1.y'),
+            ('load_data_multi_output_test.csv', 2, ['comp1.y', 'comp1.x'])]:
+        a = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/' + filename, n_outputs=n_outputs)
+        a.Add_fitting_instructions(['constants.unknown_cst'],
+                                   'constants.T',
+                                   output)
+        directory = str(tmp_path / filename)
+        sabs_pkpd.load_data.save_data_exp(a, directory)
+
+        for mmap in [True, False]:
+            b = sabs_pkpd.load_data.load_data_exp(directory, mmap=mmap)
+            assert isinstance(b.times.flat, np.memmap) == mmap
+            assert b.exp_nums == a.exp_nums
+            assert b.exp_conds == a.exp_conds
+            assert len(b.times) == len(a.times)
+            for k in range(len(a.times)):
+                assert np.array_equal(b.times[k], a.times[k])
+                assert np.array_equal(b.values[k], a.values[k])
+                assert b.values[k].shape == a.values[k].shape
+            assert b.fitting_instructions.fitted_params_annot == \
+                ['constants.unknown_cst']
+            assert b.fitting_instructions.exp_cond_param_annot == \
+                'constants.T'
+            assert b.fitting_instructions.sim_output_param_annot == output
+
+    # The loaded data is simulated as the CSV data
+    s = sabs_pkpd.load_model.load_simulation_from_mmt(
+        './tests/test resources/pints_problem_def_test.mmt')
+    a = sabs_pkpd.load_data.load_data_file(
+        './tests/test resources/load_data_test.csv')
+    a.Add_fitting_instructions(['constants.unknown_cst',
+                                'constants.unknown_cst2'],
+                               'constants.T',
+                               'comp1.y')
+    sabs_pkpd.load_data.save_data_exp(a, str(tmp_path / 'simulated'))
+    b = sabs_pkpd.load_data.load_data_exp(str(tmp_path / 'simulated'))
+    assert np.array_equal(
+        sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, b),
+        sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, a))
+
+    with pytest.raises(ValueError, match='No experimental data'):
+        sabs_pkpd.load_data.load_data_exp(str(tmp_path / 'missing'))
+
+
+def test_data_exp_contiguous():
+    """Test the data of all the experiments is stored in contiguous arrays
+    indexed by the offsets of the experiments"""
+
+    a = sabs_pkpd.load_data.Data_exp([[0, 1, 2], [0, 5]],
+                                     [[1., 2., 3.], [4., 5.]],
+                                     [1, 2], [20, 37], [37, 20])
+    assert np.array_equal(a.offsets, [0, 3, 5])
+    assert np.array_equal(a.times.flat, [0, 1, 2, 0, 5])
+    assert np.array_equal(a.values.flat, [1, 2, 3, 4, 5])
+    assert np.array_equal(a.values[1], [4, 5])
+    assert len(a.times) == 2
+    assert [len(times) for times in a.times] == [3, 2]
+    # The views write to the contiguous arrays
+    a.values[1][0] = 6
+    assert a.values.flat[3] == 6
+
+    # The condition of each experiment is used to simulate it
+    s = sabs_pkpd.load_model.load_simulation_from_mmt(
+        './tests/test resources/pints_problem_def_test.mmt')
+    a.Add_fitting_instructions(['constants.unknown_cst'], 'constants.T',
+                               'comp1.y')
+    plan = sabs_pkpd.run_model.compile_fitting_plan(a, s)
+    assert plan.exp_conds == [37, 20]
+
+    b = sabs_pkpd.load_data.load_data_file(
+        './tests/test resources/load_data_test.csv')
+    for k in range(len(b.times)):
+        assert b.experiment_conds[k] == b.exp_conds[k]
+    assert np.array_equal(b.values.flat, np.concatenate(b.values))
+
+    with pytest.raises(ValueError, match='same length'):
+        sabs_pkpd.load_data.Data_exp([[0, 1]], [[1.]], [1], [20])
+    with pytest.raises(ValueError, match='One experimental condition'):
+        sabs_pkpd.load_data.Data_exp([[0, 1]], [[1., 2.]], [1], [20],
+                                     [20, 37])
@@ -1,4 +1,10 @@
 import sabs_pkpd
+import functools
+import os
+import pickle
+import shutil
+import tempfile
+import pints
 import numpy as np
 import unittest
 
@@ -42,6 +48,20 @@ class Test(unittest.TestCase):
         print(inferred_params)
         assert np.linalg.norm(diff) < 0.01
 
+        # Aborting the simulations of bad parameter sets gives the same
+        # optimum
+        np.random.seed(19580)
+        inferred_params, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                initial_point,
+                sabs_pkpd.constants.data_exp,
+                boundaries_low,
+                boundaries_high,
+                early_rejection_factor=10,
+                n_chunks=4)
+        diff = inferred_params - np.array([0.1, 0.1])
+        assert np.linalg.norm(diff) < 0.01
+
         # Test exceptions
         wrong_initial_point = [0.5, 0.5, 1.0]
         with self.assertRaises(ValueError) as context:
@@ -73,6 +93,355 @@ class Test(unittest.TestCase):
                     wrong_boundaries_high)
         assert 'should have the same length' in str(context.exception)
 
+    def test_early_rejection_sum_of_squares(self):
+        sabs_pkpd.constants.s = sabs_pkpd.load_model.\
+            load_simulation_from_mmt(
+                './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        sabs_pkpd.constants.data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+
+        error_measure = \
+            sabs_pkpd.pints_problem_def.EarlyRejectionSumOfSquares(2)
+        assert error_measure.n_parameters() == 2
+        best = error_measure([0.1, 0.1])
+        assert error_measure.best_error == best
+        assert error_measure([0.9, 0.9]) > 2 * best
+        assert error_measure.n_rejected == 1
+        assert error_measure.n_evaluations == 2
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.EarlyRejectionSumOfSquares(2, 0.5)
+        assert 'must be at least 1' in str(context.exception)
+
+        # Rejected simulations have no gradient
+        with self.assertRaises(NotImplementedError) as context:
+            error_measure.evaluateS1([0.1, 0.1])
+        assert 'does not compute sensitivities' in str(context.exception)
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5], sabs_pkpd.constants.data_exp, [0, 0], [1, 1],
+                pints_method=pints.Adam, early_rejection_factor=10)
+        assert 'such as Adam' in str(context.exception)
+
+    def test_forward_model(self):
+        filename = './tests/test resources/pints_problem_def_test.mmt'
+        factory = functools.partial(
+            sabs_pkpd.load_model.load_simulation_from_mmt, filename)
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        other_data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        other_data_exp.Add_fitting_instructions(['constants.unknown_cst'],
+                                                'constants.T',
+                                                'comp1.y')
+
+        # Two models do not interfere, and do not use sabs_pkpd.constants
+        sabs_pkpd.constants.default_state = None
+        model = sabs_pkpd.pints_problem_def.ForwardModel(factory, data_exp)
+        other_model = sabs_pkpd.pints_problem_def.ForwardModel(
+            factory(), other_data_exp)
+        assert (model.n_parameters(), other_model.n_parameters()) == (2, 1)
+        out = model.simulate([0.1, 0.1], None)
+        other_out = other_model.simulate([0.1], None)
+        assert np.array_equal(model.simulate([0.1, 0.1], None), out)
+        expected = sabs_pkpd.run_model.simulate_data(
+            [0.1, 0.1], factory(), data_exp).flat
+        assert np.array_equal(out, expected)
+        assert len(other_out) == len(out)
+
+        # The model is rebuilt from the factory after pickling
+        copied = pickle.loads(pickle.dumps(model))
+        assert copied._s is None
+        assert np.array_equal(copied.simulate([0.1, 0.1], None), out)
+        copied = pickle.loads(pickle.dumps(other_model))
+        assert np.array_equal(copied.simulate([0.1], None), other_out)
+
+        # Identical parameters are simulated once with a memo
+        model.simulation_memo = sabs_pkpd.run_model.SimulationMemo()
+        assert np.array_equal(model.simulate([0.1, 0.1], None), out)
+        assert np.array_equal(model.simulate([0.1, 0.1], None), out)
+        assert (model.simulation_memo.hits,
+                model.simulation_memo.misses) == (1, 1)
+
+        np.random.seed(19580)
+        inferred_params, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params([0.5, 0.5],
+                                                     data_exp,
+                                                     [0, 0],
+                                                     [1, 1],
+                                                     model=model)
+        assert np.linalg.norm(inferred_params - np.array([0.1, 0.1])) < 0.01
+
+        chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+            [np.array([0.1, 0.1, 0.01])], max_iter=10, model=model)
+        assert chains.shape == (1, 10, 3)
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.ForwardModel(
+                factory,
+                sabs_pkpd.load_data.load_data_file(
+                    './tests/test resources/load_data_test.csv'))
+        assert 'fitting instructions' in str(context.exception)
+
+    def test_forward_model_s1(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        s.set_tolerance(1e-10, 1e-10)
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2', 'comp1.x'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModelS1(s, data_exp)
+
+        # The derivatives match finite differences
+        x = np.array([0.1, 0.1, 1])
+        out, derivatives = model.simulateS1(x, None)
+        assert np.allclose(out, model.simulate(x, None))
+        assert derivatives.shape == (len(out), 3)
+        for j in range(3):
+            dx = np.zeros(3)
+            dx[j] = 1e-5
+            finite_difference = (model.simulate(x + dx, None) -
+                                 model.simulate(x - dx, None)) / 2e-5
+            assert np.allclose(derivatives[:, j], finite_difference,
+                               rtol=1e-3, atol=1e-5)
+
+        # A pre-run is supported for the constants only
+        model.pre_run = 1
+        with self.assertRaises(ValueError) as context:
+            model.simulateS1(x, None)
+        assert 'cannot be computed with a pre-run' in str(context.exception)
+        model.pre_run = 0
+
+        # Gradient-based optimisation
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        copied = pickle.loads(pickle.dumps(model))
+        assert copied._s_sensitivities is None
+        inferred_params, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5],
+                data_exp,
+                [0, 0],
+                [1, 1],
+                pints_method=pints.IRPropMin,
+                model=copied)
+        assert np.linalg.norm(inferred_params - np.array([0.1, 0.1])) < 0.01
+
+    def test_multi_output(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_multi_output_test.csv',
+            n_outputs=2)
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            ['comp1.y', 'comp1.x'])
+        model = sabs_pkpd.pints_problem_def.ForwardModelS1(s, data_exp)
+        assert model.n_outputs() == 2
+        problem = sabs_pkpd.pints_problem_def.define_problem(model, data_exp)
+        assert isinstance(problem, pints.MultiOutputProblem)
+
+        out, derivatives = model.simulateS1([0.1, 0.1], None)
+        assert out.shape == (16, 2)
+        assert derivatives.shape == (16, 2, 2)
+
+        np.random.seed(19580)
+        inferred_params, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params([0.5, 0.5],
+                                                     data_exp,
+                                                     [0, 0],
+                                                     [1, 1],
+                                                     model=model)
+        assert np.linalg.norm(inferred_params - np.array([0.1, 0.1])) < 0.01
+
+        # One noise parameter per output
+        chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+            [np.array([0.1, 0.1, 0.01, 0.01])], max_iter=10, model=model)
+        assert chains.shape == (1, 10, 4)
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.MCMC_routine(
+                [np.array([0.1, 0.1, 0.01])], max_iter=10, model=model)
+        assert 'must have the same length' in str(context.exception)
+
+    def test_infer_params_multistart(self):
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(
+            functools.partial(
+                sabs_pkpd.load_model.load_simulation_from_mmt,
+                './tests/test resources/pints_problem_def_test.mmt'),
+            data_exp)
+
+        points = sabs_pkpd.pints_problem_def.sample_starting_points(
+            8, [0, 1], [1, 3], sampling='sobol', seed=1)
+        assert points.shape == (8, 2)
+        assert np.all(points >= [0, 1]) and np.all(points < [1, 3])
+
+        completed = []
+        best_parameters, best_value, optima = \
+            sabs_pkpd.pints_problem_def.infer_params_multistart(
+                data_exp, [0, 0], [1, 1], n_starts=4, model=model,
+                n_workers=2, seed=2,
+                callback=lambda k, x, f: completed.append(k))
+        assert sorted(completed) == [0, 1, 2, 3]
+        assert optima.shape == (4, 5)
+        assert np.all(np.diff(optima[:, -1]) >= 0)
+        assert best_value == optima[0, -1]
+        assert np.linalg.norm(best_parameters - np.array([0.1, 0.1])) < 0.01
+
+        # The optimisations still running are stopped once 2 agree, or when
+        # the time budget is exhausted
+        best_parameters, best_value, optima = \
+            sabs_pkpd.pints_problem_def.infer_params_multistart(
+                data_exp, [0, 0], [1, 1], n_starts=4, model=model,
+                n_workers=2, seed=2, n_agree=2)
+        assert 2 <= len(optima) < 4
+        best_parameters, best_value, optima = \
+            sabs_pkpd.pints_problem_def.infer_params_multistart(
+                data_exp, [0, 0], [1, 1], n_starts=2, model=model,
+                n_workers=2, time_budget=0.01)
+        assert best_parameters is None and len(optima) == 0
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.pints_problem_def.sample_starting_points(
+                2, [0], [1], sampling='grid')
+        assert 'lhs' in str(context.exception)
+
+    def test_MCMC_routine_chain_store(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, data_exp)
+        starting_point = [np.array([0.1, 0.1, 0.01]),
+                          np.array([0.12, 0.09, 0.01])]
+
+        directory = tempfile.mkdtemp()
+        try:
+            np.random.seed(1)
+            chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+                starting_point, max_iter=30, adapt_start=10, model=model,
+                chain_store=os.path.join(directory, 'full'))
+            assert chains.shape == (2, 30, 3)
+
+            # A routine interrupted after 20 iterations and resumed gives the
+            # same chains
+            np.random.seed(1)
+            store = sabs_pkpd.chain_store.ChainStore(
+                os.path.join(directory, 'resumed'), 2, 3, chunk_size=7)
+            sabs_pkpd.pints_problem_def.MCMC_routine(
+                starting_point, max_iter=20, adapt_start=10, model=model,
+                chain_store=store, checkpoint_interval=5)
+            np.random.seed(2)
+            resumed = sabs_pkpd.pints_problem_def.MCMC_routine(
+                starting_point, max_iter=30, adapt_start=10, model=model,
+                chain_store=os.path.join(directory, 'resumed'))
+            assert np.array_equal(np.asarray(resumed), np.asarray(chains))
+
+            # The plotting helpers read the chains lazily
+            sabs_pkpd.constants.data_exp = data_exp
+            sabs_pkpd.pints_problem_def.plot_distribution_parameters(
+                resumed, [0, 0, 0], [1, 1, 1], explor_iter=10)
+
+            # The chains cannot be written to CSV files along the store
+            with self.assertRaises(ValueError) as context:
+                sabs_pkpd.pints_problem_def.MCMC_routine(
+                    starting_point, max_iter=30, model=model,
+                    chain_store=os.path.join(directory, 'full'),
+                    chain_filename=os.path.join(directory, 'chain.csv'))
+            assert 'chain store' in str(context.exception)
+
+            # Without a store, the custom loop writes the chains and log pdfs
+            # to the same CSV files as PINTS
+            chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+                starting_point, max_iter=30, model=model,
+                rhat_threshold=1.1, check_interval=1000,
+                chain_filename=os.path.join(directory, 'chain.csv'),
+                pdf_filename=os.path.join(directory, 'pdf.csv'))
+            for i in range(2):
+                chain = np.loadtxt(os.path.join(directory,
+                                                'chain_' + str(i) + '.csv'),
+                                   delimiter=',', skiprows=1)
+                assert np.allclose(chain, chains[i])
+                with open(os.path.join(directory,
+                                       'pdf_' + str(i) + '.csv')) as f:
+                    assert f.readline().strip() == \
+                        '"logposterior","loglikelihood","logprior"'
+                pdfs = np.loadtxt(os.path.join(directory,
+                                               'pdf_' + str(i) + '.csv'),
+                                  delimiter=',', skiprows=1)
+                assert pdfs.shape == (30, 3)
+                assert np.allclose(pdfs[:, 0], pdfs[:, 1] + pdfs[:, 2])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_MCMC_routine_convergence(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, data_exp)
+        starting_point = [np.array([0.1, 0.1, 0.01]),
+                          np.array([0.11, 0.09, 0.02])]
+
+        # The sampling stops once the chains have converged
+        np.random.seed(1)
+        chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+            starting_point, max_iter=20000, adapt_start=200, model=model,
+            rhat_threshold=1.1, ess_target=100, check_interval=100)
+        assert chains.shape[0] == 2 and chains.shape[2] == 3
+        assert 200 < chains.shape[1] < 20000
+        assert chains.shape[1] % 100 == 0
+        assert np.all(pints.rhat(chains[:, 200:]) < 1.2)
+
+    def test_MCMC_routine_delayed_acceptance(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(
+            ['constants.unknown_cst', 'constants.unknown_cst2'],
+            'constants.T',
+            'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, data_exp)
+        starting_point = [np.array([0.1, 0.1, 0.01]),
+                          np.array([0.11, 0.09, 0.02])]
+
+        np.random.seed(1)
+        chains = sabs_pkpd.pints_problem_def.MCMC_routine(
+            starting_point, max_iter=3000, adapt_start=1000, model=model,
+            delayed_acceptance=True, check_interval=1000)
+        assert chains.shape == (2, 3000, 3)
+        assert np.all(np.abs(np.mean(chains[:, 1000:, :2], axis=(0, 1)) -
+                             0.1) < 0.005)
+        assert np.all(pints.rhat(chains[:, 1000:]) < 1.2)
+
     def test_MCMC_routine(self):
         # Set the model annotations for the MCMC routine
         fitting_param_annot = ['ikr.scale_kr', 'ical.scale_cal']
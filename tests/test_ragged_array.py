@@ -0,0 +1,36 @@
+import sabs_pkpd
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_ragged_array(self):
+        ragged = sabs_pkpd.ragged_array.RaggedArray([2, 3, 1])
+        ragged[0] = [1, 2]
+        ragged[1] = np.array([3, 4, 5])
+        ragged[-1] = [6]
+
+        assert len(ragged) == 3
+        assert np.array_equal(ragged.flat, [1, 2, 3, 4, 5, 6])
+        assert np.array_equal(ragged.offsets, [0, 2, 5, 6])
+        assert np.array_equal(ragged.lengths(), [2, 3, 1])
+        assert ragged.tolist() == [[1, 2], [3, 4, 5], [6]]
+        assert [len(x) for x in ragged[1:]] == [3, 1]
+
+        # Items are views on the flat buffer
+        ragged[1][0] = 10
+        assert ragged.flat[2] == 10
+
+        with self.assertRaises(IndexError):
+            ragged[3]
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.ragged_array.RaggedArray([2, 3], flat=np.zeros(4))
+        assert 'does not match the sum' in str(context.exception)
+
+    def test_ragged_array_from_arrays(self):
+        ragged = sabs_pkpd.ragged_array.ragged_array_from_arrays(
+            [np.array([0.5, 1.5]), [2.5]])
+        assert ragged.flat.dtype == np.float64
+        assert np.array_equal(ragged.flat, [0.5, 1.5, 2.5])
+        assert np.array_equal(ragged[0], [0.5, 1.5])
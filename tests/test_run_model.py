@@ -1,6 +1,8 @@
 import sabs_pkpd
 
 import io
+import matplotlib.pyplot as plt
+import pickle
 import pytest
 import numpy as np
 import unittest
@@ -48,6 +50,271 @@ class Test(unittest.TestCase):
                 sabs_pkpd.constants.data_exp)
         assert 'should have the same length' in str(context.exception)
 
+    def test_simulate_data_multi_output(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_multi_output_test.csv',
+            n_outputs=2)
+        params_annot = ['constants.unknown_cst', 'constants.unknown_cst2']
+        data_exp.Add_fitting_instructions(params_annot, 'constants.T',
+                                          ['comp1.y', 'comp1.x'])
+        out = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, data_exp)
+        assert list(out.lengths()) == [16, 16]
+
+        # The read outs are logged together in one simulation
+        for k, read_out in enumerate(['comp1.y', 'comp1.x']):
+            data_exp.Add_fitting_instructions(params_annot, 'constants.T',
+                                              read_out)
+            single = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s,
+                                                       data_exp)
+            for j in range(len(out)):
+                assert np.array_equal(out[j].reshape(-1, 2)[:, k], single[j])
+        assert np.allclose(out.flat.reshape(-1, 2),
+                           np.concatenate(data_exp.values), atol=1e-5)
+
+        # quick_simulate and plot_model_vs_data read out both outputs
+        data_exp.Add_fitting_instructions(params_annot, 'constants.T',
+                                          ['comp1.y', 'comp1.x'])
+        for k in range(len(data_exp.times)):
+            quick = sabs_pkpd.run_model.quick_simulate(
+                s, data_exp.times[k][-1], ['comp1.y', 'comp1.x'],
+                'constants.T', [data_exp.experiment_conds[k]],
+                params_annot, [0.1, 0.1], time_samples=data_exp.times[k])
+            assert list(quick.lengths()) == [16]
+            assert np.allclose(quick[0], out[k], atol=1e-4)
+
+        plt.close('all')
+        sabs_pkpd.run_model.plot_model_vs_data(params_annot, [0.1, 0.1],
+                                               data_exp, s)
+        for k, ax in enumerate(plt.gcf().axes):
+            labels = [line.get_label() for line in ax.lines]
+            assert labels == ['Simulated comp1.y', 'Experimental data comp1.y',
+                              'Simulated comp1.x', 'Experimental data comp1.x']
+            assert np.array_equal(ax.lines[3].get_ydata(),
+                                  data_exp.values[k][:, 1])
+        plt.close('all')
+
+    def test_compile_fitting_plan(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'comp1.y',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+
+        plan = sabs_pkpd.run_model.compile_fitting_plan(data_exp, s)
+        assert plan.state_params == [(1, 0)]
+        assert plan.constant_params == [(0, 'constants.unknown_cst'),
+                                        (2, 'constants.unknown_cst2')]
+        assert plan.exp_conds == list(data_exp.exp_conds)
+        assert len(plan.times) == len(plan.durations) == 2
+
+        # The plan gives the same output as compiling it at each call
+        out_plan = sabs_pkpd.run_model.simulate_data([0.1, 0, 0.1],
+                                                     s,
+                                                     data_exp,
+                                                     plan=plan)
+        out = sabs_pkpd.run_model.simulate_data([0.1, 0, 0.1], s, data_exp)
+        assert np.array_equal(np.array(out_plan), np.array(out))
+
+    def test_compile_fitting_plan_replicates(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        times = [0, 0.01, 0.05, 0.1, 0.3, 0.5, 1, 5]
+        data_exp = sabs_pkpd.load_data.Data_exp(
+            [times, times, times], [times, times, times], [1, 2, 3],
+            [20., 37.], [20., 20., 37.])
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+
+        # Two experiments in the same condition are both simulated
+        plan = sabs_pkpd.run_model.compile_fitting_plan(data_exp, s)
+        assert plan.exp_conds == [20, 20, 37]
+        assert len(plan.times) == len(plan.durations) == 3
+        assert plan.lengths == [8, 8, 8]
+        out = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, data_exp)
+        assert len(out) == 3
+        assert np.array_equal(out[0], out[1])
+        assert not np.array_equal(out[0], out[2])
+
+        data_exp = sabs_pkpd.load_data.Data_exp(
+            [times, times, times], out, [1, 2, 3], [20., 37.],
+            [20., 20., 37.])
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        model = sabs_pkpd.pints_problem_def.ForwardModel(s, data_exp)
+        np.random.seed(19580)
+        found_parameters, found_value = \
+            sabs_pkpd.pints_problem_def.infer_params(
+                [0.5, 0.5], data_exp, [0, 0], [1, 1], model=model,
+                log_to_screen=False)
+        assert np.linalg.norm(found_parameters - 0.1) < 0.01
+
+    def test_condition_pool(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        out = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, data_exp)
+
+        with sabs_pkpd.run_model.ConditionPool(s, n_workers=2) as pool:
+            assert pool.is_available()
+            out_pool = sabs_pkpd.run_model.simulate_data(
+                [0.1, 0.1], s, data_exp, condition_pool=pool)
+            assert list(pool.map(abs, [-1, 2, -3])) == [1, 2, 3]
+        assert np.array_equal(np.array(out_pool), np.array(out))
+
+        # A closed pool falls back to serial simulations
+        assert not pool.is_available()
+        with self.assertRaises(ValueError) as context:
+            pool.map(abs, [-1])
+        assert 'process which created it' in str(context.exception)
+        out_pool = sabs_pkpd.run_model.simulate_data(
+            [0.1, 0.1], s, data_exp, condition_pool=pool)
+        assert np.array_equal(np.array(out_pool), np.array(out))
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.run_model.ConditionPool(s, n_workers=0)
+        assert 'at least one worker' in str(context.exception)
+
+    def test_pre_run_cache(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        out = sabs_pkpd.run_model.simulate_data([0.1, 0.1], s, data_exp,
+                                                pre_run=2)
+
+        cache = sabs_pkpd.run_model.PreRunCache()
+        out_miss = sabs_pkpd.run_model.simulate_data(
+            [0.1, 0.1], s, data_exp, pre_run=2, pre_run_cache=cache)
+        assert (cache.hits, cache.misses, len(cache)) == (0, 2, 2)
+        out_hit = sabs_pkpd.run_model.simulate_data(
+            [0.1, 0.1], s, data_exp, pre_run=2, pre_run_cache=cache)
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert np.array_equal(np.array(out_miss), np.array(out))
+        assert np.array_equal(np.array(out_hit), np.array(out))
+
+        # Changing a constant or the pre-run length misses the cache
+        sabs_pkpd.run_model.simulate_data(
+            [0.2, 0.1], s, data_exp, pre_run=2, pre_run_cache=cache)
+        sabs_pkpd.run_model.simulate_data(
+            [0.1, 0.1], s, data_exp, pre_run=3, pre_run_cache=cache)
+        assert (cache.hits, cache.misses, len(cache)) == (2, 6, 6)
+
+        # The least recently used states are evicted to respect the bound
+        cache.max_bytes = 2 * cache.n_bytes // len(cache)
+        sabs_pkpd.run_model.simulate_data(
+            [0.3, 0.1], s, data_exp, pre_run=2, pre_run_cache=cache)
+        assert len(cache) == 2
+        assert cache.n_bytes <= cache.max_bytes
+
+        cache.clear()
+        assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+    def test_simulation_memo(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        sabs_pkpd.constants.s = s
+        sabs_pkpd.constants.data_exp = data_exp
+        sabs_pkpd.constants.default_state = s.default_state()
+        model = sabs_pkpd.pints_problem_def.MyModel()
+        out = model.simulate([0.1, 0.1], None)
+
+        memo = sabs_pkpd.run_model.SimulationMemo()
+        sabs_pkpd.constants.simulation_memo = memo
+        try:
+            assert np.isnan(memo.hit_rate())
+            assert np.array_equal(model.simulate([0.1, 0.1], None), out)
+            out_hit = model.simulate(np.array([0.1, 0.1]), None)
+            assert np.array_equal(out_hit, out)
+            assert (memo.hits, memo.misses, len(memo)) == (1, 1, 1)
+            assert memo.hit_rate() == 0.5
+
+            # The memoised output is not modified through the returned copy
+            out_hit[:] = 0
+            assert np.array_equal(model.simulate([0.1, 0.1], None), out)
+
+            # Other parameters, data or pre-run miss the memo
+            model.simulate([0.2, 0.1], None)
+            sabs_pkpd.constants.pre_run = 1
+            model.simulate([0.1, 0.1], None)
+            sabs_pkpd.constants.pre_run = 0
+            sabs_pkpd.constants.data_exp = sabs_pkpd.load_data.load_data_file(
+                './tests/test resources/load_data_test.csv')
+            sabs_pkpd.constants.data_exp.Add_fitting_instructions(
+                ['constants.unknown_cst', 'constants.unknown_cst2'],
+                'constants.T',
+                'comp1.y')
+            model.simulate([0.1, 0.1], None)
+            assert (memo.hits, memo.misses, len(memo)) == (2, 4, 4)
+
+            # The least recently used outputs are evicted to respect the bound
+            memo.max_bytes = 2 * memo.n_bytes // len(memo)
+            model.simulate([0.3, 0.1], None)
+            assert len(memo) == 2
+            assert memo.n_bytes <= memo.max_bytes
+
+            # Each process starts with an empty memo
+            copied = pickle.loads(pickle.dumps(memo))
+            assert (copied.hits, copied.misses, len(copied)) == (0, 0, 0)
+            assert copied.max_bytes == memo.max_bytes
+
+            memo.clear()
+            assert (memo.hits, memo.misses, len(memo)) == (0, 0, 0)
+        finally:
+            sabs_pkpd.constants.simulation_memo = None
+            sabs_pkpd.constants.data_exp = data_exp
+
+    def test_sum_of_squares_with_early_stop(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        out = sabs_pkpd.run_model.simulate_data([0.5, 0.5], s, data_exp)
+        expected = np.sum((out.flat - np.concatenate(data_exp.values)) ** 2)
+
+        error, completed = \
+            sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+                [0.5, 0.5], s, data_exp, np.inf, n_chunks=3)
+        assert completed
+        assert np.isclose(error, expected, rtol=1e-3)
+
+        error, completed = \
+            sabs_pkpd.run_model.sum_of_squares_with_early_stop(
+                [0.5, 0.5], s, data_exp, expected / 10, n_chunks=3)
+        assert not completed
+        assert expected / 10 < error <= expected * 1.001
+
     def test_quick_simulate(self):
         s = sabs_pkpd.load_model.load_simulation_from_mmt(
             './tests/test resources/pints_problem_def_test.mmt')
@@ -148,6 +415,90 @@ class Test(unittest.TestCase):
         sabs_pkpd.constants.default_state = None
         test = sabs_pkpd.run_model.quick_simulate(s, time_max, 'comp1.y')
 
+    def test_quick_simulate_batch(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+
+        params_annot = ['constants.unknown_cst', 'constants.unknown_cst2']
+        params_values = np.array([[0.1, 0.1], [0.2, 0.1], [0.1, 0.3]])
+        time_samples = [0, 0.01, 0.05, 0.1, 0.3, 0.5, 1, 5]
+        progress = []
+
+        out = sabs_pkpd.run_model.quick_simulate_batch(
+            s,
+            6,
+            'comp1.y',
+            params_annot,
+            params_values,
+            exp_cond_param_annot='constants.T',
+            exp_cond_param_values=[20, 37],
+            time_samples=time_samples,
+            chunk_size=2,
+            progress=lambda done, total: progress.append((done, total)))
+        assert out.shape == (3, 2, 8)
+        assert out.dtype == np.float64
+        assert progress == [(2, 3), (3, 3)]
+
+        for i in range(3):
+            expected = sabs_pkpd.run_model.quick_simulate(
+                s,
+                6,
+                'comp1.y',
+                exp_cond_param_annot='constants.T',
+                exp_cond_param_values=[20, 37],
+                fixed_params_annot=params_annot,
+                fixed_params_values=list(params_values[i]),
+                time_samples=time_samples)
+            assert np.array_equal(out[i], np.array(expected))
+
+        # Same results when the chunks are spread over worker processes
+        with sabs_pkpd.run_model.ConditionPool(s, n_workers=2) as pool:
+            out_pool = sabs_pkpd.run_model.quick_simulate_batch(
+                s,
+                6,
+                'comp1.y',
+                params_annot,
+                params_values,
+                exp_cond_param_annot='constants.T',
+                exp_cond_param_values=[20, 37],
+                time_samples=time_samples,
+                condition_pool=pool)
+        assert np.array_equal(out, out_pool)
+
+        # Test exceptions
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.run_model.quick_simulate_batch(
+                s, 6, 'comp1.y', params_annot, [0.1, 0.1])
+        assert 'array of shape' in str(context.exception)
+
+    def test_quick_simulate_log_window(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+        time_samples = [3, 3.5, 4, 5]
+
+        full = sabs_pkpd.run_model.quick_simulate(
+            s, 6, 'comp1.y', time_samples=time_samples)
+        window = sabs_pkpd.run_model.quick_simulate(
+            s, 6, 'comp1.y', time_samples=time_samples, log_window=(3, 5))
+        assert np.allclose(window[0], full[0], rtol=1e-4)
+
+        window = sabs_pkpd.run_model.quick_simulate(
+            s, 6, 'comp1.y', log_window=(3, 5))
+        assert len(window[0]) == 100
+
+        # Test exceptions
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.run_model.quick_simulate(
+                s, 6, 'comp1.y', log_window=(3, 7))
+        assert 'The log window must be' in str(context.exception)
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.run_model.quick_simulate(
+                s, 6, 'comp1.y', time_samples=[0, 4], log_window=(3, 5))
+        assert 'within the log window' in str(context.exception)
+
     def test_plot_model_vs_data(self):
         # Load the simulation from the model
         s = sabs_pkpd.load_model.load_simulation_from_mmt(
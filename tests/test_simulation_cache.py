@@ -0,0 +1,57 @@
+import sabs_pkpd
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_simulation_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            models = os.path.join(directory, 'models')
+            os.mkdir(models)
+            filename = os.path.join(models, 'model.mmt')
+            shutil.copy('./tests/test resources/pints_problem_def_test.mmt',
+                        filename)
+
+            cache = sabs_pkpd.simulation_cache.SimulationCache(
+                os.path.join(directory, 'cache'))
+            s = sabs_pkpd.load_model.load_simulation_from_mmt(filename,
+                                                              cache=cache)
+            assert (cache.hits, cache.misses) == (0, 1)
+            s_cached = sabs_pkpd.load_model.load_simulation_from_mmt(
+                filename, cache=cache)
+            assert (cache.hits, cache.misses) == (1, 1)
+            assert sabs_pkpd.constants.default_state == s.default_state()
+            assert np.array_equal(s.run(2)['comp1.y'],
+                                  s_cached.run(2)['comp1.y'])
+
+            # Editing the model builds a new entry
+            key = cache.key(filename)
+            with open(filename, 'a') as f:
+                f.write('\n')
+            assert cache.key(filename) != key
+            assert cache.prewarm(models) == 1
+            assert cache.prewarm(models) == 0
+            assert cache.misses == 2
+
+            # The least recently used entries are evicted
+            cache.max_bytes = cache.n_bytes() - 1
+            cache.evict()
+            assert len(os.listdir(cache.directory)) == 1
+            sabs_pkpd.load_model.load_simulation_from_mmt(filename,
+                                                          cache=cache)
+            assert cache.hits == 2
+
+            cache.clear()
+            assert cache.n_bytes() == 0
+
+            with self.assertRaises(ValueError) as context:
+                sabs_pkpd.simulation_cache.SimulationCache(directory,
+                                                           max_bytes=0)
+            assert 'must be positive' in str(context.exception)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,73 @@
+import sabs_pkpd
+
+import threading
+import numpy as np
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_simulation_pool(self):
+        s = sabs_pkpd.load_model.load_simulation_from_mmt(
+            './tests/test resources/pints_problem_def_test.mmt')
+        sabs_pkpd.constants.default_state = s.default_state()
+        data_exp = sabs_pkpd.load_data.load_data_file(
+            './tests/test resources/load_data_test.csv')
+        data_exp.Add_fitting_instructions(['constants.unknown_cst',
+                                           'constants.unknown_cst2'],
+                                          'constants.T',
+                                          'comp1.y')
+        params = [[0.1, 0.1], [0.2, 0.05], [0.05, 0.3], [0.3, 0.2]]
+        expected = [sabs_pkpd.run_model.simulate_data(p, s, data_exp).flat
+                    for p in params]
+
+        pool = sabs_pkpd.simulation_pool.SimulationPool(s, size=2)
+        assert pool.n_available() == 2
+
+        # Simulations run from several threads give the serial results
+        results = [None] * len(params)
+
+        def fit(k):
+            results[k] = sabs_pkpd.run_model.simulate_data(
+                params[k], pool, data_exp).flat
+
+        threads = [threading.Thread(target=fit, args=(k, ))
+                   for k in range(len(params))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for k in range(len(params)):
+            assert np.array_equal(results[k], expected[k])
+        assert pool.n_available() == 2
+
+        # The constants of a returned simulation are restored
+        with pool.simulation() as sim:
+            sim.set_constant('constants.unknown_cst', 5)
+            sim.run(1)
+        with pool.simulation() as sim:
+            assert sim.time() == 0
+            assert sim.state() == s.default_state()
+            assert np.array_equal(
+                sabs_pkpd.run_model.simulate_data([0.1, 0.1], sim,
+                                                  data_exp).flat,
+                expected[0])
+
+        out = sabs_pkpd.run_model.quick_simulate(
+            pool, 2, 'comp1.y',
+            fixed_params_annot=['constants.unknown_cst'],
+            fixed_params_values=[0.1])
+        assert np.array_equal(out[0], sabs_pkpd.run_model.quick_simulate(
+            s, 2, 'comp1.y',
+            fixed_params_annot=['constants.unknown_cst'],
+            fixed_params_values=[0.1])[0])
+
+        # Checking out more simulations than available times out
+        with pool.simulation(), pool.simulation():
+            with self.assertRaises(TimeoutError):
+                with pool.simulation(timeout=0.01):
+                    pass
+        assert pool.n_available() == 2
+
+        with self.assertRaises(ValueError) as context:
+            sabs_pkpd.simulation_pool.SimulationPool(s, size=0)
+        assert 'at least one simulation' in str(context.exception)